@@ -0,0 +1,170 @@
+"""
+Record and replay of raw OneBusAway responses.
+
+Archives are gzip files of JSON lines, one per response:
+    {"t": <unix time received>, "url": <endpoint>, "status": <code>, "headers": {...}, "body": <text>}
+The recorder appends a new gzip member per flush, so an archive can grow across runs and is never rewritten.
+"""
+
+import gzip
+import json
+import logging
+import threading
+import time
+
+from requests.structures import CaseInsensitiveDict
+
+from StApiResponseHolder import StApiResponseHolder
+
+
+logger = logging.getLogger(__name__)
+
+
+class StApiRecorder:
+    """
+    Captures every response an StApiClient receives into an append-only compressed archive
+    """
+    def __init__(self, api_client, path: str, flush_every: int = 20, flush_interval_sec: float = 300):
+        """
+        :param api_client: The StApiClient to record, anything with add_response_listener() works
+        :param path: Archive file, created if missing and appended to otherwise
+        :param flush_every: Write the buffered records once this many are pending
+        :param flush_interval_sec: Write the buffered records once the oldest has waited this long
+        """
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval_sec = flush_interval_sec
+        self.num_recorded = 0
+        self._pending = []
+        self._oldest_pending = None
+        self._lock = threading.Lock()
+        api_client.add_response_listener(self.record)
+
+    def record(self, endpoint: str, response):
+        """
+        Response listener, buffers one response and flushes if due
+        """
+        line = json.dumps({
+            "t": time.time(),
+            "url": endpoint,
+            "status": response.status_code,
+            # the body is stored decoded, so the transfer headers no longer describe it
+            "headers": {key: value for key, value in response.headers.items()
+                        if key.lower() not in ("content-encoding", "content-length", "transfer-encoding")},
+            "body": response.text if response.status_code != 304 else "",
+        }, separators=(",", ":"))
+        with self._lock:
+            if not self._pending:
+                self._oldest_pending = time.monotonic()
+            self._pending.append(line)
+            self.num_recorded += 1
+            due = (len(self._pending) >= self.flush_every or
+                   time.monotonic() - self._oldest_pending >= self.flush_interval_sec)
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            lines = self._pending
+            self._pending = []
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        with open(self.path, "ab") as f:
+            f.write(gzip.compress(data))
+
+    def close(self):
+        self.flush()
+
+
+class ReplayResponse:
+    """
+    A recorded response, with the parts of requests.Response the rest of the code uses
+    """
+    def __init__(self, record: dict):
+        self.url = record["url"]
+        self.status_code = record["status"]
+        self.headers = CaseInsensitiveDict(record["headers"])
+        self.content = record["body"].encode("utf-8")
+        self.recorded_at = record["t"]
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def read_archive(path: str, start: float = None, end: float = None):
+    """
+    Iterate the records of an archive in the order they were recorded
+    :param path: Archive written by StApiRecorder
+    :param start: Skip records received before this unix time
+    :param end: Stop at the first record received after this unix time
+    :return: Generator of record dicts
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if start is not None and record["t"] < start:
+                continue
+            if end is not None and record["t"] > end:
+                return
+            yield record
+
+
+class StApiReplay:
+    """
+    Feeds an archive back into StApiResponseHolders, at the recorded pace, sped up, or as fast as possible.  Holders
+    are registered by route exactly like on StApiClient.
+    """
+    def __init__(self, path: str, speed: float = 1.0):
+        """
+        :param path: Archive written by StApiRecorder
+        :param speed: 1.0 replays in real time, N replays N times faster, 0 replays as fast as possible
+        """
+        self.path = path
+        self.speed = speed
+        self.endpoints = {}
+
+    def add_trips_for_route_query(self, route: str, response_holder: StApiResponseHolder):
+        # match on the path only, so archives recorded against another server (e.g. a local stub) still replay
+        self.endpoints[f"/trips-for-route/{route}.json"] = response_holder
+
+    def _holder_for(self, url: str):
+        for suffix, holder in self.endpoints.items():
+            if url.endswith(suffix):
+                return holder
+        return None
+
+    def play(self, on_response=None, start: float = None, end: float = None) -> int:
+        """
+        Replay the archive into the registered holders.  Each holder gets the recorded receive time as its
+        timestamp.  304s and 429s are skipped because the live client never hands those to a holder either.
+        :param on_response: Called as on_response(response) after each response lands in its holder, e.g. to render
+        :param start: Only replay records received at or after this unix time
+        :param end: Only replay records received at or before this unix time
+        :return: Number of responses replayed
+        """
+        count = 0
+        first_recorded = None
+        started = time.monotonic()
+        for record in read_archive(self.path, start, end):
+            holder = self._holder_for(record["url"])
+            if holder is None or record["status"] in (304, 429):
+                continue
+            if first_recorded is None:
+                first_recorded = record["t"]
+            if self.speed:
+                delay = (record["t"] - first_recorded) / self.speed - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            response = ReplayResponse(record)
+            holder.set_response(response, timestamp=record["t"])
+            count += 1
+            if on_response is not None:
+                on_response(response)
+        return count
@@ -1,12 +1,11 @@
 import logging
-from datetime import datetime
-from email.utils import parsedate_to_datetime
-
-import requests
-import validators
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from StApiResponseHolder import StApiResponseHolder
-from TsNeopixel import TsNeopixel
+from StApiTransport import StApiTransport
+from TsMetrics import TsMetrics
+from TsScheduler import TsPollScheduler, parse_retry_after
 
 
 logger = logging.getLogger(__name__)
@@ -15,12 +14,47 @@ class StApiClient:
     AGENCY_ST_ID = "40"
     ROUTE_1_LINE_ID = "40_100479"
     ROUTE_2_LINE_ID = "40_2LINE"
-    BASE_URL = "https://api.pugetsound.onebusaway.org/api/where"
+    # OBA_BASE_URL points the client at another server, such as testing/stub_server.py
+    BASE_URL = os.getenv("OBA_BASE_URL", "https://api.pugetsound.onebusaway.org/api/where")
+
+    MAX_FETCH_WORKERS = 8
 
-    def __init__(self, api_key: str):
+    def __init__(
+            self,
+            api_key: str,
+            concurrent: bool = False,
+            transport: StApiTransport = None,
+            scheduler: TsPollScheduler = None):
+        """
+        :param api_key: OneBusAway API key
+        :param concurrent: If True, every registered endpoint is queried in parallel on update() instead of one
+            after another
+        :param transport: HTTP transport to use, a default pooled StApiTransport is created if None
+        :param scheduler: Rate limiting, backoff and poll alignment.  If None, fetch() only reports Retry-After.
+        """
         self.endpoints = {}
         self.neopixels = {}
         self.api_key = api_key
+        self.concurrent = concurrent
+        self.transport = transport if transport is not None else StApiTransport(pool_maxsize=self.MAX_FETCH_WORKERS)
+        self.scheduler = scheduler
+        self.metrics = TsMetrics.shared()
+        self.response_listeners = []
+        self._executor = None
+
+    @staticmethod
+    def route_for_endpoint(endpoint: str) -> str:
+        """
+        :return: The route a Trips For Route URL queries, used to label metrics
+        """
+        return endpoint.rsplit("/", 1)[-1].removesuffix(".json")
+
+    @classmethod
+    def endpoint_for_route(cls, route: str) -> str:
+        """
+        :return: The Trips For Route URL queried for a route
+        """
+        return cls.BASE_URL + f"/trips-for-route/{route}.json"
 
     def add_trips_for_route_query(self, route: str, response_holder: StApiResponseHolder):
         """
@@ -30,49 +64,165 @@ class StApiClient:
             every update()
         :return: None
         """
-        endpoint = f"/trips-for-route/{route}.json"
-        new_url = self.BASE_URL + endpoint
+        import validators  # only needed here, kept off the startup path
+
+        new_url = self.endpoint_for_route(route)
         if not validators.url(new_url):
             raise ValueError("Invalid route")
         self.endpoints[new_url] = response_holder
 
-    def add_neopixel(self, neopixel: TsNeopixel, response_holder: StApiResponseHolder):
+    def add_neopixel(self, neopixel, response_holder: StApiResponseHolder):
+        """
+        :param neopixel: A line to render, a TsNeopixelLine or a TsHeadlessLine
+        """
         self.neopixels[neopixel] = response_holder
 
-    def update(self):
-        params = {'key': self.api_key, 'includeStatus': 'true'}
+    def add_response_listener(self, listener):
+        """
+        Register a callback that sees every raw response the server sends, before any handling
+        :param listener: Called as listener(endpoint, response), possibly from a fetch worker thread
+        :return: None
+        """
+        self.response_listeners.append(listener)
+
+    def _fetch_endpoint(self, endpoint: str, container: StApiResponseHolder, params: dict) -> float:
+        """
+        Query a single endpoint and store the result in its response holder
+        :param endpoint: The URL to query
+        :param container: The StApiResponseHolder to populate
+        :param params: Query parameters to send with the request
+        :return: Seconds the server has asked us to wait, 0 if none
+        """
+        if self.scheduler is not None and not self.scheduler.acquire(timeout=self.transport.timeout[1]):
+            logger.warning(f"Request budget exhausted, skipping {endpoint}")
+            return 0
+        route = self.route_for_endpoint(endpoint)
+        self.metrics.inc("ts_http_requests_total", route=route)
+        with self.metrics.timer("ts_stage_seconds", stage="http", route=route):
+            response = self.transport.get(endpoint, params=params)
+        if response is None:
+            self.metrics.inc("ts_http_failures_total", route=route)
+            logger.error(f"Server did not respond!")
+            if self.scheduler is not None:
+                self.scheduler.record_error()
+            return 0
+        for listener in self.response_listeners:
+            try:
+                listener(endpoint, response)
+            except Exception as e:
+                logger.error(f"Response listener failed: {e}")
+        self.metrics.inc("ts_http_responses_total", route=route, code=response.status_code)
+        if response.status_code == 304:
+            # Nothing changed since the last poll, leave the holder alone so the lines don't re-parse it
+            logger.debug(f"{endpoint} not modified")
+            if self.scheduler is not None:
+                self.scheduler.record_success(endpoint)
+            return 0
+        if response.status_code != 200:
+            logger.error(f"{endpoint} returned code {response.status_code}")
+            if response.status_code == 429:
+                self.metrics.inc("ts_http_rate_limited_total", route=route)
+                retry_after = response.headers.get("Retry-After")
+                if self.scheduler is not None:
+                    wait_seconds = self.scheduler.record_retry_after(retry_after)
+                else:
+                    wait_seconds = parse_retry_after(retry_after)
+                    if wait_seconds is None: # assume a 60 second backoff
+                        logger.error(f"Could not understand 'Retry-After' of {retry_after!r}.  Retrying in 60s")
+                        wait_seconds = 60
+                logger.error(f"Server says to retry after {wait_seconds:.0f} seconds.")
+                return wait_seconds
+            if response.status_code >= 500 and self.scheduler is not None:
+                self.scheduler.record_error()
+
+        container.set_response(response)
+        if response.status_code == 200 and self.scheduler is not None:
+            # decoding here also warms the holder's cache, so the render stage doesn't have to
+            try:
+                feed = container.get_feed(response)
+            except Exception as e:
+                logger.error(f"Unable to decode response from {endpoint}: {e}")
+                feed = None
+            self.scheduler.record_success(endpoint, feed)
+        return 0
+
+    def _fetch_all_serial(self, params: dict) -> float:
         for endpoint, container in self.endpoints.items():
-            response = requests.get(endpoint, params=params)
-            if response is None:
-                logger.error(f"Server did not respond!")
-                return 0
-            if response.status_code != 200:
-                logger.error(f"{endpoint} returned code {response.status_code}")
-                if response.status_code == 429:
-                    try:
-                        retry_after = response.headers.get("Retry-After")
-                        if retry_after:
-                            # Try interpreting it as seconds
-                            wait_seconds = int(retry_after)
-                            logger.error(f"Server says to retry after {wait_seconds} seconds.")
-                            return wait_seconds
-                        else: # assume a 60 second backoff
-                            logger.error(f"Could not find 'Retry-After' header.  Retrying in 60s")
-                            return 60
-                    except ValueError:
-                        # If not an integer, try parsing it as a date
-                        # TODO
-                        logger.error(f"Server says to retry after certain date, TODO: need to handle this")
-                        return 0
-
-            container.set_response(response)
-        wait_seconds = 0
-        for line in self.neopixels.keys():
-            wait_seconds = line.update()
+            wait_seconds = self._fetch_endpoint(endpoint, container, params)
             if wait_seconds != 0:
                 return wait_seconds
         return 0
 
+    def _fetch_all_concurrent(self, params: dict) -> float:
+        # Every endpoint is in flight at once, and each holder is filled as soon as its own response lands, so one
+        # slow route no longer holds up the others.  The longest requested backoff wins.
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=max(1, min(len(self.endpoints), self.MAX_FETCH_WORKERS)),
+                thread_name_prefix="StApiFetch"
+            )
+        futures = {
+            self._executor.submit(self._fetch_endpoint, endpoint, container, params): endpoint
+            for endpoint, container in self.endpoints.items()
+        }
+        wait_seconds = 0
+        for future in as_completed(futures):
+            try:
+                wait_seconds = max(wait_seconds, future.result())
+            except Exception as e:
+                logger.error(f"Fetching {futures[future]} failed: {e}")
+        return wait_seconds
+
+    def _fetch_all(self) -> float:
+        params = {'key': self.api_key, 'includeStatus': 'true'}
+        if self.concurrent and len(self.endpoints) > 1:
+            return self._fetch_all_concurrent(params)
+        return self._fetch_all_serial(params)
+
+    def fetch(self) -> float:
+        """
+        Query every endpoint and populate the response holders.  Does not touch the lines.
+        :return: Seconds to wait before the next fetch: what the scheduler decides if there is one, otherwise what
+            the server asked for (0 if nothing)
+        """
+        wait_seconds = self._fetch_all()
+        if self.scheduler is not None:
+            return max(wait_seconds, self.scheduler.next_delay())
+        return wait_seconds
+
+    def render(self):
+        """
+        Update every registered line from whatever is currently in its response holder
+        :return: The longest wait any line asked for, 0 if none did
+        """
+        wait_seconds = 0
+        for line in self.neopixels.keys():
+            wait_seconds = max(wait_seconds, line.update() or 0)
+        return wait_seconds
+
+    def update(self):
+        """
+        fetch() then render(), for callers that poll and draw on one thread
+        :return: Seconds to wait before the next update, paced by the scheduler the same way as fetch()
+        """
+        wait_seconds = self.fetch()
+        return max(wait_seconds, self.render())
+
+    def get_latency_stats(self, route: str = None):
+        """
+        :param route: Route to get latency statistics for, or None for every endpoint
+        :return: See StApiTransport.get_stats()
+        """
+        if route is None:
+            return self.transport.get_stats()
+        return self.transport.get_stats(self.endpoint_for_route(route))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self.transport.close()
+
 
     # closest station and displacement are how this works
     # maybe have a LED in between stations?
@@ -0,0 +1,105 @@
+import json
+import logging
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:  # optional, the stdlib parser is used if it isn't installed
+    orjson = None
+    _loads = json.loads
+
+
+logger = logging.getLogger(__name__)
+
+class TrainRecord:
+    """
+    The handful of fields the lines use from one entry of a trips-for-route 'data.list'
+    """
+    __slots__ = ("trip_id", "next_stop", "next_stop_offset", "stop_times", "last_update_time", "distance_along_trip",
+                 "total_distance_along_trip")
+
+    def __init__(self, trip_id: str, next_stop: str, next_stop_offset: int, stop_times: tuple,
+                 last_update_time: int = 0, distance_along_trip: float = None, total_distance_along_trip: float = None):
+        self.trip_id = trip_id
+        self.next_stop = next_stop
+        self.next_stop_offset = next_stop_offset
+        # ((stopId, arrivalTime, departureTime, distanceAlongTrip), ...) in trip order
+        self.stop_times = stop_times
+        # server time (ms) of the last real-time update for this train, 0 if unknown
+        self.last_update_time = last_update_time
+        # meters travelled along the trip and the trip's full length, None if the server didn't say
+        self.distance_along_trip = distance_along_trip
+        self.total_distance_along_trip = total_distance_along_trip
+
+
+class TripsForRoute:
+    """
+    Compact form of a trips-for-route response: the trains plus the stop names and trip directions they reference
+    """
+    __slots__ = ("current_time", "trains", "stops", "trips", "num_skipped")
+
+    def __init__(self, current_time: int, trains: list, stops: dict, trips: dict, num_skipped: int = 0):
+        self.current_time = current_time
+        self.trains = trains
+        self.stops = stops          # stop id -> name
+        self.trips = trips          # trip id -> directionId
+        self.num_skipped = num_skipped
+
+
+def extract_trips_for_route(body: dict) -> TripsForRoute:
+    """
+    Pull the required fields out of an already decoded trips-for-route body.  Trains without a status or next stop
+    can't be placed, and malformed ones are left out; both are counted in num_skipped instead.
+    :param body: The response body as returned by json
+    :return: The compact records
+    """
+    data = body['data']
+    references = data['references']
+    stops = {stop['id']: stop['name'] for stop in references['stops']}
+    trips = {trip['id']: int(trip['directionId']) for trip in references['trips']}
+
+    trains = []
+    num_skipped = 0
+    for train in data['list']:
+        try:
+            status = train.get('status')
+            if not status or not status.get('nextStop'):
+                num_skipped += 1
+                continue
+            schedule = train.get('schedule') or {}
+            stop_times = tuple(
+                (stop_time['stopId'], stop_time['arrivalTime'], stop_time['departureTime'],
+                 stop_time.get('distanceAlongTrip'))
+                for stop_time in schedule.get('stopTimes', ())
+            )
+            trains.append(TrainRecord(train['tripId'], status['nextStop'], status['nextStopTimeOffset'], stop_times,
+                                      status.get('lastUpdateTime') or 0, status.get('distanceAlongTrip'),
+                                      status.get('totalDistanceAlongTrip')))
+        except (KeyError, TypeError, AttributeError) as e:
+            # one malformed train shouldn't cost the whole poll
+            trip_id = train.get('tripId') if isinstance(train, dict) else None
+            logger.warning(f"Skipping malformed train {trip_id}: {e!r}")
+            num_skipped += 1
+    return TripsForRoute(body.get('currentTime', 0), trains, stops, trips, num_skipped)
+
+
+def decode_trips_for_route(content: bytes) -> TripsForRoute:
+    """
+    Selective decode of a raw trips-for-route payload.  Uses orjson when it's installed, the intermediate document is
+    dropped as soon as the records are extracted so only the compact form outlives the call.
+    :param content: Raw response body
+    :return: The compact records
+    """
+    return extract_trips_for_route(_loads(content))
+
+
+def decode_response(response, selective: bool = True) -> TripsForRoute:
+    """
+    :param response: A requests.Response (or anything with .content and .json())
+    :param selective: If True and orjson is installed, use decode_trips_for_route() on the raw bytes, otherwise go
+        through response.json(), which is as fast as the stdlib parser gets
+    :return: The compact records
+    """
+    if selective and orjson is not None:
+        return decode_trips_for_route(response.content)
+    return extract_trips_for_route(response.json())
@@ -1,18 +1,73 @@
+import threading
 import time
-import requests
+
+from StApiDecoder import TripsForRoute, decode_response
+from TsMetrics import TsMetrics
 
 class StApiResponseHolder:
-    def __init__(self):
+    """
+    Latest-value slot between the fetch stage and the render stage.  The fetcher overwrites the response, readers
+    always see the newest one, and nothing ever queues up behind a slow consumer.
+    """
+    def __init__(self, selective_decode: bool = True):
+        """
+        :param selective_decode: Decode responses with StApiDecoder's selective path instead of response.json()
+        """
         self._response = None
         self._timestamp = 0
+        self.selective_decode = selective_decode
+        self._decoded_response = None
+        self._decoded = None
+        # set_response() is called from fetch worker threads, readers may be on the render thread
+        self._lock = threading.Condition()
+
+    def set_response(self, response, timestamp: float = None):
+        """
+        :param response: The newest response
+        :param timestamp: When the response was received, defaults to now.  Replays pass the recorded time.
+        """
+        with self._lock:
+            self._response = response
+            self._timestamp = time.time() if timestamp is None else timestamp
+            self._lock.notify_all()
 
-    def set_response(self, response):
-        self._response = response
-        self._timestamp = time.time()
+    def get_snapshot(self):
+        """
+        :return: (response, timestamp) read together, so they always belong to the same poll
+        """
+        with self._lock:
+            return self._response, self._timestamp
 
-    def get_response(self) -> requests.Response:
+    def wait_for_update(self, since_timestamp: float, timeout: float = None) -> bool:
+        """
+        Block until a response newer than since_timestamp has been set
+        :param since_timestamp: Timestamp of the last response the caller has seen
+        :param timeout: Maximum seconds to wait, None to wait forever
+        :return: True if a newer response is available
+        """
+        with self._lock:
+            return self._lock.wait_for(lambda: self._timestamp != since_timestamp, timeout)
+
+    def get_response(self) -> "requests.Response":
         return self._response
 
     def get_timestamp(self):
         return self._timestamp
 
+    def get_feed(self, response) -> TripsForRoute:
+        """
+        Decode a response into compact records.  The result is cached, so lines sharing this holder decode each
+        response only once.
+        :param response: A response obtained from get_snapshot()
+        :return: The decoded TripsForRoute
+        """
+        with self._lock:
+            if self._decoded_response is response:
+                return self._decoded
+        with TsMetrics.shared().timer("ts_stage_seconds", stage="decode"):
+            decoded = decode_response(response, self.selective_decode)
+        with self._lock:
+            self._decoded_response = response
+            self._decoded = decoded
+        return decoded
+
@@ -0,0 +1,153 @@
+import logging
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+logger = logging.getLogger(__name__)
+
+class EndpointStats:
+    """
+    Rolling latency statistics for a single endpoint.  Latencies are in seconds.
+    """
+    NUM_RECENT_SAMPLES = 128
+    EWMA_ALPHA = 0.2
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.not_modified = 0
+        self.last = 0.0
+        self.min = None
+        self.max = 0.0
+        self.total = 0.0
+        self.ewma = None
+        self._recent = deque(maxlen=self.NUM_RECENT_SAMPLES)
+
+    def record(self, latency: float):
+        self.requests += 1
+        self.last = latency
+        self.total += latency
+        self.min = latency if self.min is None else min(self.min, latency)
+        self.max = max(self.max, latency)
+        self.ewma = latency if self.ewma is None else self.ewma + self.EWMA_ALPHA * (latency - self.ewma)
+        self._recent.append(latency)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.requests if self.requests else 0.0
+
+    def percentile(self, pct: float) -> float:
+        """
+        :param pct: Percentile in [0, 100]
+        :return: The given percentile over the most recent NUM_RECENT_SAMPLES requests
+        """
+        if not self._recent:
+            return 0.0
+        ordered = sorted(self._recent)
+        idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+        return ordered[idx]
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "not_modified": self.not_modified,
+            "last": self.last,
+            "min": self.min or 0.0,
+            "max": self.max,
+            "mean": self.mean,
+            "ewma": self.ewma or 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+        }
+
+
+class StApiTransport:
+    """
+    Persistent, pooled HTTP layer for StApiClient.
+
+    A single requests.Session keeps connections to the API host alive between polls so we don't pay for a new TLS
+    handshake every update.  Every request has a connect and read timeout, and responses are revalidated with
+    ETag/If-Modified-Since so an unchanged payload comes back as a bodiless 304.
+    """
+    DEFAULT_CONNECT_TIMEOUT = 3.05
+    DEFAULT_READ_TIMEOUT = 10.0
+
+    def __init__(
+            self,
+            connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+            read_timeout: float = DEFAULT_READ_TIMEOUT,
+            pool_maxsize: int = 8,
+            conditional: bool = True):
+        """
+        :param connect_timeout: Seconds to wait for a connection to be established
+        :param read_timeout: Seconds to wait between bytes from the server
+        :param pool_maxsize: Maximum number of pooled connections per host
+        :param conditional: If True, send If-None-Match/If-Modified-Since using the last response's validators
+        """
+        self.timeout = (connect_timeout, read_timeout)
+        self.conditional = conditional
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate", "Accept": "application/json"})
+        self._validators = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def get(self, url: str, params: dict = None):
+        """
+        Issue a GET on the pooled session
+        :param url: URL to query
+        :param params: Query parameters
+        :return: The requests.Response, or None if the request failed or timed out
+        """
+        headers = {}
+        if self.conditional:
+            with self._lock:
+                etag, last_modified = self._validators.get(url, (None, None))
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        start = time.monotonic()
+        try:
+            response = self.session.get(url, params=params, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            logger.error(f"Request to {url} failed: {e}")
+            with self._lock:
+                stats = self._stats.setdefault(url, EndpointStats())
+                stats.record(time.monotonic() - start)
+                stats.errors += 1
+            return None
+        latency = time.monotonic() - start
+
+        with self._lock:
+            stats = self._stats.setdefault(url, EndpointStats())
+            stats.record(latency)
+            if response.status_code == 304:
+                stats.not_modified += 1
+            elif response.status_code == 200:
+                self._validators[url] = (response.headers.get("ETag"), response.headers.get("Last-Modified"))
+            else:
+                stats.errors += 1
+        return response
+
+    def get_stats(self, url: str = None):
+        """
+        :param url: Endpoint to get statistics for, or None for all of them
+        :return: A dict of statistics for the endpoint, or a dict of URL to statistics
+        """
+        with self._lock:
+            if url is not None:
+                return self._stats.get(url, EndpointStats()).as_dict()
+            return {endpoint: stats.as_dict() for endpoint, stats in self._stats.items()}
+
+    def close(self):
+        self.session.close()
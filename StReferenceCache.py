@@ -0,0 +1,255 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+class StReferenceCache:
+    """
+    Process-wide registry of reference data (stop names, trip directions and per-trip travel times) that the
+    responses of every route are merged into, so lines share one copy of a stop however many routes reference it.
+    Stop metadata and trip schedules hardly change within a service day, so each poll only adds what appeared and
+    refreshes the last-seen time of what is still there.
+
+    Stop ids, stop names and trip ids are interned: each distinct string is kept once and given a small integer
+    handle, and the tables refer to each other by handle.  A handle is released, and later reused, once no table
+    refers to it any more, so memory grows with the stops and trips currently in service, not with routes or polls.
+
+    Every table is an LRU ordered by last sighting: entries not seen for ttl_sec are evicted, and each table is
+    capped at max_entries, so memory stays bounded over weeks of uptime.
+    """
+    DEFAULT_TTL_SEC = 6 * 60 * 60
+    DEFAULT_MAX_ENTRIES = 4096
+
+    _shared = None
+
+    def __init__(self, ttl_sec: float = DEFAULT_TTL_SEC, max_entries: int = DEFAULT_MAX_ENTRIES):
+        """
+        :param ttl_sec: Seconds after its last sighting that an entry is dropped
+        :param max_entries: Maximum entries per table, least recently seen entries are dropped first
+        """
+        self.ttl_sec = ttl_sec
+        self.max_entries = max_entries
+        self._handles = {}                    # string -> handle
+        self._strings = []                    # handle -> string, None once released
+        self._refs = []                       # handle -> table keys and values referring to it
+        self._free = []                       # released handles, reused first
+        self._stop_names = OrderedDict()      # stop handle -> [name handle, last seen]
+        self._trip_directions = OrderedDict() # trip handle -> [direction, last seen]
+        self._travel_times = OrderedDict()    # trip handle -> [{stop handle: travel time}, last seen]
+        self._lock = threading.RLock()
+
+    @classmethod
+    def shared(cls) -> "StReferenceCache":
+        """
+        :return: The process-wide cache used by lines that aren't given their own
+        """
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def _acquire(self, string: str) -> int:
+        """
+        :return: The handle of string, interning it if needed, with one more reference counted against it
+        """
+        handle = self._handles.get(string)
+        if handle is None:
+            if self._free:
+                handle = self._free.pop()
+                self._strings[handle] = string
+            else:
+                handle = len(self._strings)
+                self._strings.append(string)
+                self._refs.append(0)
+            self._handles[string] = handle
+        self._refs[handle] += 1
+        return handle
+
+    def _release(self, handle: int):
+        self._refs[handle] -= 1
+        if not self._refs[handle]:
+            del self._handles[self._strings[handle]]
+            self._strings[handle] = None
+            self._free.append(handle)
+
+    def _release_travel_times(self, travel_times: dict):
+        for stop in travel_times:
+            self._release(stop)
+
+    def _evict(self, table: OrderedDict, now: float, release_value=None):
+        # entries are ordered by last sighting, so expired ones are always at the front
+        oldest_allowed = now - self.ttl_sec
+        while table:
+            key, entry = next(iter(table.items()))
+            if entry[1] >= oldest_allowed and len(table) <= self.max_entries:
+                break
+            del table[key]
+            self._release(key)
+            if release_value is not None:
+                release_value(entry[0])
+
+    def handle(self, string: str):
+        """
+        :return: The handle of an interned stop id, stop name or trip id, or None if no table refers to it
+        """
+        return self._handles.get(string)
+
+    def string(self, handle: int):
+        """
+        :return: The stop id, stop name or trip id a handle stands for, or None if it has been released
+        """
+        with self._lock:
+            return self._strings[handle] if 0 <= handle < len(self._strings) else None
+
+    def merge_stops(self, stops: dict, now: float = None) -> int:
+        """
+        :param stops: Stop ID to name, from the references of a response
+        :param now: Time of the sighting, defaults to time.time()
+        :return: Number of stops that weren't cached yet
+        """
+        now = time.time() if now is None else now
+        added = 0
+        with self._lock:
+            table = self._stop_names
+            for stop_id, name in stops.items():
+                stop = self._handles.get(stop_id)
+                entry = None if stop is None else table.get(stop)
+                if entry is None:
+                    table[self._acquire(stop_id)] = [self._acquire(name), now]
+                    added += 1
+                    continue
+                if self._strings[entry[0]] != name:
+                    old_name = entry[0]
+                    entry[0] = self._acquire(name)
+                    self._release(old_name)
+                entry[1] = now
+                table.move_to_end(stop)
+            self._evict(table, now, self._release)
+        return added
+
+    def merge_trips(self, trips: dict, now: float = None) -> int:
+        """
+        :param trips: Trip ID to directionId, from the references of a response
+        :param now: Time of the sighting, defaults to time.time()
+        :return: Number of trips that weren't cached yet
+        """
+        now = time.time() if now is None else now
+        added = 0
+        with self._lock:
+            table = self._trip_directions
+            for trip_id, direction in trips.items():
+                trip = self._handles.get(trip_id)
+                entry = None if trip is None else table.get(trip)
+                if entry is None:
+                    table[self._acquire(trip_id)] = [direction, now]
+                    added += 1
+                    continue
+                entry[0] = direction
+                entry[1] = now
+                table.move_to_end(trip)
+            self._evict(table, now)
+            self._evict(self._travel_times, now, self._release_travel_times)
+        return added
+
+    def stop_name(self, stop_id: str):
+        """
+        :return: The name of the stop, or None if it isn't cached
+        """
+        with self._lock:
+            stop = self._handles.get(stop_id)
+            entry = None if stop is None else self._stop_names.get(stop)
+            return None if entry is None else self._strings[entry[0]]
+
+    def trip_direction(self, trip_id: str):
+        """
+        :return: The directionId of the trip (0 = south, 1 = north), or None if it isn't cached
+        """
+        with self._lock:
+            trip = self._handles.get(trip_id)
+            entry = None if trip is None else self._trip_directions.get(trip)
+            return None if entry is None else entry[0]
+
+    def travel_time(self, trip_id: str, stop_id: str, train_schedule: tuple = None, now: float = None):
+        """
+        Scheduled travel time of a trip into one of its stops, i.e. the time from the previous stop's arrival
+        :param trip_id: Trip to look up
+        :param stop_id: Stop the trip is travelling to
+        :param train_schedule: The trip's (stopId, arrivalTime, departureTime, distanceAlongTrip) tuples, used to
+            build its table if it isn't cached yet
+        :param now: Time of the sighting, defaults to time.time()
+        :return: Travel time in seconds, never 0, or None if unknown
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            trip = self._handles.get(trip_id)
+            entry = None if trip is None else self._travel_times.get(trip)
+            if entry is None:
+                if not train_schedule:
+                    return None
+                trip = self._acquire(trip_id)
+                entry = [self._intern_travel_times(self._build_travel_times(train_schedule)), now]
+                self._travel_times[trip] = entry
+                self._evict(self._travel_times, now, self._release_travel_times)
+            else:
+                entry[1] = now
+                self._travel_times.move_to_end(trip)
+            stop = self._handles.get(stop_id)
+            return None if stop is None else entry[0].get(stop)
+
+    def _intern_travel_times(self, travel_times: dict) -> dict:
+        return {self._acquire(stop_id): travel_time for stop_id, travel_time in travel_times.items()}
+
+    @staticmethod
+    def _build_travel_times(train_schedule: tuple) -> dict:
+        travel_times = {}
+        # The zeroth stop is the beginning of the run, so shouldn't have "travel time", instead use the boarding time
+        first_stop_id, first_arrival, first_departure = train_schedule[0][:3]
+        travel_times[first_stop_id] = (first_departure - first_arrival) or 1 # defend against div by zero
+        for stop_idx in range(1, len(train_schedule)):
+            travel_times[train_schedule[stop_idx][0]] = (
+                    train_schedule[stop_idx][1] - train_schedule[stop_idx - 1][1]) or 1 # defend against div by zero
+        return travel_times
+
+    def export_state(self) -> dict:
+        """
+        :return: Every table as JSON-friendly lists of [key, value, last seen], least recently seen first, with the
+            handles spelled out as the strings they stand for
+        """
+        with self._lock:
+            strings = self._strings
+            return {
+                "stops": [[strings[key], strings[entry[0]], entry[1]] for key, entry in self._stop_names.items()],
+                "trips": [[strings[key], entry[0], entry[1]] for key, entry in self._trip_directions.items()],
+                "travel_times": [[strings[key], {strings[stop]: seconds for stop, seconds in entry[0].items()},
+                                  entry[1]] for key, entry in self._travel_times.items()],
+            }
+
+    def restore_state(self, state: dict, now: float = None):
+        """
+        Load tables saved by export_state().  Entries keep their saved last-seen times, so ones that have expired
+        since are dropped, and entries already in the cache win over saved ones.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            for table, rows, intern_value, release_value in (
+                    (self._stop_names, state.get("stops", ()), self._acquire, self._release),
+                    (self._trip_directions, state.get("trips", ()), None, None),
+                    (self._travel_times, state.get("travel_times", ()), self._intern_travel_times,
+                     self._release_travel_times)):
+                for key, value, last_seen in rows:
+                    if self._handles.get(key) not in table:
+                        table[self._acquire(key)] = [intern_value(value) if intern_value else value, last_seen]
+                # eviction relies on the tables being ordered by last sighting
+                for key, _ in sorted(table.items(), key=lambda item: item[1][1]):
+                    table.move_to_end(key)
+                self._evict(table, now, release_value)
+
+    def sizes(self) -> dict:
+        return {
+            "stops": len(self._stop_names),
+            "trips": len(self._trip_directions),
+            "travel_times": len(self._travel_times),
+            "strings": len(self._handles),
+        }
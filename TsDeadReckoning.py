@@ -0,0 +1,152 @@
+import logging
+
+from StReferenceCache import StReferenceCache
+from TsDistanceIndex import TsDistanceIndex
+from TsLayout import TsLayout
+from TsPositionEngine import NO_PIXEL, PositionBatch
+
+
+logger = logging.getLogger(__name__)
+
+_FOREVER = float("inf")
+
+
+class _Plan:
+    """
+    Where one train is expected to be after the poll it was seen in.  Each leg is a station on the strip the train
+    runs into, as (seconds after the poll it arrives, seconds after the poll it leaves, station pixel, scheduled
+    travel time into it, distanceAlongTrip of the station or None).  The train stays at the last leg for good.
+    """
+    __slots__ = ("trip_id", "direction", "legs", "start_distance", "stop_times")
+
+    def __init__(self, trip_id: str, direction: int, legs: list, start_distance, stop_times: tuple):
+        self.trip_id = trip_id
+        self.direction = direction
+        self.legs = legs
+        self.start_distance = start_distance
+        self.stop_times = stop_times
+
+
+class TsDeadReckoner:
+    """
+    Moves trains along between polls, so the strip shows motion even when the API is only polled every 30-60 s.
+
+    After every poll each train gets a plan: its observed time to the next stop, followed by the scheduled run and
+    dwell times of the stations on the strip after it, all counted from when the response was received.  At render
+    time the plans are evaluated at the time since then and fed through the same TsPositionEngine as a poll, so the
+    segment thresholds, station detection and the no-going-backwards clamp against the trip state all apply.  The
+    next poll replaces the plans; the clamp keeps a train that was predicted slightly ahead from stepping back,
+    while a server position further away wins outright.
+
+    Plans stop advancing horizon_sec after the poll, so trains don't run on ahead of a feed that has gone quiet.
+    """
+    def __init__(
+            self,
+            layout: TsLayout,
+            reference_cache: StReferenceCache,
+            horizon_sec: float = 90.0,
+            distance_index: TsDistanceIndex = None):
+        """
+        :param horizon_sec: Seconds after a poll past which trains are held where they are
+        :param distance_index: If given, trains placed by distance are moved by interpolating the distances between
+            stations rather than through the segment thresholds
+        """
+        self.layout = layout
+        self.reference_cache = reference_cache
+        self.horizon_sec = horizon_sec
+        self.distance_index = distance_index
+        self.plans = []
+        self._observed_at = 0.0
+        self._finished = True
+
+    def begin(self, observed_at: float, now: float):
+        """
+        Drop the old plans for a new poll
+        :param observed_at: Local unix time the response was received
+        :param now: Local unix time it is being processed
+        """
+        # a replayed response carries its recording time, which says nothing about how old it is now
+        if not 0 <= now - observed_at <= self.horizon_sec:
+            observed_at = now
+        self._observed_at = observed_at
+        self.plans = []
+        self._finished = False
+
+    def add(self, trip_id: str, direction: int, next_stop_id: str, station_pixel: int, offset: float,
+            travel_time: float, stop_times: tuple, distance_along_trip: float = None):
+        """
+        Plan a train that was added to the poll's PositionBatch
+        :param next_stop_id: The feed's next stop of the train
+        :param station_pixel: Pixel of that stop
+        :param offset: Seconds until the train reaches it, 0 if it's there
+        :param travel_time: Scheduled seconds into it
+        :param stop_times: The trip's stop times, the stations after the next one are taken from these
+        :param distance_along_trip: The train's distanceAlongTrip if it was placed by distance, else None
+        """
+        legs = [(offset, _FOREVER, station_pixel, travel_time, None)]
+        index = next((i for i, stop_time in enumerate(stop_times or ()) if stop_time[0] == next_stop_id), None)
+        if index is not None:
+            stop_pixels = self.layout.pixels_for_direction(direction)
+            arrival, departure = stop_times[index][1:3]
+            legs[0] = (offset, offset + (departure - arrival), station_pixel, travel_time, _distance(stop_times[index]))
+            previous_arrival = arrival
+            for stop_time in stop_times[index + 1:]:
+                stop_id, stop_arrival, stop_departure = stop_time[:3]
+                arrive = offset + (stop_arrival - arrival)
+                if arrive > self.horizon_sec:
+                    break
+                slot = self.layout.stop_slot(stop_id, self.reference_cache.stop_name(stop_id))
+                if slot is None:
+                    break
+                legs.append((arrive, arrive + (stop_departure - stop_arrival), stop_pixels[slot],
+                             (stop_arrival - previous_arrival) or 1, _distance(stop_time)))
+                previous_arrival = stop_arrival
+            arrive, _, pixel, travel, distance = legs[-1]
+            legs[-1] = (arrive, _FOREVER, pixel, travel, distance)
+        if self.distance_index is None:
+            distance_along_trip = None
+        self.plans.append(_Plan(trip_id, direction, legs, distance_along_trip, stop_times))
+
+    def batch_at(self, now: float, trip_state) -> PositionBatch:
+        """
+        :param now: Local unix time of the frame
+        :param trip_state: TsTripStateStore whose furthest pixels the predictions are clamped against
+        :return: The planned trains where they should be at now, or None if nothing has moved since the last call
+        """
+        if self._finished:
+            return None
+        elapsed = now - self._observed_at
+        if elapsed >= self.horizon_sec:
+            elapsed = self.horizon_sec
+            self._finished = True
+        batch = PositionBatch()
+        for plan in self.plans:
+            station_pixel, offset, travel_time, fixed_pixel = self._evaluate(plan, max(elapsed, 0.0))
+            batch.append(plan.trip_id, plan.direction, station_pixel, offset, travel_time,
+                         trip_state.previous_pixel(plan.trip_id), fixed_pixel)
+        return batch
+
+    def _evaluate(self, plan: _Plan, elapsed: float) -> tuple:
+        """
+        :return: (station pixel, offset, travel time, fixed pixel) of the train elapsed seconds after the poll
+        """
+        left_at = 0.0
+        left_distance = plan.start_distance
+        for arrive, depart, station_pixel, travel_time, distance in plan.legs:
+            if elapsed < arrive:
+                fixed_pixel = NO_PIXEL
+                if left_distance is not None and distance is not None:
+                    fraction = (elapsed - left_at) / (arrive - left_at)
+                    fixed_pixel = self.distance_index.pixel_for(
+                        plan.direction, left_distance + fraction * (distance - left_distance), plan.stop_times)
+                return station_pixel, arrive - elapsed, travel_time, fixed_pixel
+            if elapsed < depart:
+                fixed_pixel = NO_PIXEL if plan.start_distance is None else station_pixel
+                return station_pixel, 0, travel_time, fixed_pixel
+            left_at = depart
+            left_distance = distance if plan.start_distance is not None else None
+        raise AssertionError("the last leg of a plan never departs")
+
+
+def _distance(stop_time: tuple):
+    return stop_time[3] if len(stop_time) > 3 else None
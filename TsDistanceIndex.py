@@ -0,0 +1,115 @@
+import logging
+from array import array
+from bisect import bisect_right
+
+from StReferenceCache import StReferenceCache
+from TsLayout import TsLayout
+from TsPositionEngine import NO_PIXEL
+
+
+logger = logging.getLogger(__name__)
+
+OFF_STRIP = -1
+
+
+class TsDistanceIndex:
+    """
+    Places trains by how far along their trip they are (OneBusAway's distanceAlongTrip) instead of by schedule.
+
+    For each direction a table of (distance along the trip, pixel) breakpoints is built once from the stopTimes
+    distances of a trip that covers the strip, one breakpoint per station on the strip.  A train is then placed with
+    one bisect into its direction's table and a linear interpolation to the nearest pixel between the two stations.
+
+    Trips can start at different stops (short turns, trips from the base), so their distances are measured from a
+    different origin.  The shift from a trip's first stop to the table's origin is worked out once per first stop
+    and cached.
+    """
+    def __init__(self, layout: TsLayout, reference_cache: StReferenceCache):
+        self.layout = layout
+        self.reference_cache = reference_cache
+        self._distances = {}     # direction -> array of breakpoint distances (m), increasing
+        self._pixels = {}        # direction -> array of breakpoint pixels, increasing
+        self._stop_distances = {}  # direction -> {stop id: table distance} of the stations in the table
+        self._origin_shifts = {}   # (direction, first stop id) -> meters to add to a trip's distanceAlongTrip
+
+    def _station_breakpoints(self, direction: int, stop_times: tuple) -> list:
+        """
+        :return: [(distance, pixel, stop id), ...] for every stop of the trip that is a station on the strip
+        """
+        stop_pixels = self.layout.pixels_for_direction(direction)
+        breakpoints = []
+        for stop_time in stop_times:
+            stop_id = stop_time[0]
+            distance = stop_time[3] if len(stop_time) > 3 else None
+            if distance is None:
+                continue
+            slot = self.layout.stop_slot(stop_id, self.reference_cache.stop_name(stop_id))
+            if slot is not None:
+                breakpoints.append((distance, stop_pixels[slot], stop_id))
+        return breakpoints
+
+    def _build(self, direction: int, breakpoints: list) -> bool:
+        if len(breakpoints) < 2:
+            return False
+        for (distance, pixel, _), (next_distance, next_pixel, _) in zip(breakpoints, breakpoints[1:]):
+            if next_distance <= distance or next_pixel <= pixel:
+                logger.warning(f"Stops of direction {direction} are out of order on {self.layout.name}, "
+                               f"not building a distance table from them")
+                return False
+        self._distances[direction] = array("d", (distance for distance, _, _ in breakpoints))
+        self._pixels[direction] = array("h", (pixel for _, pixel, _ in breakpoints))
+        self._stop_distances[direction] = {stop_id: distance for distance, _, stop_id in breakpoints}
+        # shifts were measured against the old table
+        self._origin_shifts = {key: shift for key, shift in self._origin_shifts.items() if key[0] != direction}
+        logger.info(f"Built distance table for direction {direction} of {self.layout.name} "
+                    f"with {len(breakpoints)} stations")
+        return True
+
+    def _origin_shift(self, direction: int, stop_times: tuple):
+        """
+        :return: Meters from the table's origin to the trip's, or None if the trip can't be lined up with the table
+        """
+        key = (direction, stop_times[0][0])
+        shift = self._origin_shifts.get(key)
+        if shift is not None:
+            return shift
+        # first sighting of a trip starting here: line it up with the table, or build a better table from it
+        breakpoints = self._station_breakpoints(direction, stop_times)
+        table_stops = self._stop_distances.get(direction)
+        if table_stops is None or len(breakpoints) > len(table_stops):
+            if not self._build(direction, breakpoints):
+                return None
+            table_stops = self._stop_distances[direction]
+        for distance, _, stop_id in breakpoints:
+            table_distance = table_stops.get(stop_id)
+            if table_distance is not None:
+                shift = self._origin_shifts[key] = table_distance - distance
+                return shift
+        return None
+
+    def pixel_for(self, direction: int, distance_along_trip: float, stop_times: tuple) -> int:
+        """
+        :param direction: OneBusAway directionId of the trip
+        :param distance_along_trip: The train's distanceAlongTrip
+        :param stop_times: The trip's stop times, only read the first time a trip from its first stop is seen
+        :return: Pixel of the train, OFF_STRIP if it hasn't reached the strip yet, or NO_PIXEL if it can't be placed
+            this way and the schedule should be used instead
+        """
+        if distance_along_trip is None or not stop_times:
+            return NO_PIXEL
+        shift = self._origin_shift(direction, stop_times)
+        if shift is None:
+            return NO_PIXEL
+        distances = self._distances[direction]
+        pixels = self._pixels[direction]
+        distance = distance_along_trip + shift
+        i = bisect_right(distances, distance) - 1
+        if i < 0:
+            return OFF_STRIP
+        if i >= len(distances) - 1:
+            return pixels[-1]
+        fraction = (distance - distances[i]) / (distances[i + 1] - distances[i])
+        return pixels[i] + int(fraction * (pixels[i + 1] - pixels[i]) + 0.5)
+
+    def sizes(self) -> dict:
+        return {"directions": len(self._distances), "origins": len(self._origin_shifts)}
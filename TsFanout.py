@@ -0,0 +1,267 @@
+import ipaddress
+import logging
+import socket
+import struct
+import threading
+import time
+
+from TsLineEngine import TsFrame
+from TsMetrics import TsMetrics
+from TsOutput import TsOutput
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GROUP = "239.255.84.83"
+DEFAULT_PORT = 5483
+
+MAGIC = b"TSF1"
+KIND_KEYFRAME = 0
+KIND_DELTA = 1
+# magic, kind, line name length, sequence number, sequence number the delta applies to, pixels on the line
+_HEADER = struct.Struct("!4sBBIIH")
+# first pixel and length of a run of changed pixels in a delta
+_RUN = struct.Struct("!HH")
+_MAX_PACKET = 65507
+
+
+def encode_keyframe(line_name: bytes, seq: int, pixels: bytes) -> bytes:
+    return _HEADER.pack(MAGIC, KIND_KEYFRAME, len(line_name), seq, seq, len(pixels)) + line_name + pixels
+
+
+def encode_delta(line_name: bytes, seq: int, old: bytes, new: bytes) -> bytes:
+    """
+    :return: The runs of pixels that differ between two frames, to be applied on top of frame seq - 1
+    """
+    parts = [_HEADER.pack(MAGIC, KIND_DELTA, len(line_name), seq, (seq - 1) & 0xFFFFFFFF, len(new)), line_name]
+    i = 0
+    num_pixels = len(new)
+    while i < num_pixels:
+        if old[i] == new[i]:
+            i += 1
+            continue
+        start = i
+        while i < num_pixels and old[i] != new[i]:
+            i += 1
+        parts.append(_RUN.pack(start, i - start))
+        parts.append(new[start:i])
+    return b"".join(parts)
+
+
+def decode_packet(packet: bytes) -> tuple:
+    """
+    :return: (kind, line name, sequence number, base sequence number, number of pixels, payload)
+    :raises ValueError: If it isn't a frame packet
+    """
+    if len(packet) < _HEADER.size:
+        raise ValueError("Packet too short")
+    magic, kind, name_length, seq, base_seq, num_pixels = _HEADER.unpack_from(packet)
+    if magic != MAGIC or kind not in (KIND_KEYFRAME, KIND_DELTA):
+        raise ValueError("Not a frame packet")
+    name_end = _HEADER.size + name_length
+    return kind, packet[_HEADER.size:name_end].decode("utf-8"), seq, base_seq, num_pixels, packet[name_end:]
+
+
+def apply_delta(pixels: bytearray, payload: bytes):
+    """
+    Patch a frame with the runs of a delta.  Every run is checked before any is written, so a malformed delta
+    leaves the frame as it was.
+    :raises ValueError: If a run is truncated or falls outside the frame
+    """
+    runs = []
+    offset = 0
+    while offset < len(payload):
+        if offset + _RUN.size > len(payload):
+            raise ValueError("Truncated run header")
+        start, length = _RUN.unpack_from(payload, offset)
+        offset += _RUN.size
+        if start + length > len(pixels) or offset + length > len(payload):
+            raise ValueError(f"Run of {length} pixels at {start} doesn't fit the frame or the packet")
+        runs.append((start, length, offset))
+        offset += length
+    for start, length, offset in runs:
+        pixels[start:start + length] = payload[offset:offset + length]
+
+
+class TsFramePublisher:
+    """
+    The hub end of fan-out: one process polls the API and composes the frames, and every frame is sent over UDP to
+    any number of TsFanoutClients, so the API load stays that of a single display however many are added.
+
+    Frames go out as the palette indices of the pixels, a delta against the previous frame when it changes and a
+    full keyframe every keyframe_sec, which is also what lets a client that joined late or lost a packet catch up.
+    """
+    def __init__(self, group: str = DEFAULT_GROUP, port: int = DEFAULT_PORT, ttl: int = 1,
+                 keyframe_sec: float = 2.0, metrics: TsMetrics = None):
+        """
+        :param group: Multicast group to publish to, or a unicast address to feed a single client
+        :param ttl: Multicast hops, 1 keeps the frames on the local network
+        :param keyframe_sec: Seconds between keyframes
+        """
+        self.address = (group, port)
+        self.keyframe_sec = keyframe_sec
+        self.metrics = metrics if metrics is not None else TsMetrics.shared()
+        self.outputs = []
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        self._stop_event = threading.Event()
+        self._keyframe_thread = threading.Thread(target=self._send_keyframes, name="TsFramePublisher", daemon=True)
+
+    def output_for(self, line_name: str) -> "TsFanoutOutput":
+        """
+        :return: A TsOutput that publishes the frames of one line, add it to the line
+        """
+        output = TsFanoutOutput(self, line_name)
+        self.outputs.append(output)
+        return output
+
+    def start(self):
+        self._keyframe_thread.start()
+
+    def send(self, packet: bytes, kind: int):
+        try:
+            self._socket.sendto(packet, self.address)
+            self.metrics.inc("ts_fanout_packets_sent_total", kind="keyframe" if kind == KIND_KEYFRAME else "delta")
+        except OSError as e:
+            logger.warning(f"Could not publish frame to {self.address}: {e}")
+
+    def _send_keyframes(self):
+        while not self._stop_event.wait(self.keyframe_sec):
+            for output in self.outputs:
+                output.send_keyframe()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._keyframe_thread.is_alive():
+            self._keyframe_thread.join()
+        self._socket.close()
+
+
+class TsFanoutOutput(TsOutput):
+    """
+    Publishes the frames of one line through a TsFramePublisher.  Identical frames are not resent, the periodic
+    keyframe covers them.
+    """
+    def __init__(self, publisher: TsFramePublisher, line_name: str):
+        self.publisher = publisher
+        self.line_name = line_name.encode("utf-8")
+        self._pixels = None
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def show_frame(self, frame: TsFrame):
+        pixels = bytes(frame.pixels)
+        with self._lock:
+            if pixels == self._pixels:
+                return
+            self._seq = (self._seq + 1) & 0xFFFFFFFF
+            if self._pixels is None or len(self._pixels) != len(pixels):
+                packet, kind = encode_keyframe(self.line_name, self._seq, pixels), KIND_KEYFRAME
+            else:
+                packet, kind = encode_delta(self.line_name, self._seq, self._pixels, pixels), KIND_DELTA
+                if len(packet) > _HEADER.size + len(self.line_name) + len(pixels):
+                    packet, kind = encode_keyframe(self.line_name, self._seq, pixels), KIND_KEYFRAME
+            self._pixels = pixels
+        self.publisher.send(packet, kind)
+
+    def send_keyframe(self):
+        with self._lock:
+            if self._pixels is None:
+                return
+            packet = encode_keyframe(self.line_name, self._seq, self._pixels)
+        self.publisher.send(packet, KIND_KEYFRAME)
+
+
+class TsFanoutClient:
+    """
+    The display end of fan-out: receives a TsFramePublisher's frames and shows them on local lines.  There is no API
+    client, engine or render loop, the thread sleeps in recv() until a packet arrives and then only patches the
+    frame and puts it on the strip.
+
+    A delta is only applied on top of the frame it was made from; after a lost packet the line holds its last frame
+    until the next keyframe.
+    """
+    def __init__(self, lines: list, group: str = DEFAULT_GROUP, port: int = DEFAULT_PORT, interface: str = "0.0.0.0",
+                 metrics: TsMetrics = None):
+        """
+        :param lines: TsNeopixelLines or TsHeadlessLines to show frames on, matched to the hub's lines by name
+        :param group: Multicast group to join, or the local address the hub sends to directly
+        :param interface: Local address of the interface to join the group on
+        """
+        self.metrics = metrics if metrics is not None else TsMetrics.shared()
+        self._lines = {}
+        for line in lines:
+            # [line, frame, sequence number of the frame, or None until the first keyframe]
+            self._lines[line.engine.name] = [line, TsFrame(line.layout.num_pixels), None]
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(("", port))
+        if ipaddress.ip_address(group).is_multicast:
+            membership = socket.inet_aton(group) + socket.inet_aton(interface)
+            self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        self._socket.settimeout(1.0)
+        self._stop_event = threading.Event()
+        self.last_frame_time = 0.0
+
+    def run_forever(self):
+        """
+        Receive and show frames on the calling thread until stop() is called
+        """
+        while not self._stop_event.is_set():
+            try:
+                packet = self._socket.recv(_MAX_PACKET)
+            except socket.timeout:
+                continue
+            except OSError as e:
+                if self._stop_event.is_set():
+                    break
+                logger.error(f"Fan-out receive failed: {e}")
+                continue
+            try:
+                self.handle_packet(packet)
+            except Exception:
+                logger.exception("Failed to show fan-out packet")
+
+    def handle_packet(self, packet: bytes):
+        try:
+            kind, line_name, seq, base_seq, num_pixels, payload = decode_packet(packet)
+        except (ValueError, UnicodeDecodeError) as e:
+            logger.warning(f"Ignoring bad fan-out packet: {e}")
+            return
+        entry = self._lines.get(line_name)
+        if entry is None:
+            return
+        line, frame, current_seq = entry
+        if num_pixels != len(frame):
+            logger.warning(f"Hub's {line_name} has {num_pixels} pixels, not {len(frame)}, ignoring it")
+            return
+        if kind == KIND_KEYFRAME:
+            if seq == current_seq:
+                # nothing new, just the periodic refresh
+                return
+            if len(payload) != num_pixels:
+                logger.warning(f"Keyframe for {line_name} carries {len(payload)} of {num_pixels} pixels, ignoring it")
+                return
+            frame.pixels[:] = payload
+        else:
+            if base_seq != current_seq:
+                self.metrics.inc("ts_fanout_deltas_dropped_total", line=line_name)
+                return
+            try:
+                apply_delta(frame.pixels, payload)
+            except ValueError as e:
+                # same as a missed base: hold the last frame until the next keyframe
+                logger.warning(f"Ignoring bad delta for {line_name}: {e}")
+                entry[2] = None
+                self.metrics.inc("ts_fanout_deltas_dropped_total", line=line_name)
+                return
+        entry[2] = seq
+        # the hub only sends colors, so the positions just say which pixels are lit
+        frame.positions = [("", pixel, -1, False) for pixel, index in enumerate(frame.pixels) if index]
+        self.metrics.inc("ts_fanout_frames_shown_total", line=line_name)
+        self.last_frame_time = time.time()
+        line.show_frame(frame)
+
+    def stop(self):
+        self._stop_event.set()
+        self._socket.close()
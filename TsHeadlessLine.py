@@ -0,0 +1,68 @@
+import time
+
+from StApiDecoder import TripsForRoute
+from StApiResponseHolder import StApiResponseHolder
+from StReferenceCache import StReferenceCache
+from TsLayout import TsLayout
+from TsLineEngine import TsLineEngine
+from TsOutput import TsOutput
+
+
+class TsHeadlessLine:
+    """
+    A line with no strip: the same TsLineEngine a TsNeopixelLine runs, with its frames sent to TsOutputs instead.
+    Registers with StApiClient.add_neopixel() like a real line, and needs no board or hardware imports.
+    """
+    def __init__(
+            self,
+            name: str,
+            layout: TsLayout,
+            response_holder: StApiResponseHolder = None,
+            outputs: list = None,
+            reference_cache: StReferenceCache = None,
+            trip_state_max_age_sec: float = 120.0,
+            positioning: str = TsLineEngine.POSITIONING_SCHEDULE,
+            predict_sec: float = 0.0):
+        """
+        :param response_holder: Where update() picks up responses, only needed when driven by a StApiClient
+        :param outputs: TsOutputs every frame is shown on
+        :param positioning: How trains are placed between stations, see TsLineEngine
+        :param predict_sec: How long after a poll trains are moved along between polls, 0 to leave them where the
+            poll put them.  See TsDeadReckoner.
+        """
+        self._name = name
+        self.layout = layout
+        self.response_holder = response_holder
+        self.outputs = list(outputs) if outputs else []
+        self.engine = TsLineEngine(name, layout, reference_cache, trip_state_max_age_sec, positioning,
+                                   predict_sec)
+
+    def add_output(self, output: TsOutput):
+        self.outputs.append(output)
+
+    def show_frame(self, frame):
+        for output in self.outputs:
+            output.show_frame(frame)
+
+    def update(self):
+        frame = self.engine.poll(self.response_holder)
+        if frame is None:
+            frame = self.engine.advance(time.time())
+        if frame is not None:
+            self.show_frame(frame)
+
+    def update_feed(self, feed: TripsForRoute, now: float = None):
+        """
+        Draw an already decoded response, bypassing the holder
+        """
+        self.show_frame(self.engine.process(feed, time.time() if now is None else now))
+
+    def clear_all_pixels(self):
+        self.show_frame(self.engine.clear_frame())
+
+    def close(self):
+        for output in self.outputs:
+            output.close()
+
+    def __hash__(self):
+        return hash(self._name)
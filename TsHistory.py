@@ -0,0 +1,220 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+from TsMetrics import TsMetrics
+
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = (
+    # every trip, stop and line id is stored once here and referred to by number
+    "CREATE TABLE IF NOT EXISTS names (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)",
+    # clustered on time, so a time range is one contiguous scan and there is no separate index to keep up.  Times
+    # are whole seconds: a second sighting of a trip within the same second is ignored, so the first one recorded
+    # stands and history is never rewritten, e.g. after a restart or when replaying faster than real time.
+    "CREATE TABLE IF NOT EXISTS positions ("
+    " t INTEGER NOT NULL, line INTEGER NOT NULL, trip INTEGER NOT NULL, direction INTEGER, stop INTEGER,"
+    " offset INTEGER, pixel INTEGER, PRIMARY KEY (t, trip)) WITHOUT ROWID",
+)
+
+# Rows older than the cutoff that are neither the first nor the last of a run at the same stop and pixel
+_COMPACT = """
+    DELETE FROM positions WHERE (t, trip) IN (
+        SELECT t, trip FROM (
+            SELECT t, trip, stop, pixel,
+                LAG(stop) OVER w AS prev_stop, LAG(pixel) OVER w AS prev_pixel,
+                LEAD(stop) OVER w AS next_stop, LEAD(pixel) OVER w AS next_pixel
+            FROM positions WHERE t < ?
+            WINDOW w AS (PARTITION BY trip ORDER BY t))
+        WHERE prev_stop IS stop AND prev_pixel IS pixel AND next_stop IS stop AND next_pixel IS pixel)
+"""
+
+_QUERY = """
+    SELECT p.t, line.name, trip.name, p.direction, stop.name, p.offset, p.pixel
+    FROM positions p
+    JOIN names line ON line.id = p.line
+    JOIN names trip ON trip.id = p.trip
+    LEFT JOIN names stop ON stop.id = p.stop
+    WHERE p.t >= ? AND p.t < ?
+"""
+
+
+class TsHistoryStore:
+    """
+    Append-only history of where every train was at every poll, for analysing headways and bunching over months.
+
+    Rows of (time, line, trip, direction, next stop, seconds to it, pixel) are handed over from the render thread
+    through a bounded queue and never wait on the disk; a writer thread inserts them in bulk, one transaction per
+    flush_rows rows or flush_interval_sec, into a WAL-mode SQLite database.  Ids are interned into a names table and
+    rows are keyed by (time, trip) without a rowid, so a row costs about twenty bytes.  Time is kept to the second;
+    of several polls of a trip within one second only the first is kept.
+
+    Rows older than compact_after_sec are compacted once a day: only the first and last row of each run at the same
+    stop and pixel are kept, which keeps every arrival and departure while dropping the polls in between.
+    """
+    def __init__(
+            self,
+            path: str,
+            flush_rows: int = 5000,
+            flush_interval_sec: float = 60.0,
+            compact_after_sec: float = 7 * 86400,
+            compact_every_sec: float = 86400,
+            max_queued_polls: int = 1000,
+            metrics: TsMetrics = None):
+        """
+        :param path: SQLite database, created if missing
+        :param flush_rows: Commit once this many rows are pending
+        :param flush_interval_sec: Commit once the oldest pending row has waited this long
+        :param compact_after_sec: Rows older than this are compacted, 0 to never compact
+        :param compact_every_sec: Seconds between compactions
+        :param max_queued_polls: Polls held for the writer before new ones are dropped
+        """
+        self.path = path
+        self.flush_rows = flush_rows
+        self.flush_interval_sec = flush_interval_sec
+        self.compact_after_sec = compact_after_sec
+        self.compact_every_sec = compact_every_sec
+        self.metrics = metrics if metrics is not None else TsMetrics.shared()
+        self._queue = queue.Queue(max_queued_polls)
+        self._names = {}
+        self._connection = self._connect()
+        for statement in _SCHEMA:
+            self._connection.execute(statement)
+        self._connection.commit()
+        self._stop_event = threading.Event()
+        self._writer = threading.Thread(target=self._write_loop, name="TsHistoryStore", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        # a power cut can lose the last commit but never corrupts the database
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def add_line(self, line):
+        """
+        :param line: A TsNeopixelLine or TsHeadlessLine whose polled positions are recorded
+        """
+        line.engine.add_position_listener(self.record)
+
+    def record(self, engine, now: float, rows: list):
+        """
+        Position listener, queues one poll's rows without blocking
+        :param rows: (trip id, direction, next stop id, seconds to it, pixel or None) of every train
+        """
+        try:
+            self._queue.put_nowait((now, engine.name, rows))
+        except queue.Full:
+            self.metrics.inc("ts_history_polls_dropped_total")
+
+    def _intern(self, name: str) -> int:
+        if name is None:
+            return None
+        name_id = self._names.get(name)
+        if name_id is None:
+            cursor = self._connection.execute("INSERT OR IGNORE INTO names (name) VALUES (?)", (name,))
+            if cursor.rowcount:
+                name_id = cursor.lastrowid
+            else:
+                name_id = self._connection.execute("SELECT id FROM names WHERE name = ?", (name,)).fetchone()[0]
+            self._names[name] = name_id
+        return name_id
+
+    def _rows_for(self, now: float, line_name: str, rows: list) -> list:
+        t = int(now)
+        line_id = self._intern(line_name)
+        return [(t, line_id, self._intern(trip_id), direction, self._intern(stop_id),
+                 None if offset is None else int(offset), pixel)
+                for trip_id, direction, stop_id, offset, pixel in rows]
+
+    def _write_loop(self):
+        pending = []
+        oldest = None
+        next_compaction = time.monotonic() + self.compact_every_sec
+        while True:
+            timeout = self.flush_interval_sec if oldest is None else oldest + self.flush_interval_sec - time.monotonic()
+            try:
+                item = self._queue.get(timeout=max(0.0, timeout))
+            except queue.Empty:
+                item = None
+            if item is not None:
+                try:
+                    pending += self._rows_for(*item)
+                    if oldest is None:
+                        oldest = time.monotonic()
+                except Exception:
+                    # lose the poll, not the writer
+                    logger.exception(f"Could not record a poll of {item[1]} in {self.path}, dropping it")
+                    self.metrics.inc("ts_history_polls_dropped_total")
+            stopping = self._stop_event.is_set() and self._queue.empty()
+            if pending and (stopping or len(pending) >= self.flush_rows or
+                            time.monotonic() - oldest >= self.flush_interval_sec):
+                self._commit(pending)
+                pending = []
+                oldest = None
+            if self.compact_after_sec and time.monotonic() >= next_compaction:
+                self.compact(time.time() - self.compact_after_sec)
+                next_compaction = time.monotonic() + self.compact_every_sec
+            if stopping:
+                return
+
+    def _commit(self, rows: list):
+        try:
+            with self._connection:
+                written = self._connection.executemany(
+                    "INSERT OR IGNORE INTO positions VALUES (?, ?, ?, ?, ?, ?, ?)", rows).rowcount
+            self.metrics.inc("ts_history_rows_written_total", written)
+        except sqlite3.Error as e:
+            logger.error(f"Could not write {len(rows)} history rows to {self.path}: {e}")
+            # names interned since the last commit were rolled back with the rows
+            self._names.clear()
+
+    def compact(self, before: float) -> int:
+        """
+        Thin out rows older than before to the first and last of each run at the same stop and pixel.  Runs on the
+        writer thread; call it directly only when the store isn't running.
+        :return: Number of rows deleted
+        """
+        try:
+            with self._connection:
+                deleted = self._connection.execute(_COMPACT, (int(before),)).rowcount
+            logger.info(f"Compacted {deleted} history rows from before {time.ctime(before)}")
+            return deleted
+        except sqlite3.Error as e:
+            logger.error(f"Could not compact {self.path}: {e}")
+            return 0
+
+    def query(self, start: float, end: float, line: str = None, trip_id: str = None, stop_id: str = None) -> list:
+        """
+        Rows committed so far in [start, end), oldest first.  Opens its own connection, so it can be called from
+        any thread while the writer is running.
+        :return: (unix time, line, trip id, direction, next stop id, seconds to it, pixel) tuples
+        """
+        sql = _QUERY
+        params = [int(start), int(end)]
+        for column, value in (("line", line), ("trip", trip_id), ("stop", stop_id)):
+            if value is not None:
+                sql += f" AND {column}.name = ?"
+                params.append(value)
+        connection = sqlite3.connect(self.path)
+        try:
+            return connection.execute(sql + " ORDER BY p.t, trip.name", params).fetchall()
+        finally:
+            connection.close()
+
+    def close(self):
+        """
+        Write out everything queued and stop the writer
+        """
+        self._stop_event.set()
+        # wake the writer if it's waiting on an empty queue
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self._writer.join()
+        self._connection.close()
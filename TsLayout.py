@@ -0,0 +1,110 @@
+import json
+import logging
+import os
+from array import array
+
+
+logger = logging.getLogger(__name__)
+
+LAYOUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "layouts")
+
+class TsLayout:
+    """
+    Compiled strip geometry for a single line.
+
+    The strip runs out along the line in one direction, folds back at the reversal pixel and returns in the other
+    direction, so every stop has one pixel per direction.  Layouts are loaded from a JSON file (see layouts/) and
+    compiled once into arrays indexed by a per-stop slot, plus a bitmap per direction of which pixels are stations.
+
+    Config keys:
+        name: Display name of the line
+        num_pixels: Length of the strip
+        pixels_per_segment: Pixels from one stop to the next
+        outbound_direction / return_direction: OneBusAway directionId of each leg
+        outbound_first_pixel: Pixel of the first stop on the outbound leg
+        reversal_pixel: Pixel of the last stop on the return leg, i.e. where the strip folds back
+        stops: Stop names in outbound order.  An entry may also be {"name": ..., "ids": [...]} to pre-bind stop IDs.
+    """
+    def __init__(self, config: dict):
+        self.name = config["name"]
+        self.num_pixels = int(config["num_pixels"])
+        self.pixels_per_segment = int(config["pixels_per_segment"])
+        self.outbound_direction = int(config["outbound_direction"])
+        self.return_direction = int(config["return_direction"])
+        outbound_first_pixel = int(config.get("outbound_first_pixel", 0))
+        reversal_pixel = int(config["reversal_pixel"])
+
+        self.stop_names = []
+        self._name_to_slot = {}
+        self._stop_id_to_slot = {}
+        for entry in config["stops"]:
+            if isinstance(entry, str):
+                entry = {"name": entry}
+            slot = len(self.stop_names)
+            self.stop_names.append(entry["name"])
+            self._name_to_slot[entry["name"]] = slot
+            for stop_id in entry.get("ids", []):
+                self._stop_id_to_slot[stop_id] = slot
+
+        num_stops = len(self.stop_names)
+        outbound = array("h", (outbound_first_pixel + i * self.pixels_per_segment for i in range(num_stops)))
+        inbound = array("h", (reversal_pixel + (num_stops - 1 - i) * self.pixels_per_segment for i in range(num_stops)))
+        for pixel in (*outbound, *inbound):
+            if not 0 <= pixel < self.num_pixels:
+                raise ValueError(f"Layout {self.name} puts a stop at pixel {pixel}, outside the strip")
+
+        self._pixels = {self.outbound_direction: outbound, self.return_direction: inbound}
+        self._station_bitmaps = {}
+        for direction, pixels in self._pixels.items():
+            bitmap = bytearray(self.num_pixels)
+            for pixel in pixels:
+                bitmap[pixel] = 1
+            self._station_bitmaps[direction] = bitmap
+
+    @classmethod
+    def load(cls, path: str) -> "TsLayout":
+        """
+        :param path: Path to a layout JSON file, or the bare name of a file in layouts/ (e.g. "1_line")
+        :return: The compiled layout
+        """
+        if not os.path.exists(path):
+            path = os.path.join(LAYOUT_DIR, path if path.endswith(".json") else f"{path}.json")
+        with open(path, "r") as f:
+            return cls(json.load(f))
+
+    def is_known_direction(self, direction: int) -> bool:
+        return direction in self._pixels
+
+    def pixels_for_direction(self, direction: int) -> array:
+        """
+        :param direction: OneBusAway directionId
+        :return: Array of station pixels indexed by stop slot.  Unknown directions fall back to the outbound leg.
+        """
+        return self._pixels.get(direction, self._pixels[self.outbound_direction])
+
+    def station_bitmap(self, direction: int) -> bytearray:
+        """
+        :param direction: OneBusAway directionId
+        :return: bytearray of num_pixels, non-zero where a station for that direction sits
+        """
+        return self._station_bitmaps.get(direction, self._station_bitmaps[self.outbound_direction])
+
+    def stop_slot(self, stop_id: str, stop_name: str = None):
+        """
+        Look up the slot of a stop, binding the stop ID to a slot by name the first time it is seen
+        :param stop_id: OneBusAway stop ID
+        :param stop_name: Name from the response's references, used only if the ID is not bound yet
+        :return: The stop's slot, or None if the stop is not on this line
+        """
+        slot = self._stop_id_to_slot.get(stop_id)
+        if slot is None and stop_name is not None:
+            slot = self._name_to_slot.get(stop_name)
+            if slot is not None:
+                self._stop_id_to_slot[stop_id] = slot
+        return slot
+
+    def stop_pixel(self, stop_name: str, direction: int) -> int:
+        """
+        :return: The station pixel of a stop by name, raises KeyError if it isn't on this line
+        """
+        return self.pixels_for_direction(direction)[self._name_to_slot[stop_name]]
@@ -0,0 +1,357 @@
+import logging
+import time
+
+import colors
+from StApiDecoder import TripsForRoute
+from StApiResponseHolder import StApiResponseHolder
+from StReferenceCache import StReferenceCache
+from TsDeadReckoning import TsDeadReckoner
+from TsDistanceIndex import TsDistanceIndex
+from TsLayout import TsLayout
+from TsMetrics import TsMetrics
+from TsPositionEngine import NO_PIXEL, PositionBatch, TsPositionEngine
+from TsTripState import TsTripStateStore
+
+logger = logging.getLogger(__name__)
+
+# palette index -> color name, index 0 is off
+PALETTE_NAMES = (None,) + tuple(colors.colors)
+PALETTE_RGB = ((0, 0, 0),) + tuple(colors.colors.values())
+PALETTE_INDEX = {name: index for index, name in enumerate(PALETTE_NAMES)}
+
+
+class TsFrame:
+    """
+    One composed frame of a line, independent of what it is shown on
+        pixels: Palette index of every pixel, 0 is off
+        positions: (trip id, pixel, direction, stopped) of every train drawn
+    """
+    __slots__ = ("pixels", "positions")
+
+    def __init__(self, num_pixels: int):
+        self.pixels = bytearray(num_pixels)
+        self.positions = []
+
+    def __len__(self):
+        return len(self.pixels)
+
+    def color_name(self, pixel: int):
+        return PALETTE_NAMES[self.pixels[pixel]]
+
+    def rgb(self, pixel: int) -> tuple:
+        return PALETTE_RGB[self.pixels[pixel]]
+
+
+class TsLineEngine:
+    """
+    Everything a line does between a decoded response and a finished frame: reference population, train
+    positions and colors.  Pure Python with no hardware imports, so the NeoPixel strips and the headless outputs
+    (TsOutput) run exactly the same code.
+    """
+    DIRECTION_SOUTH = 0
+    DIRECTION_NORTH = 1
+    POSITIONING_SCHEDULE = "schedule"
+    POSITIONING_DISTANCE = "distance"
+
+    def __init__(
+            self,
+            name: str,
+            layout: TsLayout,
+            reference_cache: StReferenceCache = None,
+            trip_state_max_age_sec: float = 120.0,
+            positioning: str = POSITIONING_SCHEDULE,
+            predict_sec: float = 0.0):
+        """
+        :param name: Name of the line, used to label metrics
+        :param layout: Layout of the strip the line is drawn on
+        :param reference_cache: Stop/trip reference data, shared with every other line unless one is given
+        :param trip_state_max_age_sec: How long a trip's state is kept after it drops out of the responses
+        :param positioning: "schedule" places trains between stations by time to the next stop against the
+            scheduled travel time, "distance" by distanceAlongTrip through a TsDistanceIndex (falling back to the
+            schedule for trains it can't place)
+        :param predict_sec: If non-zero, advance() moves trains along between polls for up to this many seconds
+            after each one, see TsDeadReckoner
+        """
+        if positioning not in (self.POSITIONING_SCHEDULE, self.POSITIONING_DISTANCE):
+            raise ValueError(f"Unknown positioning {positioning!r}")
+        self.name = name
+        self.layout = layout
+        self.reference_cache = reference_cache if reference_cache is not None else StReferenceCache.shared()
+        self.position_engine = TsPositionEngine(layout)
+        self.trip_state = TsTripStateStore(layout.num_pixels, max_age_sec=trip_state_max_age_sec)
+        self.distance_index = None
+        if positioning == self.POSITIONING_DISTANCE:
+            self.distance_index = TsDistanceIndex(layout, self.reference_cache)
+        self.dead_reckoner = None
+        if predict_sec > 0:
+            self.dead_reckoner = TsDeadReckoner(layout, self.reference_cache, predict_sec, self.distance_index)
+        self.metrics = TsMetrics.shared()
+        self.frame = TsFrame(layout.num_pixels)
+        self._blank = bytes(layout.num_pixels)
+        self.last_collisions = None
+        self.frame_listeners = []
+        self.position_listeners = []
+        self._last_updated_ts = 0
+
+    def add_frame_listener(self, listener):
+        """
+        :param listener: Called as listener(engine, frame) after every frame composed from a response
+        """
+        self.frame_listeners.append(listener)
+
+    def add_position_listener(self, listener):
+        """
+        :param listener: Called as listener(engine, now, rows) after every poll, with rows of (trip id, direction,
+            next stop id, seconds to it, pixel or None if not drawn) of every train placed
+        """
+        self.position_listeners.append(listener)
+
+    def poll(self, response_holder: StApiResponseHolder):
+        """
+        Compose a frame from the holder's response, if it is new and good
+        :return: The frame, or None if there is nothing new to show
+        """
+        # check timestamp to make sure we haven't already processed this
+        server_response, timestamp = response_holder.get_snapshot()
+        if timestamp == self._last_updated_ts:
+            return None
+        self._last_updated_ts = timestamp
+
+        # verify validity
+        if server_response.status_code != 200:
+            logger.error(f"Error: Server responded with {server_response.status_code}")
+            return None
+        try:
+            feed = response_holder.get_feed(server_response)
+        except Exception as e:
+            logger.error(f"Unable to decode response: {e}")
+            return None
+        return self.process(feed, time.time(), observed_at=timestamp)
+
+    def process(self, feed: TripsForRoute, now: float, observed_at: float = None) -> TsFrame:
+        """
+        :param feed: A decoded response
+        :param now: Local unix time of the response
+        :param observed_at: Local unix time the response was received, if earlier than now.  Predictions between
+            polls count from it.
+        :return: The composed frame
+        """
+        if self.dead_reckoner is not None:
+            self.dead_reckoner.begin(now if observed_at is None else observed_at, now)
+        with self.metrics.timer("ts_stage_seconds", stage="references", line=self.name):
+            self.populate_references(feed, now)
+        with self.metrics.timer("ts_stage_seconds", stage="positions", line=self.name):
+            positions = self.compute_positions(feed, now)
+        with self.metrics.timer("ts_stage_seconds", stage="pixels", line=self.name):
+            frame = self.compose(positions)
+        for listener in self.frame_listeners:
+            try:
+                listener(self, frame)
+            except Exception as e:
+                logger.error(f"Frame listener failed: {e}")
+        return frame
+
+    def advance(self, now: float):
+        """
+        Move the trains of the last poll to where they should be by now, if predicting between polls
+        :return: The recomposed frame, or None if no train has changed pixel
+        """
+        if self.dead_reckoner is None:
+            return None
+        with self.metrics.timer("ts_stage_seconds", stage="predict", line=self.name):
+            batch = self.dead_reckoner.batch_at(now, self.trip_state)
+            if batch is None:
+                return None
+            positions = self._record_positions(batch, self.position_engine.compute(batch))
+            if positions == self.frame.positions:
+                return None
+            return self.compose(positions)
+
+    def populate_references(self, feed: TripsForRoute, now: float):
+        self.reference_cache.merge_stops(feed.stops, now)
+        self.reference_cache.merge_trips(feed.trips, now)
+
+    def compute_positions(self, feed: TripsForRoute, now: float) -> list:
+        """
+        Work out where every train goes on the strip
+        :return: A list of (trip id, pixel, direction, stopped) in feed order
+        """
+        batch = PositionBatch()
+        stop_ids = [] if self.position_listeners else None
+
+        # find all trains
+        for train in feed.trains:
+            try:
+                # for each, find where it is, and illuminate
+                next_stop_id = train.next_stop
+                distance_to_next = train.next_stop_offset
+                trip_id = train.trip_id
+
+                # these fake "_dup" trains seem to appear and mess things up, filter them out
+                if "_dup" in trip_id.lower():
+                    self.metrics.inc("ts_dup_trips_filtered_total", line=self.name)
+                    continue
+
+                # bail if we didn't find this in the global ref dict
+                next_stop_name = self.reference_cache.stop_name(next_stop_id)
+                if next_stop_name is None:
+                    logger.warning(f"Couldn't find {next_stop_id} in stops, skipping...")
+                    self.metrics.inc("ts_trains_skipped_total", line=self.name, reason="unknown_stop")
+                    continue
+
+                # bail if we didn't find this in the global ref dict
+                direction = self.reference_cache.trip_direction(trip_id)
+                if direction is None:
+                    logger.warning(f"Couldn't find {trip_id} in directions, skipping...")
+                    self.metrics.inc("ts_trains_skipped_total", line=self.name, reason="unknown_trip")
+                    continue
+
+                # look at orientation to see which direction we're in
+                if not self.layout.is_known_direction(direction):
+                    logger.warning(f"Direction {direction} unknown!")
+                stop_pixels = self.layout.pixels_for_direction(direction)
+
+                # bail if this stop isn't on our strip
+                stop_slot = self.layout.stop_slot(next_stop_id, next_stop_name)
+                if stop_slot is None:
+                    logger.warning(f"{next_stop_name} is not on {self.layout.name}, skipping...")
+                    self.metrics.inc("ts_trains_skipped_total", line=self.name, reason="off_strip")
+                    continue
+                station_pixel = stop_pixels[stop_slot]
+
+                fixed_pixel = NO_PIXEL
+                if self.distance_index is not None:
+                    fixed_pixel = self.distance_index.pixel_for(direction, train.distance_along_trip, train.stop_times)
+
+                # travel time is only needed to place a train between stations by schedule
+                travel_time = 1
+                if distance_to_next != 0 and fixed_pixel == NO_PIXEL:
+                    travel_time = self.reference_cache.travel_time(
+                        trip_id, next_stop_id, train.stop_times, now)
+                    if travel_time is None:
+                        logger.warning(f"Couldn't find {next_stop_id} in the schedule of {trip_id}, skipping...")
+                        self.metrics.inc("ts_trains_skipped_total", line=self.name, reason="no_schedule")
+                        continue
+                # The furthest pixel in the trip state attempts to fix noisy and incorrect reporting by never going
+                # backwards.  The engine only applies it when the train is close to where we think it is, if not then
+                # it takes the server's word for it no matter what.
+                batch.append(trip_id, direction, station_pixel, distance_to_next, travel_time,
+                             self.trip_state.previous_pixel(trip_id), fixed_pixel)
+                if stop_ids is not None:
+                    stop_ids.append(next_stop_id)
+                if self.dead_reckoner is not None:
+                    self.dead_reckoner.add(trip_id, direction, next_stop_id, station_pixel, distance_to_next,
+                                           travel_time, train.stop_times,
+                                           None if fixed_pixel == NO_PIXEL else train.distance_along_trip)
+
+            except Exception:
+                logger.exception(f"Failed processing {train.trip_id}")
+
+        result = self.position_engine.compute(batch)
+        positions = self._record_positions(batch, result, now)
+        self.trip_state.evict_stale(now)
+        if stop_ids is not None:
+            self._notify_position_listeners(batch, result, stop_ids, now)
+        return positions
+
+    def _notify_position_listeners(self, batch: PositionBatch, result, stop_ids: list, now: float):
+        pixels = result.pixels.tolist()
+        rows = [(trip_id, batch.directions[i], stop_ids[i], batch.offsets[i], pixels[i] if result.valid[i] else None)
+                for i, trip_id in enumerate(batch.trip_ids)]
+        for listener in self.position_listeners:
+            try:
+                listener(self, now, rows)
+            except Exception as e:
+                logger.error(f"Position listener failed: {e}")
+
+    def _record_positions(self, batch: PositionBatch, result, now: float = None) -> list:
+        """
+        Store where every train of the batch was drawn in the trip state
+        :param now: Time the trains were seen, None for predicted positions, which don't count as sightings
+        :return: A list of (trip id, pixel, direction, stopped) of the drawn trains
+        """
+        positions = []
+        pixels = result.pixels.tolist()
+        trip_state = self.trip_state
+        for i, trip_id in enumerate(batch.trip_ids):
+            slot = trip_state.slot_for(trip_id, now) if now is not None else trip_state.find_slot(trip_id)
+            if slot is None:
+                continue
+            if result.valid[i]:
+                positions.append((trip_id, pixels[i], batch.directions[i], bool(result.stopped[i])))
+                trip_state.record(slot, pixels[i], batch.directions[i])
+            else:
+                trip_state.record(slot, NO_PIXEL, batch.directions[i])
+        self.last_collisions = result.collisions
+        return positions
+
+    def _set_and_check_for_multiple(self, pixel_idx) -> int:
+        return self.trip_state.count_pixel(pixel_idx)
+
+    def _set_pixel_stopped(self, pixel_idx: int, direction: int):
+        if self._set_and_check_for_multiple(pixel_idx) != 0:
+            self.frame.pixels[pixel_idx] = PALETTE_INDEX["WHITE"]
+        elif direction == self.DIRECTION_SOUTH:
+            self.frame.pixels[pixel_idx] = PALETTE_INDEX["LIGHT_RED"]
+        else:
+            self.frame.pixels[pixel_idx] = PALETTE_INDEX["RED"]
+
+    def _set_pixel_moving(self, pixel_idx: int, direction: int):
+        if self._set_and_check_for_multiple(pixel_idx) != 0:
+            self.frame.pixels[pixel_idx] = PALETTE_INDEX["WHITE"]
+        if direction == self.DIRECTION_SOUTH:
+            self.frame.pixels[pixel_idx] = PALETTE_INDEX["LIGHT_GREEN"]
+        else:
+            self.frame.pixels[pixel_idx] = PALETTE_INDEX["GREEN"]
+
+    def compose(self, positions: list) -> TsFrame:
+        """
+        Color the trains into the engine's frame.  The frame is reused, outputs must not hold on to it.
+        """
+        self.clear_frame()
+        for trip_id, pixel_idx, direction, stopped in positions:
+            if stopped:
+                self._set_pixel_stopped(pixel_idx, direction)
+            else:
+                self._set_pixel_moving(pixel_idx, direction)
+        self.frame.positions = positions
+        return self.frame
+
+    def export_state(self) -> dict:
+        """
+        :return: The current frame and trip state, JSON-friendly
+        """
+        return {
+            "layout": self.layout.name,
+            "frame": self.frame.pixels.hex(),
+            "positions": self.frame.positions,
+            "trips": self.trip_state.export_state(),
+        }
+
+    def restore_state(self, state: dict, now: float = None):
+        """
+        Load a frame and trip state saved by export_state()
+        :return: The restored frame, or None if the state doesn't fit this line
+        """
+        now = time.time() if now is None else now
+        pixels = bytes.fromhex(state["frame"])
+        if state.get("layout") != self.layout.name or len(pixels) != len(self.frame):
+            logger.warning(f"Saved state of {self.name} doesn't match its layout, not restoring it")
+            return None
+        if max(pixels, default=0) >= len(PALETTE_NAMES):
+            logger.warning(f"Saved frame of {self.name} uses unknown colors, not restoring it")
+            return None
+        self.trip_state.restore_state(state.get("trips", []), now)
+        self.frame.pixels[:] = pixels
+        self.frame.positions = [tuple(position) for position in state.get("positions", [])]
+        return self.frame
+
+    def clear_frame(self) -> TsFrame:
+        """
+        :return: The engine's frame, all off
+        """
+        frame = self.frame
+        frame.pixels[:] = self._blank
+        frame.positions = []
+        self.trip_state.reset_pixel_counts()
+        return frame
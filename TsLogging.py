@@ -0,0 +1,282 @@
+import copy
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+from TsMetrics import TsMetrics
+
+
+class TsQueueHandler(logging.handlers.QueueHandler):
+    """
+    The only handler on the root logger.  Hands records to a TsLogListener through a bounded in-memory queue and
+    never blocks: if the listener has fallen behind, the record is dropped and counted instead.
+    """
+    def __init__(self, log_queue: queue.Queue, metrics: TsMetrics = None):
+        super().__init__(log_queue)
+        self.metrics = metrics if metrics is not None else TsMetrics.shared()
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The queue never leaves the process, so formatting and the traceback are left to the listener thread.  The
+        # message is rendered now because its arguments may change by the time the listener gets to it.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            self.metrics.inc("ts_log_records_dropped_total")
+
+
+class TsDuplicateSuppressor:
+    """
+    Lets the first of a run of identical messages through and counts the rest, so a warning repeated for every
+    train on every poll is written once per window followed by a single "repeated N more times" line.
+    """
+    def __init__(self, window_sec: float = 60.0, max_keys: int = 1024, metrics: TsMetrics = None):
+        """
+        :param window_sec: Repeats of a message within this long of its first occurrence are only counted
+        :param max_keys: Distinct messages tracked at once, the oldest is closed early past this
+        """
+        self.window_sec = window_sec
+        self.max_keys = max_keys
+        self.metrics = metrics if metrics is not None else TsMetrics.shared()
+        self._windows = {}  # (logger, level, message) -> [first record, repeats]
+
+    def admit(self, record: logging.LogRecord) -> list:
+        """
+        :return: Records to write for this one: none if it's a repeat, else the record itself, preceded by the
+            summary of the window it closes if that had repeats
+        """
+        key = (record.name, record.levelno, record.msg)
+        window = self._windows.get(key)
+        if window is not None:
+            if record.created - window[0].created < self.window_sec:
+                window[1] += 1
+                self.metrics.inc("ts_log_records_suppressed_total")
+                return []
+            del self._windows[key]
+            out = self._summarize(window, record.created)
+        else:
+            out = []
+            if len(self._windows) >= self.max_keys:
+                out += self._summarize(self._windows.pop(next(iter(self._windows))), record.created)
+        self._windows[key] = [record, 0]
+        out.append(record)
+        return out
+
+    def expired(self, now: float) -> list:
+        """
+        Close every window that has run out
+        :return: Summaries of the closed windows that had repeats
+        """
+        out = []
+        for key in [key for key, window in self._windows.items() if now - window[0].created >= self.window_sec]:
+            out += self._summarize(self._windows.pop(key), now)
+        return out
+
+    def close_all(self) -> list:
+        """
+        :return: Summaries of every open window that had repeats
+        """
+        out = []
+        for window in self._windows.values():
+            out += self._summarize(window, time.time())
+        self._windows.clear()
+        return out
+
+    @staticmethod
+    def _summarize(window: list, now: float) -> list:
+        first, repeats = window
+        if not repeats:
+            return []
+        summary = copy.copy(first)
+        summary.msg = f"{first.msg} (repeated {repeats} more times in the last {now - first.created:.0f}s)"
+        summary.exc_info = None
+        summary.exc_text = None
+        summary.stack_info = None
+        summary.created = now
+        summary.msecs = (now - int(now)) * 1000
+        return [summary]
+
+
+class TsRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    A log file that rotates on size or age, whichever comes first, and is written to the SD card in batches: lines
+    collect in the file's buffer until flush_records have built up, an ERROR is written, or the listener calls sync()
+    every flush_sec.
+    """
+    def __init__(
+            self,
+            filename: str,
+            max_bytes: int = 1_000_000,
+            backup_count: int = 3,
+            rotate_sec: float = 86400,
+            flush_records: int = 100):
+        """
+        :param max_bytes: Rotate once the file would grow past this, 0 for no size limit
+        :param backup_count: Rotated files kept
+        :param rotate_sec: Rotate once the file has been written to for this long, 0 for no age limit
+        :param flush_records: Flush after this many records even if sync() hasn't been called
+        """
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+        self.rotate_sec = rotate_sec
+        self.flush_records = flush_records
+        self._rollover_at = time.time() + rotate_sec
+        self._unflushed = 0
+        # the size is counted here rather than asked of the file, seeking to the end would flush the buffer
+        self._bytes = 0
+        self._record_bytes = 0
+
+    def _open(self):
+        stream = super()._open()
+        self._bytes = os.fstat(stream.fileno()).st_size
+        return stream
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.stream is None:
+            self.stream = self._open()
+        self._record_bytes = len(self.format(record).encode(self.encoding or "utf-8", "replace")) + len(self.terminator)
+        if self.rotate_sec and record.created >= self._rollover_at:
+            return True
+        return self.maxBytes > 0 and self._bytes + self._record_bytes >= self.maxBytes
+
+    def emit(self, record: logging.LogRecord):
+        super().emit(record)
+        self._bytes += self._record_bytes
+
+    def doRollover(self):
+        super().doRollover()
+        self._bytes = 0
+        self._rollover_at = time.time() + self.rotate_sec
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        emitted = super().handle(record)
+        if record.levelno >= logging.ERROR:
+            self.sync()
+        return emitted
+
+    def flush(self):
+        # StreamHandler calls this after every record, leave the line in the buffer until there's a batch
+        self._unflushed += 1
+        if self._unflushed >= self.flush_records:
+            self.sync()
+
+    def sync(self):
+        """
+        Push everything buffered to the file
+        """
+        self._unflushed = 0
+        super().flush()
+
+
+class TsLogListener(threading.Thread):
+    """
+    Takes records off the queue and writes them to the handlers, after duplicate suppression.  All formatting and
+    I/O happens on this thread.
+    """
+    _STOP = object()
+
+    def __init__(
+            self,
+            log_queue: queue.Queue,
+            handlers: list,
+            suppressor: TsDuplicateSuppressor = None,
+            flush_sec: float = 5.0):
+        """
+        :param suppressor: Filters out repeated messages, None to write everything
+        :param flush_sec: Buffered handlers are synced and finished suppression windows summarized this often
+        """
+        super().__init__(name="TsLogListener", daemon=True)
+        self.queue = log_queue
+        self.handlers = handlers
+        self.suppressor = suppressor
+        self.flush_sec = flush_sec
+
+    def run(self):
+        next_flush = time.time() + self.flush_sec
+        while True:
+            try:
+                record = self.queue.get(timeout=max(0.0, next_flush - time.time()))
+            except queue.Empty:
+                record = None
+            if record is self._STOP:
+                break
+            if record is not None:
+                self._handle_all(self.suppressor.admit(record) if self.suppressor else [record])
+            now = time.time()
+            if now >= next_flush:
+                if self.suppressor:
+                    self._handle_all(self.suppressor.expired(now))
+                self._sync()
+                next_flush = now + self.flush_sec
+        if self.suppressor:
+            self._handle_all(self.suppressor.close_all())
+        self._sync()
+
+    def _handle_all(self, records: list):
+        for record in records:
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def _sync(self):
+        for handler in self.handlers:
+            if isinstance(handler, TsRotatingFileHandler):
+                handler.sync()
+            else:
+                handler.flush()
+
+    def stop(self):
+        """
+        Write out everything already queued, then stop and close the handlers
+        """
+        self.queue.put(self._STOP)
+        self.join()
+        for handler in self.handlers:
+            handler.close()
+
+
+def setup_logging(
+        path: str = "trainspotting.log",
+        level: int = logging.INFO,
+        max_bytes: int = 1_000_000,
+        backup_count: int = 3,
+        rotate_sec: float = 86400,
+        flush_sec: float = 5.0,
+        duplicate_window_sec: float = 60.0,
+        queue_size: int = 10000) -> TsLogListener:
+    """
+    Send every log record through a non-blocking queue to a listener thread that writes it to the console and to a
+    rotating, batch-flushed log file.  Replaces any handlers already on the root logger.
+    :param path: Log file, None for the console only
+    :param duplicate_window_sec: Repeats of a message within this many seconds are only counted, 0 to write all
+    :param queue_size: Records held for the listener before new ones are dropped
+    :return: The started listener, stop() it on exit to write out what's left
+    """
+    formatter = logging.Formatter("%(asctime)s %(levelname)s [%(name)s]: %(message)s")
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if path:
+        handlers.append(TsRotatingFileHandler(path, max_bytes, backup_count, rotate_sec))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(queue_size)
+    suppressor = TsDuplicateSuppressor(duplicate_window_sec) if duplicate_window_sec > 0 else None
+    listener = TsLogListener(log_queue, handlers, suppressor, flush_sec)
+    listener.start()
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(TsQueueHandler(log_queue))
+    root.setLevel(level)
+    return listener
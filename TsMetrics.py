@@ -0,0 +1,226 @@
+import bisect
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# seconds; spans a sub-millisecond pixel write up to a slow HTTP round trip
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIC_HELP = {
+    "ts_http_requests_total": "Requests sent to OneBusAway",
+    "ts_http_responses_total": "Responses received from OneBusAway, by status code",
+    "ts_http_rate_limited_total": "Responses that were 429 Too Many Requests",
+    "ts_http_failures_total": "Requests that got no response at all",
+    "ts_dup_trips_filtered_total": "Duplicate '_dup' trips dropped from the feed",
+    "ts_trains_skipped_total": "Trains that could not be placed on the strip, by reason",
+    "ts_frames_sent_total": "Frames transmitted to the strip",
+    "ts_frames_skipped_total": "Frames identical to the last one and not transmitted",
+    "ts_stage_seconds": "Wall time of each stage of the update pipeline",
+    "ts_log_records_dropped_total": "Log records dropped because the log listener had fallen behind",
+    "ts_log_records_suppressed_total": "Log records counted as repeats instead of written",
+    "ts_fanout_packets_sent_total": "Frame packets published to fan-out clients, by keyframe or delta",
+    "ts_fanout_frames_shown_total": "Frames received from the hub and shown",
+    "ts_fanout_deltas_dropped_total": "Deltas from the hub ignored as malformed or because their base frame was missed",
+    "ts_history_rows_written_total": "Train positions committed to the history store",
+    "ts_history_polls_dropped_total": "Polls not recorded because the history writer had fallen behind or failed",
+}
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Timer:
+    __slots__ = ("_metrics", "_name", "_labels", "_start")
+
+    def __init__(self, metrics, name: str, labels: dict):
+        self._metrics = metrics
+        self._name = name
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._metrics.observe(self._name, time.perf_counter() - self._start, **self._labels)
+        return False
+
+
+class TsMetrics:
+    """
+    Counters and timing histograms for every stage, endpoint and line.  Recording is a dict update under a lock, so
+    it's cheap enough for the per-poll hot path.  Exposed in Prometheus text format by TsMetricsServer and
+    summarized in the log by TsMetricsLogger.
+    """
+    _shared = None
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters = {}    # name -> {label key: value}
+        self._histograms = {}  # name -> {label key: _Histogram}
+        self._help = dict(METRIC_HELP)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls) -> "TsMetrics":
+        """
+        :return: The process-wide metrics every component records into
+        """
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram(self.buckets)
+            histogram.observe(value)
+
+    def timer(self, name: str, **labels) -> _Timer:
+        """
+        Context manager that observes the wall time of its block into a histogram
+        """
+        return _Timer(self, name, labels)
+
+    def get_counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get(name, {}).get(_label_key(labels), 0)
+
+    def render_prometheus(self) -> str:
+        """
+        :return: Every metric in the Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            for name in sorted(self._counters):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(self._counters[name].items()):
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+            for name in sorted(self._histograms):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in sorted(self._histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key, (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(key, (('le', '+Inf'),))} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram.sum}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """
+        :return: One line with every counter total and the mean of every histogram
+        """
+        parts = []
+        with self._lock:
+            for name in sorted(self._counters):
+                parts.append(f"{name}={sum(self._counters[name].values()):g}")
+            for name in sorted(self._histograms):
+                for key, histogram in sorted(self._histograms[name].items()):
+                    if histogram.count:
+                        label = ",".join(str(value) for _, value in key)
+                        parts.append(f"{name}[{label}]={histogram.sum / histogram.count * 1000:.1f}ms"
+                                     f"/{histogram.count}")
+        return " ".join(parts)
+
+
+class TsMetricsServer:
+    """
+    Serves TsMetrics at http://<host>:<port>/metrics from a daemon thread
+    """
+    def __init__(self, metrics: TsMetrics, port: int, host: str = "127.0.0.1"):
+        # http.server pulls in a good part of the email package, only pay for it when metrics are served
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_port
+        self._thread = threading.Thread(target=self._server.serve_forever, name="TsMetricsServer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        logger.info(f"Serving metrics on port {self.port}")
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class TsMetricsLogger(threading.Thread):
+    """
+    Logs TsMetrics.summary() every period_sec
+    """
+    def __init__(self, metrics: TsMetrics, period_sec: float):
+        super().__init__(name="TsMetricsLogger", daemon=True)
+        self.metrics = metrics
+        self.period_sec = period_sec
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.period_sec):
+            logger.info(f"metrics: {self.metrics.summary()}")
+
+    def stop(self):
+        self._stop_event.set()
@@ -4,7 +4,9 @@ import board
 import adafruit_pixelbuf
 from adafruit_raspberry_pi5_neopixel_write import neopixel_write
 
-from StApiClient import StApiResponseHolder
+from StApiResponseHolder import StApiResponseHolder
+from TsLineEngine import PALETTE_RGB, TsFrame
+from TsMetrics import TsMetrics
 
 
 class TsNeopixel(adafruit_pixelbuf.PixelBuf, ABC):
@@ -20,9 +22,140 @@ class TsNeopixel(adafruit_pixelbuf.PixelBuf, ABC):
         self._pin = pin
         self.response_holder = response_holder
         super().__init__(size=size, brightness=brightness, **kwargs)
+        # copy of the last buffer actually sent to the strip, None forces the next show() to transmit
+        self._last_frame = None
+        self.last_dirty_region = None
+        self.frames_sent = 0
+        self.frames_skipped = 0
+        self.metrics = TsMetrics.shared()
+        # set while a TsStripWorker process drives this strip, see attach_framebuffer()
+        self._frame_slot = None
+        self._frame_ready = None
+
+    def attach_framebuffer(self, slot, frame_ready):
+        """
+        Compose frames directly in a shared TsStripWorker.FrameSlot and hand them to a worker process instead of
+        transmitting from this one
+        :param slot: The strip's slot in the shared framebuffer
+        :param frame_ready: Event the worker waits on for new frames
+        """
+        slot.begin_write()
+        slot.frame[:] = self._post_brightness_buffer
+        slot.end_write()
+        self._post_brightness_buffer = slot.frame
+        self._frame_slot = slot
+        self._frame_ready = frame_ready
+
+    def detach_framebuffer(self):
+        """
+        Go back to transmitting from this process
+        """
+        if self._frame_slot is None:
+            return
+        self._post_brightness_buffer = bytearray(self._frame_slot.frame)
+        self._frame_slot = None
+        self._frame_ready = None
+
+    @adafruit_pixelbuf.PixelBuf.brightness.setter
+    def brightness(self, value: float):
+        adafruit_pixelbuf.PixelBuf.brightness.fset(self, value)
+        self._build_palette()
+
+    def _build_palette(self):
+        """
+        Precompile the palette for show_frame(): for every channel, a translation table from palette index to the
+        byte at that channel's position in the strip's byte order, already scaled by brightness.  The unscaled
+        tables keep PixelBuf's pre-brightness buffer in step, so reading pixels back and changing brightness work
+        as before.
+        """
+        brightness = self._brightness
+        self._channel_tables = []
+        for channel in range(self._bpp):
+            raw = bytearray(256)
+            scaled = bytearray(256)
+            for index, rgb in enumerate(PALETTE_RGB):
+                value = rgb[channel] if channel < len(rgb) else 0
+                raw[index] = value
+                scaled[index] = int(value * brightness)
+            self._channel_tables.append((self._byteorder[channel], bytes(raw), bytes(scaled)))
 
     def _transmit(self, buf):
-        neopixel_write(self._pin, buf)
+        if self._frame_slot is not None:
+            self._frame_slot.end_write()
+            self._frame_ready.set()
+        else:
+            neopixel_write(self._pin, buf)
+
+    def begin_frame(self):
+        """
+        Start composing a new frame off-screen.  Nothing is sent to the strip until show().
+        """
+        if self._frame_slot is not None:
+            self._frame_slot.begin_write()
+        self.fill(0)
+
+    def show(self, force: bool = False):
+        """
+        Transmit the composed frame, but only if it differs from the last frame sent
+        :param force: Transmit even if the frame is unchanged
+        """
+        frame = self._post_brightness_buffer
+        last_frame = self._last_frame
+        if not force and last_frame is not None and frame == last_frame:
+            self.frames_skipped += 1
+            self.metrics.inc("ts_frames_skipped_total", line=self._name)
+            if self._frame_slot is not None:
+                self._frame_slot.end_write()
+            return None
+        if last_frame is not None and len(last_frame) == len(frame):
+            self.last_dirty_region = self._find_dirty_region(last_frame, frame)
+        else:
+            self.last_dirty_region = (0, self._pixels - 1)
+        self._last_frame = bytearray(frame)
+        self.frames_sent += 1
+        self.metrics.inc("ts_frames_sent_total", line=self._name)
+        with self.metrics.timer("ts_stage_seconds", stage="transmit", line=self._name):
+            return self._transmit(frame)
+
+    def show_frame(self, frame: TsFrame):
+        """
+        Output backend entry point: draw a TsLineEngine frame on the strip.  The palette indices are translated
+        straight into the buffer that is transmitted, one pass per channel, instead of setting pixels one by one.
+        """
+        if self._frame_slot is not None:
+            self._frame_slot.begin_write()
+        pixels = frame.pixels
+        start = self._offset
+        stop = start + self._bytes
+        step = self._pixel_step
+        post_brightness = self._post_brightness_buffer
+        pre_brightness = self._pre_brightness_buffer
+        for position, raw, scaled in self._channel_tables:
+            post_brightness[start + position:stop:step] = pixels.translate(scaled)
+            if pre_brightness is not None:
+                pre_brightness[start + position:stop:step] = pixels.translate(raw)
+        self.show()
+
+    def _find_dirty_region(self, old: bytearray, new: bytearray):
+        # WS281x strips are a shift register, so the whole chain is always clocked out; the dirty span is kept for
+        # diagnostics only.
+        first = 0
+        last = len(new) - 1
+        while first <= last and old[first] == new[first]:
+            first += 1
+        if first > last:
+            return None
+        while old[last] == new[last]:
+            last -= 1
+        step = self._pixel_step
+        return (first - self._offset) // step, (last - self._offset) // step
+
+    def clear_all_pixels(self):
+        self.begin_frame()
+        self.show(force=True)
+
+    def get_frame_stats(self) -> dict:
+        return {"frames_sent": self.frames_sent, "frames_skipped": self.frames_skipped}
 
     @abstractmethod
     def update(self):
@@ -0,0 +1,64 @@
+import logging
+import time
+
+import board
+
+from StApiResponseHolder import StApiResponseHolder
+from StReferenceCache import StReferenceCache
+from TsLayout import TsLayout
+from TsLineEngine import TsLineEngine
+from TsNeopixel import TsNeopixel
+from TsOutput import TsOutput
+
+logger = logging.getLogger(__name__)
+
+class TsNeopixelLine(TsNeopixel):
+    """
+    A line drawn on a strip according to a TsLayout.  New lines only need a layout file, not a subclass.  All the
+    work up to the finished frame is done by a TsLineEngine, this class only puts its frames on the strip.
+    """
+    DIRECTION_SOUTH = TsLineEngine.DIRECTION_SOUTH
+    DIRECTION_NORTH = TsLineEngine.DIRECTION_NORTH
+
+    def __init__(
+            self,
+            name: str,
+            pin: board.pin,
+            layout: TsLayout,
+            response_holder: StApiResponseHolder,
+            brightness: float,
+            reference_cache: StReferenceCache = None,
+            trip_state_max_age_sec: float = 120.0,
+            positioning: str = TsLineEngine.POSITIONING_SCHEDULE,
+            predict_sec: float = 0.0,
+            **kwargs):
+        """
+        :param reference_cache: Stop/trip reference data, shared with every other line unless one is given
+        :param trip_state_max_age_sec: How long a trip's state is kept after it drops out of the responses
+        :param positioning: How trains are placed between stations, see TsLineEngine
+        :param predict_sec: How long after a poll trains are moved along between polls, 0 to leave them where the
+            poll put them.  See TsDeadReckoner.
+        """
+        self.layout = layout
+        self.outputs = []
+        self.engine = TsLineEngine(name, layout, reference_cache, trip_state_max_age_sec, positioning,
+                                   predict_sec)
+        super().__init__(name, pin, layout.num_pixels, response_holder, brightness=brightness, **kwargs)
+
+    def add_output(self, output: TsOutput):
+        """
+        :param output: Also shown every frame the strip is, e.g. a TsFanoutOutput
+        """
+        self.outputs.append(output)
+
+    def show_frame(self, frame):
+        super().show_frame(frame)
+        for output in self.outputs:
+            output.show_frame(frame)
+
+    def update(self):
+        frame = self.engine.poll(self.response_holder)
+        if frame is None:
+            frame = self.engine.advance(time.time())
+        if frame is not None:
+            self.show_frame(frame)
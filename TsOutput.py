@@ -0,0 +1,113 @@
+import os
+import struct
+import sys
+import zlib
+from abc import ABC, abstractmethod
+
+from TsLineEngine import PALETTE_NAMES, PALETTE_RGB, TsFrame
+
+
+class TsOutput(ABC):
+    """
+    Somewhere a TsLineEngine frame can be shown.  TsNeopixel strips take frames through the same show_frame(), the
+    outputs here need no hardware at all.
+    """
+    @abstractmethod
+    def show_frame(self, frame: TsFrame):
+        raise NotImplementedError("Must be subclassed")
+
+    def close(self):
+        pass
+
+
+class TsNullOutput(TsOutput):
+    """
+    Discards every frame, for soak tests and benchmarks
+    """
+    def __init__(self):
+        self.frames = 0
+
+    def show_frame(self, frame: TsFrame):
+        self.frames += 1
+
+
+class TsTerminalOutput(TsOutput):
+    """
+    Draws each frame as one line of 24-bit color blocks, or with print_colors()/print_names() as two columns folded
+    at the middle of the strip like the physical map
+    """
+    def __init__(self, stream=None, live: bool = True):
+        """
+        :param stream: Where to write, defaults to stdout
+        :param live: Draw every frame as it arrives, otherwise only keep it for print_colors()/print_names()
+        """
+        self.stream = stream if stream is not None else sys.stdout
+        self.live = live
+        self._pixels = None
+        self._positions = []
+
+    def show_frame(self, frame: TsFrame):
+        self._pixels = bytes(frame.pixels)
+        self._positions = list(frame.positions)
+        if self.live:
+            blocks = "".join(f"\x1b[38;2;{r};{g};{b}m█" for r, g, b in (PALETTE_RGB[i] for i in self._pixels))
+            self.stream.write(f"{blocks}\x1b[0m\n")
+            self.stream.flush()
+
+    def _print_columns(self, cells: list, width: int):
+        num_rows = len(cells) // 2
+        left = num_rows - 1  # due to 0 indexing
+        right = num_rows
+        for i in range(num_rows):
+            self.stream.write(f"[{cells[left - i]:<{width}}], [{cells[right + i]:>{width}}]\n")
+
+    def print_colors(self):
+        if self._pixels is None:
+            return
+        self._print_columns([PALETTE_NAMES[i] or "" for i in self._pixels], 11)
+
+    def print_names(self):
+        if self._pixels is None:
+            return
+        names = [""] * len(self._pixels)
+        for trip_id, pixel_idx, _, _ in self._positions:
+            names[pixel_idx] += trip_id
+        self._print_columns(names, 40)
+
+
+def encode_png(width: int, height: int, rgb_rows: list) -> bytes:
+    """
+    Minimal 8-bit RGB PNG encoder
+    :param rgb_rows: height rows of width * 3 bytes
+    :return: The PNG file contents
+    """
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+
+    # filter type 0 (none) in front of every row
+    raw = b"".join(b"\x00" + bytes(row) for row in rgb_rows)
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw, 6))
+            + chunk(b"IEND", b""))
+
+
+class TsPngOutput(TsOutput):
+    """
+    Writes every frame to <directory>/<prefix>-NNNNNN.png, one scale x scale square per pixel
+    """
+    def __init__(self, directory: str, scale: int = 4, prefix: str = "frame"):
+        self.directory = directory
+        self.scale = max(1, scale)
+        self.prefix = prefix
+        self.frames = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def show_frame(self, frame: TsFrame):
+        row = bytearray()
+        for index in frame.pixels:
+            row += bytes(PALETTE_RGB[index]) * self.scale
+        path = os.path.join(self.directory, f"{self.prefix}-{self.frames:06d}.png")
+        with open(path, "wb") as f:
+            f.write(encode_png(len(frame) * self.scale, self.scale, [row] * self.scale))
+        self.frames += 1
@@ -0,0 +1,101 @@
+import logging
+import threading
+import time
+from contextlib import nullcontext
+
+from StApiClient import StApiClient
+from TsProfiler import TsProfiler
+
+
+logger = logging.getLogger(__name__)
+
+class FetchWorker(threading.Thread):
+    """
+    Producer stage: polls the API on its own thread and drops each response into its StApiResponseHolder.  A slow
+    or hung HTTP call only delays the next poll, never a frame.
+    """
+    def __init__(self, api_client: StApiClient, period_sec: float, profiler: TsProfiler = None):
+        """
+        :param api_client: Client whose endpoints are polled
+        :param period_sec: Minimum seconds between polls, the server's Retry-After is honored if it's longer
+        :param profiler: If given, every poll is profiled as the "fetch" stage
+        """
+        super().__init__(name="TsFetchWorker", daemon=True)
+        self.api_client = api_client
+        self.period_sec = period_sec
+        self.profiler = profiler
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                with self.profiler.profile("fetch") if self.profiler else nullcontext():
+                    wait_seconds = self.api_client.fetch()
+            except Exception as e:
+                logger.error(f"Fetch failed: {e}")
+                wait_seconds = 0
+            self._stop_event.wait(max(self.period_sec, wait_seconds or 0))
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class RenderLoop:
+    """
+    Render stage: drives every registered line on a fixed cadence.  Lines pick up the newest response from their
+    holder and skip the frame if nothing changed since the last one.
+    """
+    def __init__(self, api_client: StApiClient, frame_period_sec: float, profiler: TsProfiler = None):
+        """
+        :param api_client: Client whose registered lines are rendered
+        :param frame_period_sec: Seconds between render passes
+        :param profiler: If given, every render pass is profiled as the "render" stage
+        """
+        self.api_client = api_client
+        self.frame_period_sec = frame_period_sec
+        self.profiler = profiler
+        self._stop_event = threading.Event()
+
+    def run(self):
+        next_frame = time.monotonic()
+        while not self._stop_event.is_set():
+            try:
+                with self.profiler.profile("render") if self.profiler else nullcontext():
+                    self.api_client.render()
+            except Exception as e:
+                logger.error(f"Render failed: {e}")
+            next_frame += self.frame_period_sec
+            delay = next_frame - time.monotonic()
+            if delay < 0:
+                # we fell behind, don't try to catch up with a burst of frames
+                next_frame = time.monotonic()
+                delay = 0
+            self._stop_event.wait(delay)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class TsPipeline:
+    """
+    Runs fetching and rendering as two decoupled stages.  They only share the StApiResponseHolder latest-value
+    slots, so neither stage ever waits on the other.
+    """
+    def __init__(self, api_client: StApiClient, poll_period_sec: float, frame_period_sec: float,
+                 profiler: TsProfiler = None):
+        self.fetcher = FetchWorker(api_client, poll_period_sec, profiler)
+        self.renderer = RenderLoop(api_client, frame_period_sec, profiler)
+
+    def run_forever(self):
+        """
+        Start the fetch worker and run the render loop on the calling thread until stop() is called
+        """
+        self.fetcher.start()
+        try:
+            self.renderer.run()
+        finally:
+            self.stop()
+
+    def stop(self):
+        self.renderer.stop()
+        self.fetcher.stop()
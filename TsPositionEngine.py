@@ -0,0 +1,172 @@
+import importlib.util
+import logging
+from array import array
+
+# numpy is optional, a pure Python pass over the same columns is used without it.  It also takes a while to import on
+# a Pi, so it's only imported when the first batch is computed rather than at startup.
+numpy = None
+HAVE_NUMPY = importlib.util.find_spec("numpy") is not None
+
+
+def _import_numpy():
+    global numpy
+    if numpy is None:
+        import numpy as module
+        numpy = module
+    return numpy
+
+from TsLayout import TsLayout
+
+
+logger = logging.getLogger(__name__)
+
+NO_PIXEL = -32768
+
+# Thresholds on (time to next stop / travel time into it) for how far short of the station a train is drawn
+NEAR_STATION_RATIO = 0.1
+MID_SEGMENT_RATIO = 0.6
+# A train may be clamped forward to its furthest pixel only if the server puts it within this many pixels of it
+MAX_CLAMP_DISTANCE = 3
+
+
+class PositionBatch:
+    """
+    One poll's trains as columns, ready for TsPositionEngine.compute().  Rows are in feed order.
+    """
+    def __init__(self):
+        self.trip_ids = []
+        self.directions = array("b")
+        self.station_pixels = array("h")
+        self.offsets = array("d")
+        self.travel_times = array("d")
+        self.previous_pixels = array("h")
+        self.fixed_pixels = array("h")
+
+    def append(self, trip_id: str, direction: int, station_pixel: int, offset: float, travel_time: float,
+               previous_pixel: int = NO_PIXEL, fixed_pixel: int = NO_PIXEL):
+        """
+        :param trip_id: Trip of the train
+        :param direction: OneBusAway directionId
+        :param station_pixel: Pixel of the station the train is heading to
+        :param offset: Seconds until the train reaches that station, 0 if it's there
+        :param travel_time: Scheduled seconds into that station, ignored if offset is 0
+        :param previous_pixel: Furthest pixel drawn for this train last poll, NO_PIXEL if none
+        :param fixed_pixel: Position already worked out some other way (e.g. TsDistanceIndex), used instead of the
+            segment thresholds.  NO_PIXEL if none.
+        """
+        self.trip_ids.append(trip_id)
+        self.directions.append(direction)
+        self.station_pixels.append(station_pixel)
+        self.offsets.append(offset)
+        self.travel_times.append(travel_time or 1)
+        self.previous_pixels.append(previous_pixel)
+        self.fixed_pixels.append(fixed_pixel)
+
+    def __len__(self):
+        return len(self.trip_ids)
+
+
+class PositionResult:
+    """
+    Output of TsPositionEngine.compute(), aligned with the batch rows
+        pixels: Pixel of each train
+        stopped: Non-zero if the train is standing at a station
+        valid: Zero if the train falls off the start of the strip and should not be drawn
+        collisions: Number of drawn trains on every pixel of the strip
+    """
+    __slots__ = ("pixels", "stopped", "valid", "collisions")
+
+    def __init__(self, pixels, stopped, valid, collisions):
+        self.pixels = pixels
+        self.stopped = stopped
+        self.valid = valid
+        self.collisions = collisions
+
+
+class TsPositionEngine:
+    """
+    Turns a PositionBatch into pixels in one pass over whole columns: segment thresholds, the no-going-backwards
+    clamp, station detection and per-pixel collision counts.  With numpy each step is a single vectorized operation,
+    without it the same columns are walked in plain Python.
+    """
+    def __init__(self, layout: TsLayout, use_numpy: bool = True):
+        """
+        :param layout: Layout of the strip the batches are drawn on
+        :param use_numpy: Use numpy if it is installed
+        """
+        self.layout = layout
+        self.use_numpy = use_numpy and HAVE_NUMPY
+        # station bitmap matrix, one row per direction; unknown directions use the outbound row like the layout does
+        self._direction_rows = {layout.outbound_direction: 0, layout.return_direction: 1}
+        self._bitmaps = [layout.station_bitmap(layout.outbound_direction),
+                         layout.station_bitmap(layout.return_direction)]
+        self._bitmap_matrix = None
+
+    def compute(self, batch: PositionBatch) -> PositionResult:
+        if self.use_numpy:
+            return self._compute_numpy(batch)
+        return self._compute_python(batch)
+
+    def _compute_numpy(self, batch: PositionBatch) -> PositionResult:
+        numpy = _import_numpy()
+        if self._bitmap_matrix is None:
+            self._bitmap_matrix = numpy.array([list(bitmap) for bitmap in self._bitmaps], dtype=numpy.bool_)
+        num_pixels = self.layout.num_pixels
+        if len(batch) == 0:
+            empty = numpy.zeros(0, dtype=numpy.int32)
+            return PositionResult(empty, empty.astype(numpy.bool_), empty.astype(numpy.bool_),
+                                  numpy.zeros(num_pixels, dtype=numpy.int32))
+        station = numpy.frombuffer(batch.station_pixels, dtype=numpy.int16).astype(numpy.int32)
+        offset = numpy.frombuffer(batch.offsets, dtype=numpy.float64)
+        travel = numpy.frombuffer(batch.travel_times, dtype=numpy.float64)
+        previous = numpy.frombuffer(batch.previous_pixels, dtype=numpy.int16).astype(numpy.int32)
+        fixed = numpy.frombuffer(batch.fixed_pixels, dtype=numpy.int16).astype(numpy.int32)
+        rows = numpy.fromiter((self._direction_rows.get(d, 0) for d in batch.directions),
+                              dtype=numpy.intp, count=len(batch))
+
+        at_station = offset == 0
+        ratio = offset / travel
+        back = numpy.where(ratio < NEAR_STATION_RATIO, 0, numpy.where(ratio < MID_SEGMENT_RATIO, 1, 2))
+        pixels = numpy.where(fixed != NO_PIXEL, fixed, station - numpy.where(at_station, 0, back))
+        valid = pixels >= 0
+
+        has_previous = previous != NO_PIXEL
+        clamp = has_previous & (numpy.abs(previous - pixels) < MAX_CLAMP_DISTANCE)
+        pixels = numpy.where(clamp, numpy.maximum(pixels, previous), pixels)
+        numpy.clip(pixels, 0, num_pixels - 1, out=pixels)
+
+        stopped = at_station & self._bitmap_matrix[rows, pixels]
+        collisions = numpy.bincount(pixels[valid], minlength=num_pixels).astype(numpy.int32)
+        return PositionResult(pixels, stopped, valid, collisions)
+
+    def _compute_python(self, batch: PositionBatch) -> PositionResult:
+        num_pixels = self.layout.num_pixels
+        count = len(batch)
+        pixels = array("h", bytes(2 * count))
+        stopped = bytearray(count)
+        valid = bytearray(count)
+        collisions = array("i", bytes(4 * num_pixels))
+        direction_rows = self._direction_rows
+        bitmaps = self._bitmaps
+        for i in range(count):
+            pixel = batch.fixed_pixels[i]
+            offset = batch.offsets[i]
+            if pixel == NO_PIXEL:
+                pixel = batch.station_pixels[i]
+                if offset != 0:
+                    ratio = offset / batch.travel_times[i]
+                    if ratio >= MID_SEGMENT_RATIO:
+                        pixel -= 2
+                    elif ratio >= NEAR_STATION_RATIO:
+                        pixel -= 1
+            if pixel < 0:
+                continue
+            previous = batch.previous_pixels[i]
+            if previous != NO_PIXEL and abs(previous - pixel) < MAX_CLAMP_DISTANCE:
+                pixel = max(pixel, previous)
+            pixel = min(pixel, num_pixels - 1)
+            pixels[i] = pixel
+            valid[i] = 1
+            stopped[i] = offset == 0 and bitmaps[direction_rows.get(batch.directions[i], 0)][pixel] != 0
+            collisions[pixel] += 1
+        return PositionResult(pixels, stopped, valid, collisions)
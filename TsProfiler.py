@@ -0,0 +1,197 @@
+import cProfile
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+# The CPU reports are narrowed to the project's own modules, i.e. the source files next to this one, so whatever
+# stage the work moves to stays in the report
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _current_rss_kib():
+    """
+    :return: Resident set size of this process in KiB, None where /proc isn't available
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class TsProfiler:
+    """
+    Opt-in profiling for long unattended runs.
+
+    - CPU: every pipeline stage gets its own cProfile.Profile, enabled around each cycle of that stage on the thread
+      that runs it.  Every 'cycles' cycles the window is written out and a new one starts.  Where the interpreter
+      allows only one active profiler, a cycle that overlaps another stage's is run unprofiled.
+    - Memory: a tracemalloc snapshot is taken every 'snapshot_sec', and written out with the top allocators and the
+      growth since the first snapshot.
+
+    Reports are plain text with one entry per line and no timings in the names, so consecutive windows can be
+    compared with diff.  The raw .prof of each CPU window is kept alongside for pstats/snakeviz.
+    """
+    def __init__(self, out_dir: str, cycles: int = 100, snapshot_sec: float = 600, top: int = 25,
+                 trace_frames: int = 1):
+        """
+        :param out_dir: Directory the reports are written to, created if needed
+        :param cycles: Cycles of a stage per CPU report
+        :param snapshot_sec: Seconds between memory snapshots, 0 disables memory tracing
+        :param top: Entries per report section
+        :param trace_frames: Stack frames tracemalloc keeps per allocation
+        """
+        self.out_dir = out_dir
+        self.cycles = cycles
+        self.snapshot_sec = snapshot_sec
+        self.top = top
+        self.trace_frames = trace_frames
+        self._profiles = {}   # stage -> [cProfile.Profile, cycles in this window, windows written]
+        self.skipped_cycles = 0
+        self._first_snapshot = None
+        self._last_snapshot = None
+        self._num_snapshots = 0
+        self._stop_event = threading.Event()
+        self._snapshot_thread = None
+        os.makedirs(out_dir, exist_ok=True)
+
+    def start(self):
+        """
+        Start memory tracing and the snapshot thread
+        """
+        if self.snapshot_sec <= 0:
+            return
+        tracemalloc.start(self.trace_frames)
+        self._snapshot_thread = threading.Thread(target=self._snapshot_loop, name="TsProfiler", daemon=True)
+        self._snapshot_thread.start()
+        logger.info(f"Profiling to {self.out_dir}: CPU every {self.cycles} cycles, memory every {self.snapshot_sec}s")
+
+    def stop(self):
+        """
+        Write out partial CPU windows and a final memory snapshot, then stop tracing
+        """
+        self._stop_event.set()
+        for stage, state in list(self._profiles.items()):
+            if state[1]:
+                self._write_cpu_report(stage, state)
+        if tracemalloc.is_tracing():
+            self.take_snapshot()
+            tracemalloc.stop()
+
+    @contextmanager
+    def profile(self, stage: str):
+        """
+        Profile one cycle of a stage.  Each stage must always be run from the same thread.
+        :param stage: Name of the stage, e.g. "fetch" or "render"
+        """
+        state = self._profiles.get(stage)
+        if state is None:
+            state = self._profiles[stage] = [cProfile.Profile(), 0, 0]
+        try:
+            state[0].enable()
+        except ValueError as e:
+            # From Python 3.12 only one profiler can be active in the process at a time, so when another stage is
+            # mid-cycle on its own thread this cycle goes unprofiled.  Profiling must never change what runs.
+            self.skipped_cycles += 1
+            if self.skipped_cycles == 1:
+                logger.warning(f"Not profiling a {stage} cycle, and counting any others in skipped_cycles: {e}")
+            enabled = False
+        else:
+            enabled = True
+        if not enabled:
+            yield
+            return
+        try:
+            yield
+        finally:
+            state[0].disable()
+            state[1] += 1
+            if state[1] >= self.cycles:
+                self._write_cpu_report(stage, state)
+
+    def _write_cpu_report(self, stage: str, state: list):
+        profile, num_cycles, window = state
+        base = os.path.join(self.out_dir, f"cpu-{stage}-{window:04d}")
+        try:
+            profile.dump_stats(base + ".prof")
+            with open(base + ".txt", "w") as f:
+                f.write(self._format_cpu_report(stage, profile, num_cycles))
+        except OSError as e:
+            logger.error(f"Could not write CPU profile {base}: {e}")
+        state[0] = cProfile.Profile()
+        state[1] = 0
+        state[2] += 1
+
+    def _format_cpu_report(self, stage: str, profile: cProfile.Profile, num_cycles: int) -> str:
+        stats = pstats.Stats(profile).stats
+        rows = []
+        for (filename, lineno, function), (_, num_calls, total_time, cumulative_time, _) in stats.items():
+            if os.path.dirname(os.path.abspath(filename)) != PROJECT_DIR:
+                continue
+            module = os.path.basename(filename)
+            rows.append((cumulative_time, total_time, num_calls, f"{module}:{lineno}({function})"))
+        rows.sort(key=lambda row: (-row[0], row[3]))
+        lines = [
+            f"# stage={stage} cycles={num_cycles} written={time.strftime('%Y-%m-%dT%H:%M:%S')}",
+            f"# top {self.top} by cumulative time in the modules of {PROJECT_DIR}",
+            f"{'function':<60} {'calls':>9} {'cum ms/cycle':>13} {'own ms/cycle':>13}",
+        ]
+        for cumulative_time, total_time, num_calls, name in rows[:self.top]:
+            lines.append(f"{name:<60} {num_calls:>9} {cumulative_time * 1000 / num_cycles:>13.3f} "
+                         f"{total_time * 1000 / num_cycles:>13.3f}")
+        return "\n".join(lines) + "\n"
+
+    def _snapshot_loop(self):
+        while not self._stop_event.wait(self.snapshot_sec):
+            self.take_snapshot()
+
+    def take_snapshot(self):
+        """
+        Take a tracemalloc snapshot and write its report
+        """
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+        if self._first_snapshot is None:
+            self._first_snapshot = snapshot
+        path = os.path.join(self.out_dir, f"mem-{self._num_snapshots:04d}.txt")
+        try:
+            with open(path, "w") as f:
+                f.write(self._format_memory_report(snapshot))
+        except OSError as e:
+            logger.error(f"Could not write memory report {path}: {e}")
+        self._last_snapshot = snapshot
+        self._num_snapshots += 1
+
+    def _format_memory_report(self, snapshot: tracemalloc.Snapshot) -> str:
+        traced, peak = tracemalloc.get_traced_memory()
+        rss = _current_rss_kib()
+        lines = [
+            f"# snapshot={self._num_snapshots} written={time.strftime('%Y-%m-%dT%H:%M:%S')} "
+            f"rss_kib={rss if rss is not None else 'n/a'} traced_kib={traced // 1024} peak_kib={peak // 1024}",
+            f"## top {self.top} allocators",
+        ]
+        for stat in snapshot.statistics("lineno")[:self.top]:
+            frame = stat.traceback[0]
+            lines.append(f"{os.path.basename(frame.filename)}:{frame.lineno} "
+                         f"size_kib={stat.size / 1024:.1f} count={stat.count}")
+        for title, baseline in (("since previous snapshot", self._last_snapshot),
+                                ("since first snapshot", self._first_snapshot)):
+            if baseline is None or baseline is snapshot:
+                continue
+            lines.append(f"## top {self.top} growth {title}")
+            for stat in snapshot.compare_to(baseline, "lineno")[:self.top]:
+                frame = stat.traceback[0]
+                lines.append(f"{os.path.basename(frame.filename)}:{frame.lineno} "
+                             f"size_diff_kib={stat.size_diff / 1024:+.1f} count_diff={stat.count_diff:+d}")
+        return "\n".join(lines) + "\n"
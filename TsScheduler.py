@@ -0,0 +1,246 @@
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from StApiDecoder import TripsForRoute
+
+
+logger = logging.getLogger(__name__)
+
+def parse_retry_after(value: str, now: float = None):
+    """
+    Parse a Retry-After header in either of its forms
+    :param value: Header value, delta-seconds ("120") or an HTTP-date ("Wed, 21 Oct 2026 07:28:00 GMT")
+    :param now: Unix time to measure an HTTP-date against, defaults to time.time()
+    :return: Seconds to wait (never negative), or None if the value can't be parsed
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        return max(0.0, float(int(value)))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if retry_at is None:
+        return None
+    now = time.time() if now is None else now
+    return max(0.0, retry_at.timestamp() - now)
+
+
+class TokenBucket:
+    """
+    Global request rate limiter shared by every endpoint.  Holds up to 'burst' tokens and refills at 'rate' per
+    second, each request spends one.
+    """
+    def __init__(self, rate: float, burst: int):
+        """
+        :param rate: Tokens added per second, i.e. the sustained request rate
+        :param burst: Maximum tokens held, i.e. how many requests may go out back to back
+        :raises ValueError: If rate isn't positive or burst is less than one, either would never let a request out
+        """
+        if not rate > 0:
+            raise ValueError(f"TokenBucket rate must be positive, got {rate}")
+        if burst < 1:
+            raise ValueError(f"TokenBucket burst must be at least 1, got {burst}")
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def try_acquire(self) -> bool:
+        """
+        :return: True if a token was spent, False if the bucket is empty
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def time_until_available(self) -> float:
+        """
+        :return: Seconds until a token will be available, 0 if one is available now
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def acquire(self, timeout: float = None) -> bool:
+        """
+        Block until a token is spent
+        :param timeout: Maximum seconds to wait, None to wait as long as it takes
+        :return: True if a token was spent, False on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.try_acquire():
+            wait = self.time_until_available()
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+        return True
+
+
+class Backoff:
+    """
+    Exponential backoff with full jitter: the n-th consecutive failure waits uniformly in [0, min(cap, base * 2^n)]
+    """
+    def __init__(self, base_sec: float = 2.0, cap_sec: float = 300.0, rng: random.Random = None):
+        self.base_sec = base_sec
+        self.cap_sec = cap_sec
+        self.failures = 0
+        self._rng = rng if rng is not None else random.Random()
+
+    def failure(self) -> float:
+        """
+        Record a failure
+        :return: Seconds to wait before trying again
+        """
+        ceiling = min(self.cap_sec, self.base_sec * (2 ** self.failures))
+        self.failures += 1
+        return self._rng.uniform(0, ceiling)
+
+    def success(self):
+        self.failures = 0
+
+
+class TsPollScheduler:
+    """
+    Decides when to poll next, to get the freshest data for the fewest requests.
+
+    - A global TokenBucket keeps all endpoints together under the API quota.
+    - Retry-After is honored in both its delta-seconds and HTTP-date forms.
+    - Errors back off exponentially with jitter.
+    - Otherwise polls are aligned to the server's own refresh: the reporting interval is learned from how each
+      trip's lastUpdateTime advances between polls.  The next poll lands just after the next update is expected,
+      measured on the server clock via the response's currentTime.
+    """
+    DEFAULT_UPDATE_INTERVAL_SEC = 10.0
+    MIN_UPDATE_INTERVAL_SEC = 2.0
+    MAX_UPDATE_INTERVAL_SEC = 120.0
+    INTERVAL_EWMA_ALPHA = 0.2
+    DEFAULT_RETRY_AFTER_SEC = 60
+
+    def __init__(
+            self,
+            min_period_sec: float,
+            max_period_sec: float,
+            rate_limiter: TokenBucket = None,
+            backoff: Backoff = None,
+            margin_sec: float = 1.0):
+        """
+        :param min_period_sec: Never poll more often than this
+        :param max_period_sec: Never wait longer than this between polls, unless the server asks us to
+        :param rate_limiter: Shared request budget, defaults to one request per second with a burst of 5
+        :param backoff: Backoff policy for errors, defaults to Backoff()
+        :param margin_sec: How long after an expected server update to poll
+        """
+        self.min_period_sec = min_period_sec
+        self.max_period_sec = max_period_sec
+        self.rate_limiter = rate_limiter if rate_limiter is not None else TokenBucket(rate=1.0, burst=5)
+        self.backoff = backoff if backoff is not None else Backoff()
+        self.margin_sec = margin_sec
+        self.update_interval_sec = self.DEFAULT_UPDATE_INTERVAL_SEC
+        self._retry_at = 0.0
+        self._error_retry_at = 0.0
+        self._expected_updates = {}   # endpoint -> local unix time the next server update is expected
+        self._last_update_times = {}  # trip id -> last seen lastUpdateTime (ms)
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout: float = None) -> bool:
+        """
+        Spend a request from the global budget, blocking until one is available
+        """
+        return self.rate_limiter.acquire(timeout)
+
+    def record_retry_after(self, retry_after: str, now: float = None) -> float:
+        """
+        :param retry_after: The Retry-After header of a 429, or None if it had none
+        :return: Seconds the server asked us to wait
+        """
+        now = time.time() if now is None else now
+        wait_seconds = parse_retry_after(retry_after, now)
+        if wait_seconds is None:
+            logger.error(f"Could not understand 'Retry-After' of {retry_after!r}.  "
+                         f"Retrying in {self.DEFAULT_RETRY_AFTER_SEC}s")
+            wait_seconds = self.DEFAULT_RETRY_AFTER_SEC
+        with self._lock:
+            self._retry_at = max(self._retry_at, now + wait_seconds)
+        return wait_seconds
+
+    def record_error(self, now: float = None) -> float:
+        """
+        Record a failed request (no response or a server error)
+        :return: Seconds the backoff will hold the next poll for
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            wait_seconds = self.backoff.failure()
+            self._error_retry_at = now + wait_seconds
+        return wait_seconds
+
+    def record_success(self, endpoint: str, feed: TripsForRoute = None, now: float = None):
+        """
+        Record a good response and learn the server's refresh cadence from it
+        :param endpoint: Endpoint that responded
+        :param feed: The decoded response, if available
+        :param now: Local unix time the response was received
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self.backoff.success()
+            self._error_retry_at = 0.0
+            if feed is None or not feed.current_time:
+                return
+            newest_update_ms = 0
+            for train in feed.trains:
+                update_ms = train.last_update_time
+                if not update_ms:
+                    continue
+                newest_update_ms = max(newest_update_ms, update_ms)
+                previous_ms = self._last_update_times.get(train.trip_id)
+                if previous_ms is not None and update_ms > previous_ms:
+                    sample = min(self.MAX_UPDATE_INTERVAL_SEC,
+                                 max(self.MIN_UPDATE_INTERVAL_SEC, (update_ms - previous_ms) / 1000))
+                    self.update_interval_sec += self.INTERVAL_EWMA_ALPHA * (sample - self.update_interval_sec)
+                self._last_update_times[train.trip_id] = update_ms
+            # forget trips that weren't in this response so the table doesn't grow forever
+            if len(self._last_update_times) > 4 * max(1, len(feed.trains)):
+                seen = {train.trip_id for train in feed.trains}
+                self._last_update_times = {k: v for k, v in self._last_update_times.items() if k in seen}
+            if newest_update_ms:
+                # convert the server's clock to ours via the skew measured from currentTime
+                skew = feed.current_time / 1000 - now
+                self._expected_updates[endpoint] = newest_update_ms / 1000 + self.update_interval_sec - skew
+
+    def next_delay(self, now: float = None) -> float:
+        """
+        :return: Seconds to wait before the next poll
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            delay = self.min_period_sec
+            if self._expected_updates:
+                expected = min(self._expected_updates.values()) + self.margin_sec - now
+                # the first expected refresh that doesn't violate the minimum period
+                while expected < self.min_period_sec:
+                    expected += self.update_interval_sec
+                delay = min(self.max_period_sec, expected)
+            delay = max(delay, self._error_retry_at - now, self._retry_at - now)
+        return max(delay, self.rate_limiter.time_until_available())
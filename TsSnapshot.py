@@ -0,0 +1,168 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from StReferenceCache import StReferenceCache
+
+
+logger = logging.getLogger(__name__)
+
+
+class TsSnapshot:
+    """
+    Keeps the last good frame, trip state and reference tables of every line on disk, so that after a restart the
+    strips can show a stale-but-plausible picture straight away instead of staying dark until the first poll.
+
+    A save is triggered by a frame a line composes from a response, at most once every min_interval_sec, and is
+    skipped if nothing in the state has changed since the last one, to spare the SD card.  The state is serialized
+    on the caller's thread, where it is consistent, and written by a background thread to a temporary file that is
+    synced to disk before it replaces the snapshot, so a crash or power cut mid-write leaves the previous snapshot
+    intact.
+    """
+    VERSION = 1
+
+    def __init__(self, path: str, reference_cache: StReferenceCache = None, max_age_sec: float = 1800,
+                 min_interval_sec: float = 60):
+        """
+        :param path: Snapshot file
+        :param reference_cache: Reference tables to save and restore, defaults to the shared cache
+        :param max_age_sec: Snapshots older than this are too stale to show and are ignored on restore
+        :param min_interval_sec: Frames within this many seconds of the last save don't trigger another, the state
+            they leave behind is saved by the next frame after that or on close()
+        """
+        self.path = path
+        self.reference_cache = reference_cache if reference_cache is not None else StReferenceCache.shared()
+        self.max_age_sec = max_age_sec
+        self.min_interval_sec = min_interval_sec
+        self.lines = {}
+        self._last_save = None
+        self._unsaved = False
+        self._last_content = None
+        self._pending = None
+        self._condition = threading.Condition()
+        self._closed = False
+        self._writer = threading.Thread(target=self._write_loop, name="TsSnapshot", daemon=True)
+        self._writer.start()
+
+    def add_line(self, line):
+        """
+        :param line: A TsNeopixelLine or TsHeadlessLine, saved on every new frame and restored by name
+        """
+        self.lines[line.engine.name] = line
+        line.engine.add_frame_listener(self._on_frame)
+
+    def _on_frame(self, engine, frame):
+        if self._last_save is not None and time.monotonic() - self._last_save < self.min_interval_sec:
+            self._unsaved = True
+            return
+        self.save()
+
+    def save(self):
+        """
+        Queue the current state for writing, replacing any state not written yet.  Nothing is written if the state
+        is the same as the last one saved.
+        """
+        self._last_save = time.monotonic()
+        self._unsaved = False
+        state = {
+            "version": self.VERSION,
+            "references": self.reference_cache.export_state(),
+            "lines": {name: line.engine.export_state() for name, line in self.lines.items()},
+        }
+        content = json.dumps(state, separators=(",", ":"))
+        if content == self._last_content:
+            return
+        self._last_content = content
+        state["saved_at"] = time.time()
+        data = json.dumps(state, separators=(",", ":"))
+        with self._condition:
+            self._pending = data
+            self._condition.notify()
+
+    def _write_loop(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending is not None or self._closed)
+                data, self._pending = self._pending, None
+                if data is None:
+                    return
+            self._write(data)
+
+    def _write(self, data: str):
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, "w") as f:
+                f.write(data)
+                # the data must be on the card before the rename is, or a power cut can leave an empty snapshot
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+            self._sync_directory()
+        except OSError as e:
+            logger.error(f"Could not write snapshot {self.path}: {e}")
+
+    def _sync_directory(self):
+        # makes the rename itself survive a power cut; not every platform can open a directory
+        try:
+            fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def restore(self, now: float = None) -> int:
+        """
+        Load the snapshot into the reference cache and every added line, and show each line's saved frame
+        :return: Number of lines restored
+        """
+        now = time.time() if now is None else now
+        try:
+            with open(self.path, "r") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read snapshot {self.path}: {e}")
+            return 0
+        if state.get("version") != self.VERSION:
+            logger.warning(f"Snapshot {self.path} is version {state.get('version')}, ignoring it")
+            return 0
+        age = now - state.get("saved_at", 0)
+        if age > self.max_age_sec:
+            logger.info(f"Snapshot {self.path} is {age:.0f}s old, too stale to show")
+            return 0
+
+        self.reference_cache.restore_state(state.get("references", {}), now)
+        restored = 0
+        for name, line_state in state.get("lines", {}).items():
+            line = self.lines.get(name)
+            if line is None:
+                continue
+            try:
+                frame = line.engine.restore_state(line_state, now)
+            except (KeyError, TypeError, ValueError) as e:
+                logger.warning(f"Could not restore {name} from {self.path}: {e}")
+                continue
+            if frame is not None:
+                line.show_frame(frame)
+                restored += 1
+        logger.info(f"Restored {restored} line(s) from a {age:.0f}s old snapshot")
+        return restored
+
+    def close(self):
+        """
+        Save the state of any frames since the last save, write out anything pending and stop the writer.  Call it
+        once the lines have stopped updating.
+        """
+        if self._unsaved:
+            self.save()
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._writer.join()
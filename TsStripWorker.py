@@ -0,0 +1,196 @@
+import logging
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+
+
+logger = logging.getLogger(__name__)
+
+_SEQUENCE_BYTES = 8
+# spawn, the parent already has threads running by the time the workers start and forking them is unsafe
+_CONTEXT = multiprocessing.get_context("spawn")
+
+
+def _aligned(size: int) -> int:
+    return (size + _SEQUENCE_BYTES - 1) // _SEQUENCE_BYTES * _SEQUENCE_BYTES
+
+
+class FrameSlot:
+    """
+    One strip's frame in a TsFrameBuffer, guarded by a seqlock.  The sequence is odd while the single writer is
+    composing and even once the frame is complete; readers copy the frame and keep the copy only if the sequence was
+    even and unchanged across the copy.
+    """
+    def __init__(self, buf: memoryview, offset: int, length: int):
+        # 8 aligned bytes, so the sequence is stored and loaded in one go
+        self._sequence = buf[offset:offset + _SEQUENCE_BYTES].cast("Q")
+        self.frame = buf[offset + _SEQUENCE_BYTES:offset + _SEQUENCE_BYTES + length]
+
+    @property
+    def sequence(self) -> int:
+        return self._sequence[0]
+
+    def begin_write(self):
+        if self._sequence[0] % 2 == 0:
+            self._sequence[0] += 1
+
+    def end_write(self):
+        if self._sequence[0] % 2 == 1:
+            self._sequence[0] += 1
+
+    def read_into(self, dest: bytearray):
+        """
+        :param dest: Receives a consistent copy of the frame
+        :return: The sequence of the copied frame, or None if the writer was busy and the copy must be retried
+        """
+        before = self._sequence[0]
+        if before % 2 == 1:
+            return None
+        dest[:] = self.frame
+        if self._sequence[0] != before:
+            return None
+        return before
+
+    def release(self):
+        self._sequence.release()
+        self.frame.release()
+
+
+class TsFrameBuffer:
+    """
+    A shared memory segment holding one FrameSlot per strip.  The render stage composes frames directly in the
+    slots, so handing a frame to a strip worker process costs no copy on the writer's side.
+    """
+    def __init__(self, lengths: list, name: str = None):
+        """
+        :param lengths: Byte length of each strip's frame
+        :param name: Segment to attach to, None creates a new one
+        """
+        self.lengths = list(lengths)
+        offsets = []
+        size = 0
+        for length in self.lengths:
+            offsets.append(size)
+            size += _SEQUENCE_BYTES + _aligned(length)
+        self.owner = name is None
+        self._shm = shared_memory.SharedMemory(name=name, create=self.owner, size=max(size, _SEQUENCE_BYTES))
+        self.name = self._shm.name
+        self._buf = self._shm.buf
+        self.slots = [FrameSlot(self._buf, offset, length) for offset, length in zip(offsets, self.lengths)]
+
+    def close(self):
+        for slot in self.slots:
+            slot.release()
+        self.slots = []
+        self._buf.release()
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
+
+
+class TsStripWorker(_CONTEXT.Process):
+    """
+    Drives a group of strips from its own process, so GC pauses and JSON decoding in the main process never delay
+    neopixel_write.  Waits for the render stage to signal a new frame, copies every slot that changed out of the
+    shared framebuffer and transmits it if it differs from what is already on the strip.
+    """
+    STOP_POLL_SEC = 0.5
+
+    def __init__(self, framebuffer_name: str, lengths: list, strips: list, cpu: int = None):
+        """
+        :param framebuffer_name: Shared memory segment of the TsFrameBuffer
+        :param lengths: Frame lengths of every slot in the framebuffer
+        :param strips: (slot index, pin) of every strip this worker drives
+        :param cpu: Core to pin the worker to, None to leave it to the scheduler
+        """
+        super().__init__(name=f"TsStripWorker-{'-'.join(str(index) for index, _ in strips)}", daemon=True)
+        self.framebuffer_name = framebuffer_name
+        self.lengths = lengths
+        self.strips = strips
+        self.cpu = cpu
+        self.frame_ready = _CONTEXT.Event()
+        self.stop_event = _CONTEXT.Event()
+
+    def run(self):
+        from adafruit_raspberry_pi5_neopixel_write import neopixel_write
+
+        if self.cpu is not None and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, {self.cpu})
+        framebuffer = TsFrameBuffer(self.lengths, name=self.framebuffer_name)
+        try:
+            states = [(framebuffer.slots[index], pin, bytearray(self.lengths[index]), [None, None])
+                      for index, pin in self.strips]
+            while not self.stop_event.is_set():
+                self.frame_ready.wait(self.STOP_POLL_SEC)
+                self.frame_ready.clear()
+                self._transmit_changed(states, neopixel_write)
+            # pick up the frame published just before stopping, usually the strip being cleared
+            self._transmit_changed(states, neopixel_write)
+        finally:
+            framebuffer.close()
+
+    @staticmethod
+    def _transmit_changed(states: list, write):
+        for slot, pin, frame, last in states:
+            # last is [sequence read, frame sent]
+            sequence = slot.sequence
+            if sequence == last[0]:
+                continue
+            sequence = slot.read_into(frame)
+            if sequence is None:
+                # caught the writer mid-frame, its end of frame signal will bring us back
+                continue
+            last[0] = sequence
+            if frame != last[1]:
+                write(pin, frame)
+                last[1] = bytes(frame)
+
+
+class TsStripWorkerPool:
+    """
+    Moves the output of a set of TsNeopixel strips into TsStripWorker processes, grouped round-robin over
+    num_workers workers.  Each worker is pinned to its own core where there are enough of them, leaving the first
+    core to the fetch and render threads.
+    """
+    def __init__(self, strips: list, num_workers: int = None, pin_cpus: bool = True):
+        """
+        :param strips: TsNeopixel strips to drive, in the order they are assigned to workers
+        :param num_workers: Worker processes, defaults to one per strip
+        :param pin_cpus: Pin each worker to a core
+        """
+        num_workers = len(strips) if not num_workers else min(num_workers, len(strips))
+        self.strips = list(strips)
+        self.framebuffer = TsFrameBuffer([len(strip._post_brightness_buffer) for strip in self.strips])
+        cpus = self._worker_cpus(num_workers) if pin_cpus else [None] * num_workers
+        groups = [[] for _ in range(num_workers)]
+        for index, strip in enumerate(self.strips):
+            groups[index % num_workers].append((index, strip._pin))
+        self.workers = [TsStripWorker(self.framebuffer.name, self.framebuffer.lengths, group, cpu)
+                        for group, cpu in zip(groups, cpus)]
+        for index, strip in enumerate(self.strips):
+            strip.attach_framebuffer(self.framebuffer.slots[index], self.workers[index % num_workers].frame_ready)
+
+    @staticmethod
+    def _worker_cpus(num_workers: int) -> list:
+        if not hasattr(os, "sched_getaffinity"):
+            return [None] * num_workers
+        cpus = sorted(os.sched_getaffinity(0))
+        if len(cpus) > 1:
+            cpus = cpus[1:]
+        return [cpus[i % len(cpus)] for i in range(num_workers)]
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+            logger.info(f"Started {worker.name} on cpu {worker.cpu}")
+
+    def stop(self, timeout: float = 2.0):
+        for worker in self.workers:
+            worker.stop_event.set()
+            worker.frame_ready.set()
+        for worker in self.workers:
+            if worker.pid is not None:
+                worker.join(timeout)
+        for strip in self.strips:
+            strip.detach_framebuffer()
+        self.framebuffer.close()
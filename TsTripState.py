@@ -0,0 +1,173 @@
+import logging
+import sys
+from array import array
+
+from TsPositionEngine import NO_PIXEL
+
+
+logger = logging.getLogger(__name__)
+
+NO_DIRECTION = -1
+
+
+class TsTripStateStore:
+    """
+    Per-trip state of one line in preallocated columns.  Trip ids are interned once into a slot index; every poll
+    after that only updates numbers in place, so memory and GC pressure stay flat no matter how many trips the feed
+    churns through.  Trips not seen for max_age_sec are evicted and their slots reused.
+
+    Columns, indexed by slot:
+        last_pixel: Furthest pixel the train was drawn at, NO_PIXEL if it wasn't drawn
+        direction: Last known directionId, NO_DIRECTION if none
+        last_seen: Local unix time the trip was last in a response
+        smoothed_pixel: Exponentially smoothed position in pixels, for drawing between polls
+
+    Also holds the per-pixel occupancy counters of the frame being drawn, zeroed in place for each frame.
+    """
+    SMOOTHING_ALPHA = 0.5
+
+    def __init__(self, num_pixels: int, max_age_sec: float = 120.0, capacity: int = 64, max_capacity: int = 1024):
+        """
+        :param num_pixels: Pixels on the strip, sizes the occupancy counters
+        :param max_age_sec: Trips not seen for this long are evicted
+        :param capacity: Slots allocated up front, doubled as needed
+        :param max_capacity: Slots never grow past this, the least recently seen trip is evicted instead
+        """
+        self.max_age_sec = max_age_sec
+        self.max_capacity = max(1, max_capacity)
+        self._slots = {}        # interned trip id -> slot
+        self._trip_ids = []     # slot -> trip id, None if free
+        self._free = []
+        self.last_pixel = array("h")
+        self.direction = array("b")
+        self.last_seen = array("d")
+        self.smoothed_pixel = array("d")
+        self._grow(min(max(1, capacity), self.max_capacity))
+        self._pixel_counts = array("H", bytes(2 * num_pixels))
+        self._zero_counts = array("H", bytes(2 * num_pixels))
+
+    def _grow(self, capacity: int):
+        old = len(self._trip_ids)
+        extra = capacity - old
+        self._trip_ids.extend([None] * extra)
+        self.last_pixel.extend([NO_PIXEL] * extra)
+        self.direction.extend([NO_DIRECTION] * extra)
+        self.last_seen.extend([0.0] * extra)
+        self.smoothed_pixel.extend([0.0] * extra)
+        # pop() hands out the lowest free slot first
+        self._free.extend(range(capacity - 1, old - 1, -1))
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, trip_id: str):
+        return trip_id in self._slots
+
+    @property
+    def capacity(self) -> int:
+        return len(self._trip_ids)
+
+    def previous_pixel(self, trip_id: str) -> int:
+        """
+        :return: Furthest pixel the trip was drawn at, NO_PIXEL if it is unknown or wasn't drawn
+        """
+        slot = self._slots.get(trip_id)
+        return NO_PIXEL if slot is None else self.last_pixel[slot]
+
+    def find_slot(self, trip_id: str):
+        """
+        :return: The slot of a trip without marking it as seen, None if it is unknown
+        """
+        return self._slots.get(trip_id)
+
+    def slot_for(self, trip_id: str, now: float) -> int:
+        """
+        Find or allocate the slot of a trip and mark it as seen
+        :return: The slot index
+        """
+        slot = self._slots.get(trip_id)
+        if slot is None:
+            slot = self._allocate(sys.intern(trip_id), now)
+        self.last_seen[slot] = now
+        return slot
+
+    def _allocate(self, trip_id: str, now: float) -> int:
+        if not self._free:
+            self.evict_stale(now)
+        if not self._free:
+            if self.capacity < self.max_capacity:
+                self._grow(min(2 * self.capacity, self.max_capacity))
+            else:
+                self._release(min(self._slots.values(), key=self.last_seen.__getitem__))
+        slot = self._free.pop()
+        self._slots[trip_id] = slot
+        self._trip_ids[slot] = trip_id
+        return slot
+
+    def _release(self, slot: int):
+        del self._slots[self._trip_ids[slot]]
+        self._trip_ids[slot] = None
+        self.last_pixel[slot] = NO_PIXEL
+        self.direction[slot] = NO_DIRECTION
+        self.smoothed_pixel[slot] = 0.0
+        self._free.append(slot)
+
+    def record(self, slot: int, pixel: int, direction: int):
+        """
+        Store where a trip was drawn this poll
+        :param pixel: Pixel drawn at, NO_PIXEL if it wasn't drawn
+        """
+        previous = self.last_pixel[slot]
+        self.last_pixel[slot] = pixel
+        self.direction[slot] = direction
+        if pixel == NO_PIXEL:
+            return
+        if previous == NO_PIXEL:
+            self.smoothed_pixel[slot] = pixel
+        else:
+            self.smoothed_pixel[slot] += self.SMOOTHING_ALPHA * (pixel - self.smoothed_pixel[slot])
+
+    def evict_stale(self, now: float) -> int:
+        """
+        :return: Number of trips evicted for not being seen in max_age_sec
+        """
+        cutoff = now - self.max_age_sec
+        last_seen = self.last_seen
+        stale = [slot for slot in self._slots.values() if last_seen[slot] < cutoff]
+        for slot in stale:
+            self._release(slot)
+        return len(stale)
+
+    def export_state(self) -> list:
+        """
+        :return: [trip id, last pixel, direction, last seen, smoothed pixel] of every trip
+        """
+        return [[trip_id, self.last_pixel[slot], self.direction[slot], self.last_seen[slot], self.smoothed_pixel[slot]]
+                for trip_id, slot in self._slots.items()]
+
+    def restore_state(self, rows: list, now: float):
+        """
+        Load trips saved by export_state(), dropping any that have gone stale since
+        """
+        cutoff = now - self.max_age_sec
+        for trip_id, pixel, direction, last_seen, smoothed_pixel in rows:
+            if last_seen < cutoff:
+                continue
+            slot = self.slot_for(trip_id, last_seen)
+            self.last_pixel[slot] = pixel
+            self.direction[slot] = direction
+            self.smoothed_pixel[slot] = smoothed_pixel
+
+    def reset_pixel_counts(self):
+        """
+        Zero the occupancy counters for a new frame
+        """
+        self._pixel_counts[:] = self._zero_counts
+
+    def count_pixel(self, pixel: int) -> int:
+        """
+        :return: How many trains were already on the pixel in this frame, before this one
+        """
+        count = self._pixel_counts[pixel]
+        self._pixel_counts[pixel] = count + 1
+        return count
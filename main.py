@@ -1,78 +1,266 @@
 import logging
 import os
-import time
 
-#from adafruit_blinka.microcontroller.amlogic.meson_g12_common.pin import board
-import board
 from dotenv import load_dotenv
 
-from StApiClient import StApiClient
-from StApiResponseHolder import StApiResponseHolder
-from TsNeopixel import TsNeopixel
-from TsNeopixel1Line import TsNeopixel1Line
+# Everything else is imported where it's first needed, so the strip can show the last snapshot before the network
+# stack, numpy and the rest have been loaded
 
 def setup_logging():
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s %(levelname)s [%(name)s]: %(message)s",
-        handlers=[
-            logging.FileHandler("trainspotting.log"),
-            logging.StreamHandler()
-        ]
+    """
+    Log through a non-blocking queue to the console and a rotating, batch-flushed trainspotting.log, see TsLogging
+    :return: The log listener, stopped last on exit
+    """
+    from TsLogging import setup_logging as setup_log_pipeline
+    return setup_log_pipeline(
+        path=os.getenv("TRAIN_LOG_PATH", "trainspotting.log"),
+        max_bytes=int(os.getenv("TRAIN_LOG_MAX_BYTES", 1_000_000)),
+        backup_count=int(os.getenv("TRAIN_LOG_BACKUPS", 3)),
+        rotate_sec=float(os.getenv("TRAIN_LOG_ROTATE_SEC", 86400)),
+        flush_sec=float(os.getenv("TRAIN_LOG_FLUSH_SEC", 5)),
+        duplicate_window_sec=float(os.getenv("TRAIN_LOG_DUPLICATE_SEC", 60)),
     )
 
 
 class Trainspotting:
     def __init__(
             self,
-            api_key: str
+            api_key: str,
+            concurrent_fetch: bool = False,
+            scheduler: "TsPollScheduler" = None
     ):
+        from StApiClient import StApiClient
+
         # set up interface
         if api_key == "none":
             raise EnvironmentError("No API key provided.")
-        self.api_client = StApiClient(api_key)
+        self.api_client = StApiClient(api_key, concurrent=concurrent_fetch, scheduler=scheduler)
+        self.pipeline = None
+        self.recorder = None
+        self.metrics_server = None
+        self.metrics_logger = None
+        self.profiler = None
+        self.strip_workers = None
+        self.snapshot = None
+        self.frame_publisher = None
+        self.history = None
+
+    def record_to(self, archive_path: str):
+        """
+        Capture every raw server response into an archive that StApiArchive.StApiReplay can play back
+        :param archive_path: Archive file, appended to if it exists
+        """
+        from StApiArchive import StApiRecorder
+        self.recorder = StApiRecorder(self.api_client, archive_path)
+
+    def serve_metrics(self, port: int):
+        """
+        Expose per-stage timings and counters in Prometheus text format on http://127.0.0.1:<port>/metrics
+        """
+        from TsMetrics import TsMetrics, TsMetricsServer
+        self.metrics_server = TsMetricsServer(TsMetrics.shared(), port)
+        self.metrics_server.start()
+
+    def log_metrics(self, period_sec: float):
+        """
+        Log a one-line metrics summary every period_sec
+        """
+        from TsMetrics import TsMetrics, TsMetricsLogger
+        self.metrics_logger = TsMetricsLogger(TsMetrics.shared(), period_sec)
+        self.metrics_logger.start()
+
+    def profile_to(self, out_dir: str, cycles: int, snapshot_sec: float):
+        """
+        Write CPU profiles of every 'cycles' fetch/render cycles and tracemalloc reports every snapshot_sec to out_dir
+        """
+        from TsProfiler import TsProfiler
+        self.profiler = TsProfiler(out_dir, cycles=cycles, snapshot_sec=snapshot_sec)
+        self.profiler.start()
 
-    def add_endpoint(self, route: str, response_holder: StApiResponseHolder):
+    def add_endpoint(self, route: str, response_holder: "StApiResponseHolder"):
         self.api_client.add_trips_for_route_query(route, response_holder)
 
-    def add_line(self, line: TsNeopixel, response_holder: StApiResponseHolder):
+    def add_line(self, line: "TsNeopixel", response_holder: "StApiResponseHolder"):
         self.api_client.add_neopixel(line, response_holder)
 
+    def use_strip_workers(self, num_workers: int = None):
+        """
+        Transmit to the strips from dedicated worker processes fed through shared memory, so adding a strip never
+        slows down the others.  Call after every line is added and before run().
+        :param num_workers: Worker processes the strips are spread over, defaults to one per strip
+        """
+        from TsStripWorker import TsStripWorkerPool
+        self.strip_workers = TsStripWorkerPool(list(self.api_client.neopixels), num_workers)
+        self.strip_workers.start()
+
+    def record_history(self, path: str):
+        """
+        Keep every polled train position in a TsHistoryStore for later analysis.  Call after every line is added.
+        :param path: SQLite database, appended to if it exists
+        """
+        from TsHistory import TsHistoryStore
+        self.history = TsHistoryStore(path)
+        for line in self.api_client.neopixels:
+            self.history.add_line(line)
+
+    def publish_frames(self, group: str = None, port: int = None, keyframe_sec: float = 2.0):
+        """
+        Act as a fan-out hub: send every frame of every line to TsFanoutClients over UDP.  Call after every line is
+        added.
+        :param group: Multicast group, or the address of a single client, defaults to TsFanout.DEFAULT_GROUP
+        :param port: UDP port, defaults to TsFanout.DEFAULT_PORT
+        """
+        from TsFanout import DEFAULT_GROUP, DEFAULT_PORT, TsFramePublisher
+        self.frame_publisher = TsFramePublisher(group or DEFAULT_GROUP, port or DEFAULT_PORT,
+                                                keyframe_sec=keyframe_sec)
+        for line in self.api_client.neopixels:
+            line.add_output(self.frame_publisher.output_for(line.engine.name))
+        self.frame_publisher.start()
+
     def update(self):
         return self.api_client.update()
 
+    def run(self, poll_period_sec: float, frame_period_sec: float):
+        """
+        Poll and render forever, with fetching on a background thread so a slow network never freezes the strip
+        :param poll_period_sec: Minimum seconds between API polls
+        :param frame_period_sec: Seconds between render passes
+        """
+        from TsPipeline import TsPipeline
+        self.pipeline = TsPipeline(self.api_client, poll_period_sec, frame_period_sec, self.profiler)
+        self.pipeline.run_forever()
+
+    def close(self):
+        if self.pipeline is not None:
+            self.pipeline.stop()
+        if self.strip_workers is not None:
+            self.strip_workers.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        if self.metrics_logger is not None:
+            self.metrics_logger.stop()
+        if self.profiler is not None:
+            self.profiler.stop()
+        if self.snapshot is not None:
+            self.snapshot.close()
+        if self.frame_publisher is not None:
+            self.frame_publisher.stop()
+        if self.history is not None:
+            self.history.close()
+        self.api_client.close()
+
+
+def run_fanout_client(lines: list, group: str = None, port: int = None):
+    """
+    Show the frames a hub publishes (see Trainspotting.publish_frames) on lines until interrupted, without polling
+    the API at all
+    """
+    from TsFanout import DEFAULT_GROUP, DEFAULT_PORT, TsFanoutClient
+    client = TsFanoutClient(lines, group or DEFAULT_GROUP, port or DEFAULT_PORT)
+    try:
+        client.run_forever()
+    finally:
+        client.stop()
+
 
 if __name__ == "__main__":
-    setup_logging()
     load_dotenv()
+    log_listener = setup_logging()
 
     env_sample_period_sec = int(os.getenv("TRAIN_PERIOD_SEC", 6))
     env_sample_period_sec = min(60, max(env_sample_period_sec, 5))  # limit update period to [5, 60] seconds
     env_api_key = os.getenv("OBA_API_KEY", "none")
+    env_frame_period_sec = float(os.getenv("TRAIN_FRAME_PERIOD_SEC", 0.1))
+    env_concurrent_fetch = os.getenv("TRAIN_CONCURRENT_FETCH", "1") != "0"
+    env_record_path = os.getenv("TRAIN_RECORD_PATH")
+    env_api_rate_per_sec = float(os.getenv("TRAIN_API_RATE_PER_SEC", 1.0))
+    env_metrics_port = int(os.getenv("TRAIN_METRICS_PORT", 0))
+    env_metrics_log_sec = float(os.getenv("TRAIN_METRICS_LOG_SEC", 300))
+    env_profile_dir = os.getenv("TRAIN_PROFILE_DIR")
+    env_profile_cycles = int(os.getenv("TRAIN_PROFILE_CYCLES", 100))
+    env_profile_snapshot_sec = float(os.getenv("TRAIN_PROFILE_SNAPSHOT_SEC", 600))
+    env_strip_workers = int(os.getenv("TRAIN_STRIP_WORKERS", 0))
+    env_positioning = os.getenv("TRAIN_POSITIONING", "schedule")
+    env_predict_sec = float(os.getenv("TRAIN_PREDICT_SEC", 90))
+    env_snapshot_path = os.getenv("TRAIN_SNAPSHOT_PATH", "trainspotting.snapshot.json")
+    env_snapshot_max_age_sec = float(os.getenv("TRAIN_SNAPSHOT_MAX_AGE_SEC", 1800))
+    env_snapshot_interval_sec = float(os.getenv("TRAIN_SNAPSHOT_INTERVAL_SEC", 60))
+    env_history_path = os.getenv("TRAIN_HISTORY_PATH")
+    env_mode = os.getenv("TRAIN_MODE", "standalone")  # "standalone", "hub" or "client"
+    env_fanout_group = os.getenv("TRAIN_FANOUT_GROUP")
+    env_fanout_port = int(os.getenv("TRAIN_FANOUT_PORT", 0))
+    env_fanout_keyframe_sec = float(os.getenv("TRAIN_FANOUT_KEYFRAME_SEC", 2))
+    if env_mode not in ("standalone", "hub", "client"):
+        raise EnvironmentError(f"Unknown TRAIN_MODE {env_mode!r}")
 
-    program = Trainspotting(env_api_key)
+    # Light the strip from the last snapshot first, then load everything needed to poll
+    #from adafruit_blinka.microcontroller.amlogic.meson_g12_common.pin import board
+    import board
+    from StApiResponseHolder import StApiResponseHolder
+    from TsNeopixel1Line import TsNeopixel1Line
 
-    # Create structures
     response1Line = StApiResponseHolder()
     neopixel1Line = TsNeopixel1Line(
         "1 Line",
         board.D18,
         response1Line,
         brightness=0.10,
-        byteorder="GRB"
+        byteorder="GRB",
+        positioning=env_positioning,
+        predict_sec=env_predict_sec
+    )
+    if env_mode == "client":
+        # a display fed by a hub: no API key, polling or snapshot
+        try:
+            run_fanout_client([neopixel1Line], env_fanout_group, env_fanout_port)
+        finally:
+            neopixel1Line.clear_all_pixels()
+            log_listener.stop()
+        raise SystemExit(0)
+
+    snapshot = None
+    if env_snapshot_path:
+        from TsSnapshot import TsSnapshot
+        snapshot = TsSnapshot(env_snapshot_path, max_age_sec=env_snapshot_max_age_sec,
+                              min_interval_sec=env_snapshot_interval_sec)
+        snapshot.add_line(neopixel1Line)
+        snapshot.restore()
+
+    from StApiClient import StApiClient
+    from TsScheduler import TokenBucket, TsPollScheduler
+
+    scheduler = TsPollScheduler(
+        min_period_sec=env_sample_period_sec,
+        max_period_sec=60,
+        rate_limiter=TokenBucket(rate=env_api_rate_per_sec, burst=5)
     )
+    program = Trainspotting(env_api_key, concurrent_fetch=env_concurrent_fetch, scheduler=scheduler)
+    if env_record_path:
+        program.record_to(env_record_path)
+    if env_metrics_port:
+        program.serve_metrics(env_metrics_port)
+    if env_metrics_log_sec > 0:
+        program.log_metrics(env_metrics_log_sec)
+    if env_profile_dir:
+        program.profile_to(env_profile_dir, env_profile_cycles, env_profile_snapshot_sec)
 
     # Inject dependencies
     program.add_endpoint(StApiClient.ROUTE_1_LINE_ID, response1Line)
     program.add_line(neopixel1Line, response1Line)
+    program.snapshot = snapshot
+    if env_history_path:
+        program.record_history(env_history_path)
+    if env_mode == "hub":
+        program.publish_frames(env_fanout_group, env_fanout_port, env_fanout_keyframe_sec)
+    if env_strip_workers > 0:
+        program.use_strip_workers(env_strip_workers)
 
     try:
         # Run forever
-        while True:
-            wait_seconds = program.update()
-            if wait_seconds is not None:
-                time.sleep(max(env_sample_period_sec, wait_seconds))
-            else:
-                time.sleep(env_sample_period_sec)
+        program.run(env_sample_period_sec, env_frame_period_sec)
     finally:
         neopixel1Line.clear_all_pixels()
+        program.close()
+        log_listener.stop()
@@ -0,0 +1,69 @@
+"""
+Compare the current response.json() decode against StApiDecoder's selective decode.
+
+    python -m testing.bench_decode --trains 10 100 1000
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+import StApiDecoder
+from testing import fixtures
+
+
+def _full_json(content: bytes):
+    # what requests.Response.json() does
+    return json.loads(content)
+
+
+def _selective_stdlib(content: bytes):
+    return StApiDecoder.extract_trips_for_route(json.loads(content))
+
+
+def _selective(content: bytes):
+    return StApiDecoder.decode_trips_for_route(content)
+
+
+CASES = {
+    "response.json()": _full_json,
+    "selective (stdlib json)": _selective_stdlib,
+    f"selective ({'orjson' if StApiDecoder.orjson else 'stdlib json'})": _selective,
+}
+
+
+def _time_case(func, content: bytes, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(content)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _memory_case(func, content: bytes):
+    tracemalloc.start()
+    result = func(content)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak, retained
+
+
+def run(train_counts: list, repeat: int):
+    print(f"{'trains':>7} {'bytes':>10}  {'decoder':<26} {'best ms':>9} {'peak KiB':>9} {'kept KiB':>9}")
+    for num_trains in train_counts:
+        content = fixtures.make_trips_for_route_bytes(num_trains)
+        for name, func in CASES.items():
+            best = _time_case(func, content, repeat)
+            peak, retained = _memory_case(func, content)
+            print(f"{num_trains:>7} {len(content):>10}  {name:<26} {best * 1000:>9.2f} "
+                  f"{peak / 1024:>9.1f} {retained / 1024:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--trains", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run(args.trains, args.repeat)
@@ -0,0 +1,167 @@
+"""
+Benchmark the update pipeline stage by stage: decode, reference population, position calculation and pixel writes.
+
+Runs the 1 Line as a TsHeadlessLine into a TsNullOutput always, and as TsNeopixel1Line too when the hardware libraries
+are importable (i.e. on the Pi), against synthetic payloads of increasing size.  Both run the same TsLineEngine, so
+the difference between them is the cost of the strip.
+
+    python -m testing.bench_update --save testing/bench_baseline.json
+    python -m testing.bench_update --compare testing/bench_baseline.json
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+import tracemalloc
+
+import StApiDecoder
+from StReferenceCache import StReferenceCache
+from TsHeadlessLine import TsHeadlessLine
+from TsLayout import TsLayout
+from TsOutput import TsNullOutput
+from testing import fixtures
+
+STAGES = ("decode", "references", "positions", "pixels")
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+
+
+class _HeadlessTarget:
+    name = "TsHeadlessLine"
+
+    def __init__(self):
+        self.line = TsHeadlessLine("bench", TsLayout.load("1_line"), outputs=[TsNullOutput()],
+                                   reference_cache=StReferenceCache())
+
+    def decode(self, content: bytes):
+        return StApiDecoder.decode_trips_for_route(content)
+
+    def draw(self, positions: list):
+        self.line.show_frame(self.line.engine.compose(positions))
+
+
+class _HardwareTarget:
+    name = "TsNeopixel1Line"
+
+    def __init__(self):
+        import board
+        from StApiResponseHolder import StApiResponseHolder
+        from TsNeopixel1Line import TsNeopixel1Line
+        self.holder = StApiResponseHolder()
+        self.line = TsNeopixel1Line(
+            "bench", board.D18, self.holder, brightness=0.1, reference_cache=StReferenceCache(), byteorder="GRB")
+
+    def decode(self, content: bytes):
+        return self.holder.get_feed(fixtures.FixtureResponse(content))
+
+    def draw(self, positions: list):
+        self.line.show_frame(self.line.engine.compose(positions))
+
+
+def _targets() -> list:
+    targets = [_HeadlessTarget]
+    try:
+        import TsNeopixel1Line  # noqa: F401
+        targets.append(_HardwareTarget)
+    except (ImportError, NotImplementedError) as e:
+        print(f"Skipping TsNeopixel1Line, hardware libraries unavailable: {e}", file=sys.stderr)
+    return targets
+
+
+def _run_cycle(target, content: bytes, measure) -> None:
+    now = time.time()
+    engine = target.line.engine
+    feed = measure("decode", target.decode, content)
+    measure("references", engine.populate_references, feed, now)
+    positions = measure("positions", engine.compute_positions, feed, now)
+    measure("pixels", target.draw, positions)
+
+
+def _bench(target_cls, content: bytes, repeat: int) -> dict:
+    target = target_cls()
+    results = {stage: {"ms": float("inf"), "peak_kib": 0.0, "alloc_kib": 0.0} for stage in STAGES}
+
+    def timed(stage, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = (time.perf_counter() - start) * 1000
+        results[stage]["ms"] = min(results[stage]["ms"], elapsed)
+        return result
+
+    def traced(stage, func, *args):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        result = func(*args)
+        current, peak = tracemalloc.get_traced_memory()
+        results[stage]["peak_kib"] = (peak - before) / 1024
+        results[stage]["alloc_kib"] = (current - before) / 1024
+        return result
+
+    # first cycle warms the reference cache, like every poll after the first one in production
+    _run_cycle(target, content, lambda stage, func, *args: func(*args))
+    for _ in range(repeat):
+        _run_cycle(target, content, timed)
+    tracemalloc.start()
+    try:
+        _run_cycle(target, content, traced)
+    finally:
+        tracemalloc.stop()
+    return results
+
+
+def run(sizes, num_routes: int) -> dict:
+    report = {}
+    targets = _targets()
+    print(f"{'target':<20} {'trains':>7}  {'stage':<11} {'best ms':>9} {'peak KiB':>9} {'kept KiB':>9}")
+    for size in sizes:
+        content = fixtures.make_trips_for_route_bytes(size, num_routes=num_routes, dup_ratio=0.05)
+        repeat = max(3, min(50, 20000 // size))
+        for target_cls in targets:
+            results = _bench(target_cls, content, repeat)
+            report.setdefault(target_cls.name, {})[str(size)] = results
+            for stage in STAGES:
+                r = results[stage]
+                print(f"{target_cls.name:<20} {size:>7}  {stage:<11} {r['ms']:>9.3f} "
+                      f"{r['peak_kib']:>9.1f} {r['alloc_kib']:>9.1f}")
+    return report
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """
+    :return: Descriptions of every stage whose time grew by more than the tolerance factor over the baseline
+    """
+    regressions = []
+    for target, sizes in report.items():
+        for size, stages in sizes.items():
+            for stage, r in stages.items():
+                base = baseline.get(target, {}).get(size, {}).get(stage)
+                if base is None or base["ms"] <= 0:
+                    continue
+                ratio = r["ms"] / base["ms"]
+                if ratio > tolerance:
+                    regressions.append(
+                        f"{target} {size} trains {stage}: {base['ms']:.3f} ms -> {r['ms']:.3f} ms ({ratio:.2f}x)")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--routes", type=int, default=4, help="Routes the trains are spread over")
+    parser.add_argument("--save", help="Write the results to this JSON file as the new baseline")
+    parser.add_argument("--compare", help="Baseline JSON file to check the results against")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="Slowdown factor that counts as a regression")
+    args = parser.parse_args()
+
+    # unknown stop/trip warnings would dominate the timings
+    logging.basicConfig(level=logging.ERROR)
+    report = run(args.sizes, args.routes)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"created": time.time(), "results": report}, f, indent=2)
+    if args.compare:
+        with open(args.compare, "r") as f:
+            regressions = compare(report, json.load(f)["results"], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
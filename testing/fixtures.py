@@ -0,0 +1,242 @@
+"""
+Synthetic trips-for-route payloads shaped like the OneBusAway responses StApiClient receives, for benchmarks and
+offline runs.  Stops come from a layout so the generated trains land on a real strip.
+"""
+import json
+import random
+
+from TsLayout import TsLayout
+
+SERVICE_DATE_MS = 1760770800000
+STOP_SPACING_M = 1500.0
+STOP_TRAVEL_SEC = 180
+STOP_DWELL_SEC = 20
+
+
+def _stop_id(route_idx: int, stop_idx: int) -> str:
+    return f"40_{route_idx * 1000 + 99000 + stop_idx}"
+
+
+def stop_references(layout: TsLayout, num_routes: int = 1) -> list:
+    """
+    :return: references.stops for every route, each route gets its own copy of the layout's stops
+    """
+    stops = []
+    for route_idx in range(num_routes):
+        for stop_idx, name in enumerate(layout.stop_names):
+            stops.append({
+                "code": str(stop_idx),
+                "direction": "N",
+                "id": _stop_id(route_idx, stop_idx),
+                "lat": 47.45 + stop_idx * 0.02,
+                "locationType": 0,
+                "lon": -122.3,
+                "name": name,
+                "parent": "",
+                "routeIds": [f"40_R{route_idx}"],
+                "wheelchairBoarding": "UNKNOWN",
+            })
+    return stops
+
+
+def stop_order(layout: TsLayout, direction: int) -> list:
+    """
+    :return: Indices of the layout's stops in the order a trip in direction calls at them
+    """
+    order = list(range(len(layout.stop_names)))
+    if direction == layout.return_direction:
+        order.reverse()
+    return order
+
+
+def make_train(
+        rng: random.Random,
+        trip_id: str,
+        vehicle_idx: int,
+        route_idx: int,
+        order: list,
+        start_sec: int,
+        next_seq: int,
+        offset: int,
+        current_time_ms: int) -> dict:
+    """
+    Build one data.list entry
+    :param vehicle_idx: Number of the train, its vehicle and block ids are made from it
+    :param order: Stop indices the trip calls at, see stop_order()
+    :param start_sec: Scheduled arrival at the first stop, seconds into the service day
+    :param next_seq: Position in order of the stop the train is heading to
+    :param offset: Seconds until it gets there, 0 if it's there
+    """
+    num_stops = len(order)
+    stop_times = []
+    for seq, stop_idx in enumerate(order):
+        arrival = start_sec + seq * STOP_TRAVEL_SEC
+        stop_times.append({
+            "arrivalTime": arrival,
+            "departureTime": arrival + STOP_DWELL_SEC,
+            "distanceAlongTrip": seq * STOP_SPACING_M,
+            "historicalOccupancy": "",
+            "stopHeadsign": "",
+            "stopId": _stop_id(route_idx, stop_idx),
+        })
+    distance = max(0.0, next_seq * STOP_SPACING_M - STOP_SPACING_M * offset / STOP_TRAVEL_SEC)
+    return {
+        "frequency": None,
+        "serviceDate": SERVICE_DATE_MS,
+        "situationIds": [],
+        "tripId": trip_id,
+        "status": {
+            "activeTripId": trip_id,
+            "blockTripSequence": 0,
+            "closestStop": _stop_id(route_idx, order[next_seq]),
+            "closestStopTimeOffset": offset,
+            "distanceAlongTrip": distance,
+            "frequency": None,
+            "lastKnownDistanceAlongTrip": 0,
+            "lastKnownLocation": {"lat": 47.5, "lon": -122.3},
+            "lastKnownOrientation": 0,
+            "lastLocationUpdateTime": current_time_ms - rng.randrange(30000),
+            "lastUpdateTime": current_time_ms - rng.randrange(30000),
+            "nextStop": _stop_id(route_idx, order[next_seq]),
+            "nextStopTimeOffset": offset,
+            "occupancyCapacity": -1,
+            "occupancyCount": -1,
+            "occupancyStatus": "",
+            "orientation": 90.0,
+            "phase": "in_progress",
+            "position": {"lat": 47.5, "lon": -122.3},
+            "predicted": True,
+            "scheduleDeviation": rng.randrange(-60, 240),
+            "scheduledDistanceAlongTrip": distance,
+            "serviceDate": SERVICE_DATE_MS,
+            "situationIds": [],
+            "status": "SCHEDULED",
+            "totalDistanceAlongTrip": (num_stops - 1) * STOP_SPACING_M,
+            "vehicleId": f"40_{vehicle_idx}",
+        },
+        "schedule": {
+            "frequency": None,
+            "nextTripId": "",
+            "previousTripId": "",
+            "stopTimes": stop_times,
+            "timeZone": "America/Los_Angeles",
+        },
+    }
+
+
+def make_trip_reference(trip_id: str, vehicle_idx: int, route_idx: int, direction: int, headsign: str) -> dict:
+    return {
+        "blockId": f"40_B{vehicle_idx}",
+        "directionId": str(direction),
+        "id": trip_id,
+        "peakOffpeak": 0,
+        "routeId": f"40_R{route_idx}",
+        "routeShortName": "",
+        "serviceId": "40_S",
+        "shapeId": f"40_SH{route_idx}_{direction}",
+        "timeZone": "",
+        "tripHeadsign": headsign,
+        "tripShortName": "",
+    }
+
+
+def make_dup(train: dict) -> dict:
+    """
+    :return: The bogus "_dup" copy of a train the real feed sometimes contains
+    """
+    dup = json.loads(json.dumps(train))
+    dup["tripId"] = f"{train['tripId']}_dup"
+    return dup
+
+
+def wrap_response(current_time_ms: int, trains: list, stops: list, trips: list, num_routes: int = 1) -> dict:
+    """
+    :return: The response envelope around data.list and references
+    """
+    return {
+        "code": 200,
+        "currentTime": current_time_ms,
+        "data": {
+            "limitExceeded": False,
+            "list": trains,
+            "outOfRange": False,
+            "references": {
+                "agencies": [{"id": "40", "name": "Sound Transit", "timezone": "America/Los_Angeles"}],
+                "routes": [{"id": f"40_R{i}", "shortName": f"{i + 1} Line"} for i in range(num_routes)],
+                "situations": [],
+                "stopTimes": [],
+                "stops": stops,
+                "trips": trips,
+            },
+        },
+        "text": "OK",
+        "version": 2,
+    }
+
+
+def make_trips_for_route(
+        num_trains: int,
+        num_routes: int = 1,
+        seed: int = 0,
+        layout: TsLayout = None,
+        dup_ratio: float = 0.0,
+        missing_ref_ratio: float = 0.0,
+        current_time_ms: int = None) -> dict:
+    """
+    Build a trips-for-route response body
+    :param num_trains: Total trains across all routes
+    :param num_routes: Number of routes the trains are spread over, each gets its own copy of the layout's stops
+    :param seed: Random seed, the same arguments always build the same payload
+    :param layout: Layout to take stop names from, defaults to the 1 Line
+    :param dup_ratio: Fraction of trains that also get a bogus "_dup" copy
+    :param missing_ref_ratio: Fraction of trains whose trip is left out of references.trips
+    :param current_time_ms: Server time of the response, defaults to a fixed time during service
+    :return: The decoded JSON body as a dict
+    """
+    rng = random.Random(seed)
+    layout = layout if layout is not None else TsLayout.load("1_line")
+    current_time_ms = current_time_ms if current_time_ms is not None else SERVICE_DATE_MS + 12 * 3600 * 1000
+    num_stops = len(layout.stop_names)
+
+    trains = []
+    trips = []
+    for train_idx in range(num_trains):
+        route_idx = train_idx % num_routes
+        direction = rng.choice((layout.outbound_direction, layout.return_direction))
+        trip_id = f"40_{route_idx}_{train_idx:06d}"
+        order = stop_order(layout, direction)
+        start_sec = 12 * 3600 - rng.randrange(num_stops) * STOP_TRAVEL_SEC
+        next_seq = rng.randrange(num_stops)
+        offset = rng.choice((0, 0, rng.randrange(1, STOP_TRAVEL_SEC)))
+        train = make_train(rng, trip_id, train_idx, route_idx, order, start_sec, next_seq, offset, current_time_ms)
+        trains.append(train)
+        if rng.random() >= missing_ref_ratio:
+            trips.append(make_trip_reference(trip_id, train_idx, route_idx, direction, layout.stop_names[order[-1]]))
+        if rng.random() < dup_ratio:
+            trains.append(make_dup(train))
+
+    return wrap_response(current_time_ms, trains, stop_references(layout, num_routes), trips, num_routes)
+
+
+def make_trips_for_route_bytes(num_trains: int, **kwargs) -> bytes:
+    """
+    :return: make_trips_for_route() serialized the way the server sends it
+    """
+    return json.dumps(make_trips_for_route(num_trains, **kwargs), separators=(",", ":")).encode()
+
+
+class FixtureResponse:
+    """
+    Just enough of requests.Response to sit in a StApiResponseHolder
+    """
+    def __init__(self, content: bytes, status_code: int = 200, headers: dict = None):
+        self.content = content
+        self.status_code = status_code
+        self.headers = headers if headers is not None else {"Content-Type": "application/json"}
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
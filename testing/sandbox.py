@@ -1,5 +1,9 @@
+import json
+
 import requests
 
+from StApiArchive import read_archive
+
 BASE_URL = "https://api.pugetsound.onebusaway.org/api/where"
 ROUTE_1_LINE_ID = "40_100479"
 API_KEY = "ad0b7f8d-bde6-469a-a839-f5c7429fd665"
@@ -7,4 +11,15 @@ endpoint = "https://api.pugetsound.onebusaway.org/api/where/trips-for-route/40_1
 
 def query_server():
     response = requests.get(endpoint, params={'key': API_KEY, 'includeStatus': 'true'})
-    return response.json()
\ No newline at end of file
+    return response.json()
+
+def replay_server(archive_path: str, route: str = ROUTE_1_LINE_ID):
+    """
+    Offline stand-in for query_server(), yields every recorded 200 response body for a route in order
+    :param archive_path: Archive written by StApiArchive.StApiRecorder
+    :param route: Route to pick out of the archive
+    """
+    suffix = f"/trips-for-route/{route}.json"
+    for record in read_archive(archive_path):
+        if record["status"] == 200 and record["url"].endswith(suffix):
+            yield json.loads(record["body"])
@@ -0,0 +1,77 @@
+"""
+Headless soak test: drive the production line code (StApiResponseHolder -> TsLineEngine) into a TsNullOutput for many
+polls as fast as it will go, and watch for throughput drift and memory growth.
+
+Polls are synthetic, with trains churning between polls, or replayed from an archive recorded with TRAIN_RECORD_PATH.
+
+    python -m testing.soak --polls 100000
+    python -m testing.soak --archive trainspotting.archive.gz --png-dir /tmp/frames
+"""
+import argparse
+import logging
+import time
+import tracemalloc
+
+from StApiArchive import ReplayResponse, read_archive
+from StApiResponseHolder import StApiResponseHolder
+from StReferenceCache import StReferenceCache
+from TsHeadlessLine import TsHeadlessLine
+from TsLayout import TsLayout
+from TsOutput import TsNullOutput, TsPngOutput
+from testing import fixtures
+
+
+def _synthetic(polls: int, trains: int, variants: int = 64):
+    # a rotating set of payloads with different seeds, so trips keep appearing and disappearing
+    payloads = [fixtures.make_trips_for_route_bytes(trains, seed=seed, dup_ratio=0.05) for seed in range(variants)]
+    for i in range(polls):
+        yield fixtures.FixtureResponse(payloads[i % variants])
+
+
+def _replayed(archive_path: str, polls: int):
+    records = [record for record in read_archive(archive_path) if record["status"] == 200]
+    for i in range(polls):
+        yield ReplayResponse(records[i % len(records)])
+
+
+def run(responses, line: TsHeadlessLine, holder: StApiResponseHolder, report_every: int):
+    tracemalloc.start()
+    start = window_start = time.perf_counter()
+    baseline = None
+    polls = 0
+    for polls, response in enumerate(responses, 1):
+        holder.set_response(response, timestamp=polls)
+        line.update()
+        if polls % report_every == 0:
+            now = time.perf_counter()
+            current, peak = tracemalloc.get_traced_memory()
+            baseline = current if baseline is None else baseline
+            trip_state = line.engine.trip_state
+            print(f"{polls:>9} polls  {report_every / (now - window_start):>8.0f} polls/s  "
+                  f"traced {current / 1024:>8.1f} KiB ({(current - baseline) / 1024:+.1f})  "
+                  f"peak {peak / 1024:>8.1f} KiB  "
+                  f"trips {len(trip_state)}/{trip_state.capacity}  references {line.engine.reference_cache.sizes()}")
+            window_start = now
+    tracemalloc.stop()
+    elapsed = time.perf_counter() - start
+    print(f"{polls} polls in {elapsed:.1f}s, {polls / elapsed:.0f} polls/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--polls", type=int, default=20000)
+    parser.add_argument("--trains", type=int, default=40, help="Trains per synthetic poll")
+    parser.add_argument("--archive", help="Replay the 200 responses of this archive instead of synthetic polls")
+    parser.add_argument("--png-dir", help="Also dump every frame as a PNG into this directory")
+    parser.add_argument("--report-every", type=int, default=2000)
+    args = parser.parse_args()
+
+    # unknown stop/trip warnings would dominate the run
+    logging.basicConfig(level=logging.ERROR)
+    outputs = [TsNullOutput()]
+    if args.png_dir:
+        outputs.append(TsPngOutput(args.png_dir))
+    holder = StApiResponseHolder()
+    line = TsHeadlessLine("soak", TsLayout.load("1_line"), holder, outputs, reference_cache=StReferenceCache())
+    responses = _replayed(args.archive, args.polls) if args.archive else _synthetic(args.polls, args.trains)
+    run(responses, line, holder, args.report_every)
@@ -0,0 +1,328 @@
+"""
+Local stand-in for the OneBusAway trips-for-route endpoint, for stress and recovery testing without touching the real
+server.  Serves a synthetic fleet that runs its trips in (optionally sped up) real time, with the feed's quirks:
+"_dup" trains, trips missing from the references and trains whose next stop jumps backwards.  Faults can be injected:
+latency, 5xx errors, periodic outages and 429s carrying Retry-After as delta-seconds, as an HTTP date, or either.
+
+    python -m testing.stub_server --trains 300 --error-rate 0.05 --rate-limit-rate 0.02 --retry-after both
+    OBA_BASE_URL=http://127.0.0.1:8080/api/where python main.py
+
+With --drive-sec the real StApiClient, scheduler and pipeline are run against the stub in-process with a headless
+line, and a metrics summary is printed at the end, so throughput and recovery can be measured on a laptop.
+"""
+import argparse
+import email.utils
+import json
+import logging
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from TsLayout import TsLayout
+from testing import fixtures
+
+
+logger = logging.getLogger(__name__)
+
+LAYOVER_SEC = 120
+_PATH = re.compile(r"^/api/where/trips-for-route/(?P<route>[^/?]+)\.json$")
+
+
+class SyntheticFleet:
+    """
+    Trains running a layout's stops end to end at the fixtures' stop spacing, each turning round into a new trip
+    in the other direction after a layover, so trip ids keep churning like the real feed's
+    """
+    def __init__(
+            self,
+            num_trains: int,
+            routes: list,
+            layout: TsLayout = None,
+            dup_ratio: float = 0.02,
+            missing_ref_ratio: float = 0.01,
+            backwards_ratio: float = 0.02,
+            speed: float = 1.0,
+            seed: int = 0):
+        """
+        :param num_trains: Trains per route
+        :param routes: Route ids served, each gets its own copy of the layout's stops
+        :param dup_ratio: Chance per train per response of a bogus "_dup" copy
+        :param missing_ref_ratio: Chance per train per response of its trip missing from references.trips
+        :param backwards_ratio: Chance per train per response of reporting the stop before its real next stop
+        :param speed: Simulated seconds per real second
+        """
+        self.layout = layout if layout is not None else TsLayout.load("1_line")
+        self.routes = {route: idx for idx, route in enumerate(routes)}
+        self.num_trains = num_trains
+        self.dup_ratio = dup_ratio
+        self.missing_ref_ratio = missing_ref_ratio
+        self.backwards_ratio = backwards_ratio
+        self.speed = speed
+        self.trip_sec = (len(self.layout.stop_names) - 1) * fixtures.STOP_TRAVEL_SEC
+        self.cycle_sec = self.trip_sec + LAYOVER_SEC
+        rng = random.Random(seed)
+        # per train: seconds into its cycle at start, and whether its first trip is outbound
+        self._phases = [(rng.uniform(0, 2 * self.cycle_sec), rng.random() < 0.5) for _ in range(num_trains)]
+        self._stops = {idx: fixtures.stop_references(self.layout, idx + 1)[-len(self.layout.stop_names):]
+                       for idx in self.routes.values()}
+        self._started = time.monotonic()
+
+    def payload(self, route: str, rng: random.Random):
+        """
+        :return: The trips-for-route body for route at the current time, or None if the route isn't served
+        """
+        route_idx = self.routes.get(route)
+        if route_idx is None:
+            return None
+        layout = self.layout
+        elapsed = (time.monotonic() - self._started) * self.speed
+        current_time_ms = int(time.time() * 1000)
+        trains = []
+        trips = []
+        for train_idx, (phase, outbound_first) in enumerate(self._phases):
+            t = elapsed + phase
+            generation, within = divmod(t, self.cycle_sec)
+            if within >= self.trip_sec:
+                continue  # laying over, not in the feed
+            outbound = outbound_first == (generation % 2 == 0)
+            direction = layout.outbound_direction if outbound else layout.return_direction
+            order = fixtures.stop_order(layout, direction)
+            trip_id = f"40_{route_idx}_{train_idx:04d}_{int(generation):05d}"
+            seq, into_segment = divmod(int(within), fixtures.STOP_TRAVEL_SEC)
+            if into_segment < fixtures.STOP_DWELL_SEC:
+                next_seq, offset = seq, 0
+            else:
+                next_seq, offset = seq + 1, fixtures.STOP_TRAVEL_SEC - into_segment
+            if next_seq > 0 and rng.random() < self.backwards_ratio:
+                next_seq, offset = next_seq - 1, rng.randrange(1, fixtures.STOP_TRAVEL_SEC)
+            start_sec = 6 * 3600 + int(t - within) % (18 * 3600)
+            train = fixtures.make_train(rng, trip_id, train_idx, route_idx, order, start_sec, next_seq, offset,
+                                        current_time_ms)
+            trains.append(train)
+            if rng.random() >= self.missing_ref_ratio:
+                trips.append(fixtures.make_trip_reference(trip_id, train_idx, route_idx, direction,
+                                                          layout.stop_names[order[-1]]))
+            if rng.random() < self.dup_ratio:
+                trains.append(fixtures.make_dup(train))
+        return fixtures.wrap_response(current_time_ms, trains, self._stops[route_idx], trips, len(self.routes))
+
+
+class FaultInjector:
+    """
+    Decides per request whether to add latency or fail it, and how
+    """
+    RETRY_AFTER_FORMS = ("seconds", "date", "both")
+
+    def __init__(
+            self,
+            latency_ms: float = 0,
+            jitter_ms: float = 0,
+            error_rate: float = 0.0,
+            rate_limit_rate: float = 0.0,
+            retry_after: str = "both",
+            retry_after_sec: int = 10,
+            outage_every_sec: float = 0,
+            outage_sec: float = 0):
+        """
+        :param latency_ms: Added to every response
+        :param jitter_ms: Up to this much more is added at random
+        :param error_rate: Fraction of requests answered with a 500, 502, 503 or 504
+        :param rate_limit_rate: Fraction of requests answered with a 429
+        :param retry_after: Form of the 429's Retry-After: "seconds", "date", or "both" to pick one at random
+        :param retry_after_sec: How long the Retry-After asks the client to wait
+        :param outage_every_sec: Every this many seconds the server goes down for outage_sec, 0 for never
+        :param outage_sec: Length of each outage, during which every request gets a 503
+        """
+        if retry_after not in self.RETRY_AFTER_FORMS:
+            raise ValueError(f"retry_after must be one of {self.RETRY_AFTER_FORMS}")
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.retry_after_sec = retry_after_sec
+        self.outage_every_sec = outage_every_sec
+        self.outage_sec = outage_sec
+        self._started = time.monotonic()
+
+    def delay(self, rng: random.Random) -> float:
+        return (self.latency_ms + rng.uniform(0, self.jitter_ms)) / 1000
+
+    def failure(self, rng: random.Random):
+        """
+        :return: (status, headers) to fail the request with, or None to serve it
+        """
+        if self.outage_every_sec and (time.monotonic() - self._started) % self.outage_every_sec < self.outage_sec:
+            return 503, {}
+        roll = rng.random()
+        if roll < self.rate_limit_rate:
+            form = self.retry_after if self.retry_after != "both" else rng.choice(("seconds", "date"))
+            if form == "seconds":
+                value = str(self.retry_after_sec)
+            else:
+                value = email.utils.formatdate(time.time() + self.retry_after_sec, usegmt=True)
+            return 429, {"Retry-After": value}
+        if roll < self.rate_limit_rate + self.error_rate:
+            return rng.choice((500, 502, 503, 504)), {}
+        return None
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple, fleet: SyntheticFleet, faults: FaultInjector, seed: int = 0):
+        self.fleet = fleet
+        self.faults = faults
+        self.counts = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        super().__init__(address, _StubHandler)
+
+    def request_rng(self) -> random.Random:
+        with self._lock:
+            return random.Random(self._rng.getrandbits(64))
+
+    def count(self, status: int):
+        with self._lock:
+            self.counts[status] = self.counts.get(status, 0) + 1
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/api/where"
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        path = self.path.split("?", 1)[0]
+        if path == "/stats":
+            with server._lock:
+                body = json.dumps({str(status): count for status, count in sorted(server.counts.items())})
+            self._send(200, body.encode(), {})
+            return
+        match = _PATH.match(path)
+        rng = server.request_rng()
+        time.sleep(server.faults.delay(rng))
+        if match is None:
+            self._send(404, b'{"code":404,"text":"resource not found"}', {})
+            return
+        failure = server.faults.failure(rng)
+        if failure is not None:
+            status, headers = failure
+            self._send(status, json.dumps({"code": status, "text": "stub fault"}).encode(), headers)
+            return
+        payload = server.fleet.payload(match.group("route"), rng)
+        if payload is None:
+            self._send(404, b'{"code":404,"text":"unknown route"}', {})
+            return
+        self._send(200, json.dumps(payload, separators=(",", ":")).encode(), {})
+
+    def _send(self, status: int, body: bytes, headers: dict):
+        self.server.count(status)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def drive(base_url: str, routes: list, duration_sec: float, poll_sec: float, frame_sec: float, rate_per_sec: float):
+    """
+    Run the production fetch/render loop against base_url for duration_sec with one headless line per route
+    :return: TsMetrics summary of the run
+    """
+    from StApiClient import StApiClient
+    from StApiResponseHolder import StApiResponseHolder
+    from TsHeadlessLine import TsHeadlessLine
+    from TsMetrics import TsMetrics
+    from TsOutput import TsNullOutput
+    from TsPipeline import TsPipeline
+    from TsScheduler import TokenBucket, TsPollScheduler
+
+    StApiClient.BASE_URL = base_url
+    scheduler = TsPollScheduler(min_period_sec=poll_sec, max_period_sec=60,
+                                rate_limiter=TokenBucket(rate=rate_per_sec, burst=5))
+    client = StApiClient("stub", concurrent=True, scheduler=scheduler)
+    layout = TsLayout.load("1_line")
+    for route in routes:
+        holder = StApiResponseHolder()
+        client.add_trips_for_route_query(route, holder)
+        client.add_neopixel(TsHeadlessLine(route, layout, holder, [TsNullOutput()]), holder)
+    pipeline = TsPipeline(client, poll_sec, frame_sec)
+    timer = threading.Timer(duration_sec, pipeline.stop)
+    timer.start()
+    try:
+        pipeline.run_forever()
+    finally:
+        timer.cancel()
+        client.close()
+    return TsMetrics.shared().summary()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--routes", default="40_100479", help="comma separated route ids to serve")
+    parser.add_argument("--trains", type=int, default=40, help="trains per route")
+    parser.add_argument("--speed", type=float, default=1.0, help="simulated seconds per real second")
+    parser.add_argument("--dup-ratio", type=float, default=0.02)
+    parser.add_argument("--missing-ref-ratio", type=float, default=0.01)
+    parser.add_argument("--backwards-ratio", type=float, default=0.02)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", choices=FaultInjector.RETRY_AFTER_FORMS, default="both")
+    parser.add_argument("--retry-after-sec", type=int, default=10)
+    parser.add_argument("--outage-every-sec", type=float, default=0)
+    parser.add_argument("--outage-sec", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--drive-sec", type=float, default=0,
+                        help="run the fetch/render loop against the stub for this long, then print its metrics")
+    parser.add_argument("--poll-sec", type=float, default=5)
+    parser.add_argument("--frame-sec", type=float, default=0.1)
+    parser.add_argument("--rate-per-sec", type=float, default=1.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR if args.drive_sec else logging.INFO)
+
+    routes = [route for route in args.routes.split(",") if route]
+    fleet = SyntheticFleet(args.trains, routes, dup_ratio=args.dup_ratio, missing_ref_ratio=args.missing_ref_ratio,
+                           backwards_ratio=args.backwards_ratio, speed=args.speed, seed=args.seed)
+    faults = FaultInjector(args.latency_ms, args.jitter_ms, args.error_rate, args.rate_limit_rate, args.retry_after,
+                           args.retry_after_sec, args.outage_every_sec, args.outage_sec)
+    server = StubServer((args.host, args.port), fleet, faults, args.seed)
+    print(f"OBA_BASE_URL={server.base_url}")
+
+    if not args.drive_sec:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            print(f"responses by status: {server.counts}")
+            server.server_close()
+        return
+
+    threading.Thread(target=server.serve_forever, name="StubServer", daemon=True).start()
+    try:
+        summary = drive(server.base_url, routes, args.drive_sec, args.poll_sec, args.frame_sec, args.rate_per_sec)
+    finally:
+        server.shutdown()
+        server.server_close()
+    print(f"responses by status: {server.counts}")
+    print(summary)
+
+
+if __name__ == "__main__":
+    main()
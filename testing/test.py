@@ -1,3 +1,5 @@
+import sys
+
 from testing import sandbox
 from testing.TsNeopixel1LineFake import TsNeopixel1LineFake
 
@@ -11,7 +13,17 @@ class Test:
         self.testLine1Instance.print_names()
         self.testLine1Instance.print_colors()
 
+    def run_replay(self, archive_path: str):
+        # deterministic and offline: every recorded poll, in order, as fast as possible
+        for server_packet in sandbox.replay_server(archive_path):
+            self.testLine1Instance.update(server_packet)
+        self.testLine1Instance.print_names()
+        self.testLine1Instance.print_colors()
+
 
 if __name__ == "__main__":
     testInstance = Test()
-    testInstance.run_test()
\ No newline at end of file
+    if len(sys.argv) > 1:
+        testInstance.run_replay(sys.argv[1])
+    else:
+        testInstance.run_test()
@@ -0,0 +1,50 @@
+from StApiClient import StApiClient
+from StApiResponseHolder import StApiResponseHolder
+from StReferenceCache import StReferenceCache
+from TsHeadlessLine import TsHeadlessLine
+from TsLayout import TsLayout
+from TsOutput import TsOutput
+from testing import fixtures
+
+
+class _CountingOutput(TsOutput):
+    def __init__(self):
+        self.frames = 0
+
+    def show_frame(self, frame):
+        self.frames += 1
+
+
+def _client_with_lines(num_lines: int):
+    client = StApiClient("test", transport=object())
+    layout = TsLayout.load("1_line")
+    outputs = []
+    for i in range(num_lines):
+        holder = StApiResponseHolder()
+        holder.set_response(fixtures.FixtureResponse(fixtures.make_trips_for_route_bytes(10, seed=i)))
+        output = _CountingOutput()
+        line = TsHeadlessLine(f"line {i}", layout, holder, [output], reference_cache=StReferenceCache())
+        client.add_neopixel(line, holder)
+        outputs.append(output)
+    return client, outputs
+
+
+def test_render_draws_every_line():
+    client, outputs = _client_with_lines(3)
+    assert client.render() == 0
+    assert [output.frames for output in outputs] == [1, 1, 1]
+
+
+def test_render_returns_longest_wait():
+    client, _ = _client_with_lines(0)
+
+    class _Line:
+        def __init__(self, wait):
+            self.wait = wait
+
+        def update(self):
+            return self.wait
+
+    for wait in (None, 5, 2):
+        client.add_neopixel(_Line(wait), StApiResponseHolder())
+    assert client.render() == 5
@@ -0,0 +1,91 @@
+import random
+import struct
+
+import pytest
+
+from TsFanout import (KIND_DELTA, KIND_KEYFRAME, TsFanoutClient, apply_delta, decode_packet, encode_delta,
+                      encode_keyframe)
+from TsLineEngine import TsFrame
+
+
+def test_keyframe_round_trip():
+    pixels = bytes(range(10))
+    kind, line_name, seq, base_seq, num_pixels, payload = decode_packet(encode_keyframe(b"1 Line", 7, pixels))
+    assert (kind, line_name, seq, base_seq, num_pixels, payload) == (KIND_KEYFRAME, "1 Line", 7, 7, 10, pixels)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_delta_round_trip(seed):
+    rng = random.Random(seed)
+    old = bytes(rng.randrange(4) for _ in range(60))
+    new = bytes(value if rng.random() < 0.8 else rng.randrange(4) for value in old)
+    kind, line_name, seq, base_seq, num_pixels, payload = decode_packet(encode_delta(b"line", 0, old, new))
+    assert (kind, line_name, seq, base_seq, num_pixels) == (KIND_DELTA, "line", 0, 0xFFFFFFFF, 60)
+    pixels = bytearray(old)
+    apply_delta(pixels, payload)
+    assert pixels == new
+
+
+def test_unchanged_frame_gives_empty_delta():
+    pixels = bytes(10)
+    assert decode_packet(encode_delta(b"line", 2, pixels, pixels))[5] == b""
+
+
+@pytest.mark.parametrize("packet", [b"", b"TSF1", b"XXXX" + bytes(20)])
+def test_decode_rejects_non_frame_packets(packet):
+    with pytest.raises(ValueError):
+        decode_packet(packet)
+
+
+@pytest.mark.parametrize("payload", [
+    struct.pack("!HH", 8, 5) + bytes(5),   # runs off the end of the frame
+    struct.pack("!HH", 0, 4) + bytes(2),   # fewer bytes than the run says
+    b"\x00\x01",                           # truncated run header
+])
+def test_malformed_delta_leaves_frame_untouched(payload):
+    pixels = bytearray(range(10))
+    with pytest.raises(ValueError):
+        apply_delta(pixels, struct.pack("!HH", 0, 1) + b"\x09" + payload)
+    assert pixels == bytearray(range(10))
+
+
+class _Line:
+    class _Layout:
+        num_pixels = 10
+
+    class _Engine:
+        name = "line"
+
+    layout = _Layout()
+    engine = _Engine()
+
+    def __init__(self):
+        self.frames = []
+
+    def show_frame(self, frame: TsFrame):
+        self.frames.append(bytes(frame.pixels))
+
+
+@pytest.fixture
+def client():
+    line = _Line()
+    client = TsFanoutClient([line], group="127.0.0.1", port=0)
+    yield client, line
+    client.stop()
+
+
+def test_client_waits_for_keyframe_after_a_bad_packet(client):
+    client, line = client
+    first = bytes(10)
+    second = bytes([1] * 10)
+    third = bytes([2] + [1] * 9)
+    client.handle_packet(encode_keyframe(b"line", 1, first)[:-3])
+    assert line.frames == []
+    client.handle_packet(encode_keyframe(b"line", 1, first))
+    client.handle_packet(encode_delta(b"line", 2, first, second)[:-2])
+    # based on the frame the bad delta should have made, so it can't be applied either
+    client.handle_packet(encode_delta(b"line", 3, second, third))
+    assert line.frames == [first]
+    client.handle_packet(encode_keyframe(b"line", 3, third))
+    assert line.frames == [first, third]
+    assert all(len(frame) == 10 for frame in line.frames)
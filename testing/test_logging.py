@@ -0,0 +1,31 @@
+import logging
+import os
+
+from TsLogging import TsRotatingFileHandler
+
+
+def _record(i: int) -> logging.LogRecord:
+    return logging.LogRecord("test", logging.INFO, __file__, 1, f"message {i:04d}", None, None)
+
+
+def test_records_stay_buffered_until_sync(tmp_path):
+    path = tmp_path / "test.log"
+    handler = TsRotatingFileHandler(str(path), max_bytes=1_000_000, rotate_sec=0, flush_records=100)
+    for i in range(10):
+        handler.handle(_record(i))
+    assert os.path.getsize(path) == 0
+    handler.sync()
+    assert path.read_text().count("\n") == 10
+    handler.close()
+
+
+def test_rotates_on_size(tmp_path):
+    path = tmp_path / "test.log"
+    path.write_text("x" * 50 + "\n")
+    handler = TsRotatingFileHandler(str(path), max_bytes=100, backup_count=2, rotate_sec=0)
+    for i in range(8):
+        handler.handle(_record(i))
+    handler.close()
+    # every line is 13 bytes: the 51 bytes already there plus three lines fill the first file
+    assert path.with_name("test.log.1").read_text().count("\n") == 4
+    assert path.read_text().count("\n") == 5
@@ -0,0 +1,58 @@
+import random
+
+import pytest
+
+import TsPositionEngine
+from TsLayout import TsLayout
+from TsPositionEngine import NO_PIXEL, PositionBatch, TsPositionEngine as Engine
+
+
+def _random_batch(layout: TsLayout, rng: random.Random, size: int) -> PositionBatch:
+    batch = PositionBatch()
+    directions = (layout.outbound_direction, layout.return_direction)
+    for i in range(size):
+        direction = rng.choice(directions)
+        stop_pixels = layout.pixels_for_direction(direction)
+        station_pixel = rng.choice(stop_pixels)
+        offset = rng.choice((0, 0, rng.uniform(0, 300)))
+        previous = rng.choice((NO_PIXEL, station_pixel + rng.randint(-4, 4)))
+        fixed = rng.choice((NO_PIXEL, NO_PIXEL, NO_PIXEL, rng.randint(-2, layout.num_pixels - 1)))
+        batch.append(f"trip {i}", direction, station_pixel, offset, rng.uniform(0, 240), previous, fixed)
+    return batch
+
+
+def _rows(result) -> list:
+    valid = [bool(v) for v in result.valid]
+    pixels = list(result.pixels)
+    stopped = [bool(s) for s in result.stopped]
+    # pixels of trains that aren't drawn are undefined
+    return [(pixels[i], stopped[i]) if valid[i] else None for i in range(len(valid))]
+
+
+@pytest.mark.skipif(not TsPositionEngine.HAVE_NUMPY, reason="numpy isn't installed")
+@pytest.mark.parametrize("seed", range(20))
+def test_numpy_and_python_agree(seed):
+    layout = TsLayout.load("1_line")
+    rng = random.Random(seed)
+    batch = _random_batch(layout, rng, rng.choice((0, 1, 7, 200)))
+    with_numpy = Engine(layout, use_numpy=True).compute(batch)
+    without_numpy = Engine(layout, use_numpy=False).compute(batch)
+    assert _rows(with_numpy) == _rows(without_numpy)
+    assert list(with_numpy.collisions) == list(without_numpy.collisions)
+
+
+def test_segment_thresholds_and_clamp():
+    layout = TsLayout.load("1_line")
+    station = max(layout.pixels_for_direction(layout.outbound_direction))
+    batch = PositionBatch()
+    batch.append("at station", layout.outbound_direction, station, 0, 100)
+    batch.append("near", layout.outbound_direction, station, 5, 100)
+    batch.append("mid", layout.outbound_direction, station, 30, 100)
+    batch.append("far", layout.outbound_direction, station, 90, 100)
+    # was drawn further on last poll and the server is close to it, so it doesn't step back
+    batch.append("clamped", layout.outbound_direction, station, 90, 100, previous_pixel=station)
+    # the server is far from where it was, the server wins
+    batch.append("jumped", layout.outbound_direction, station, 90, 100, previous_pixel=station - 10)
+    result = Engine(layout, use_numpy=False).compute(batch)
+    assert list(result.pixels) == [station, station, station - 1, station - 2, station, station - 2]
+    assert bool(result.stopped[0]) and not any(result.stopped[1:])
@@ -0,0 +1,55 @@
+import cProfile
+
+import pytest
+
+from TsProfiler import TsProfiler
+
+
+class _BusyProfile(cProfile.Profile):
+    def enable(self, *args, **kwargs):
+        raise ValueError("Another profiling tool is already active")
+
+
+def test_cycle_runs_when_profiler_cannot_be_enabled(tmp_path, monkeypatch):
+    monkeypatch.setattr(cProfile, "Profile", _BusyProfile)
+    profiler = TsProfiler(str(tmp_path), cycles=2, snapshot_sec=0)
+    ran = []
+    for _ in range(3):
+        with profiler.profile("render"):
+            ran.append(True)
+    assert ran == [True] * 3
+    assert profiler.skipped_cycles == 3
+
+
+def test_stage_errors_still_propagate(tmp_path, monkeypatch):
+    monkeypatch.setattr(cProfile, "Profile", _BusyProfile)
+    profiler = TsProfiler(str(tmp_path), cycles=2, snapshot_sec=0)
+    with pytest.raises(KeyError):
+        with profiler.profile("fetch"):
+            raise KeyError("boom")
+
+
+def test_writes_a_report_every_window(tmp_path):
+    profiler = TsProfiler(str(tmp_path), cycles=2, snapshot_sec=0)
+    for _ in range(4):
+        with profiler.profile("render"):
+            sum(range(1000))
+    assert sorted(path.name for path in tmp_path.glob("cpu-render-*.txt")) == [
+        "cpu-render-0000.txt", "cpu-render-0001.txt"]
+
+
+def test_report_covers_the_line_engine(tmp_path):
+    from StReferenceCache import StReferenceCache
+    from TsHeadlessLine import TsHeadlessLine
+    from TsLayout import TsLayout
+    from StApiDecoder import decode_trips_for_route
+    from testing import fixtures
+
+    line = TsHeadlessLine("test", TsLayout.load("1_line"), reference_cache=StReferenceCache())
+    feed = decode_trips_for_route(fixtures.make_trips_for_route_bytes(20))
+    profiler = TsProfiler(str(tmp_path), cycles=1, snapshot_sec=0)
+    with profiler.profile("render"):
+        line.update_feed(feed)
+    report = (tmp_path / "cpu-render-0000.txt").read_text()
+    assert "TsLineEngine.py:" in report
+    assert "TsPositionEngine.py:" in report
@@ -0,0 +1,95 @@
+import random
+from collections import Counter
+
+from StReferenceCache import StReferenceCache
+
+
+def _assert_consistent(cache: StReferenceCache):
+    """
+    Every live handle is counted exactly as often as the tables refer to it, and released handles are free
+    """
+    refs = Counter()
+    for stop, entry in cache._stop_names.items():
+        refs[stop] += 1
+        refs[entry[0]] += 1
+    for trip in cache._trip_directions:
+        refs[trip] += 1
+    for trip, entry in cache._travel_times.items():
+        refs[trip] += 1
+        refs.update(entry[0].keys())
+    live = {handle for handle, string in enumerate(cache._strings) if string is not None}
+    assert set(refs) == live
+    assert all(cache._refs[handle] == refs[handle] for handle in live)
+    assert all(cache._handles[cache._strings[handle]] == handle for handle in live)
+    assert len(cache._handles) == len(live)
+    assert set(cache._free) == set(range(len(cache._strings))) - live
+
+
+def test_shared_names_are_stored_once():
+    cache = StReferenceCache()
+    cache.merge_stops({"40_1": "Westlake", "40_2": "Westlake"}, now=0)
+    cache.merge_stops({"40_1": "Westlake"}, now=1)
+    assert cache.stop_name("40_1") is cache.stop_name("40_2")
+    assert cache.sizes()["strings"] == 3
+    _assert_consistent(cache)
+
+
+def test_renamed_stop_releases_old_name():
+    cache = StReferenceCache()
+    cache.merge_stops({"40_1": "Old Name"}, now=0)
+    cache.merge_stops({"40_1": "New Name"}, now=1)
+    assert cache.stop_name("40_1") == "New Name"
+    assert cache.handle("Old Name") is None
+    _assert_consistent(cache)
+
+
+def test_evicted_handles_are_reused():
+    cache = StReferenceCache(ttl_sec=10)
+    cache.merge_trips({"trip a": 0, "trip b": 1}, now=0)
+    handles = {cache.handle("trip a"), cache.handle("trip b")}
+    # new entries go in before the expired ones are evicted
+    cache.merge_trips({"trip c": 0}, now=100)
+    assert cache.trip_direction("trip a") is None
+    cache.merge_trips({"trip d": 1, "trip e": 0}, now=101)
+    assert {cache.handle("trip d"), cache.handle("trip e")} == handles
+    assert len(cache._strings) == 3
+    _assert_consistent(cache)
+
+
+def test_travel_times_are_keyed_by_stop():
+    cache = StReferenceCache()
+    schedule = (("s1", 100, 130, None), ("s2", 250, 260, None), ("s3", 400, 400, None))
+    assert cache.travel_time("trip", "s2", schedule, now=0) == 150
+    assert cache.travel_time("trip", "s1", now=1) == 30
+    assert cache.travel_time("trip", "nowhere", now=1) is None
+    assert cache.travel_time("other trip", "s1", now=1) is None
+    _assert_consistent(cache)
+
+
+def test_refcounts_stay_consistent_under_churn():
+    rng = random.Random(1)
+    cache = StReferenceCache(ttl_sec=50, max_entries=30)
+    now = 0.0
+    for _ in range(2000):
+        now += rng.random() * 2
+        cache.merge_stops({f"S{rng.randrange(60)}": f"Name {rng.randrange(20)}" for _ in range(5)}, now)
+        cache.merge_trips({f"T{rng.randrange(200)}": rng.randrange(2) for _ in range(5)}, now)
+        schedule = tuple((f"S{rng.randrange(60)}", i * 100, i * 100 + 20, None) for i in range(rng.randrange(1, 6)))
+        cache.travel_time(f"T{rng.randrange(200)}", schedule[0][0], schedule, now)
+    _assert_consistent(cache)
+    # bounded by the live entries, not by everything ever seen
+    assert len(cache._strings) < 200
+    assert all(size <= 30 for name, size in cache.sizes().items() if name != "strings")
+
+
+def test_export_and_restore_round_trip():
+    cache = StReferenceCache()
+    cache.merge_stops({"s1": "One", "s2": "Two"}, now=100)
+    cache.merge_trips({"trip": 1}, now=100)
+    cache.travel_time("trip", "s2", (("s1", 0, 10, None), ("s2", 60, 70, None)), now=100)
+    restored = StReferenceCache()
+    restored.restore_state(cache.export_state(), now=110)
+    assert restored.export_state() == cache.export_state()
+    assert restored.stop_name("s2") == "Two"
+    assert restored.travel_time("trip", "s2", now=110) == 60
+    _assert_consistent(restored)
@@ -0,0 +1,84 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+import pytest
+
+from TsScheduler import Backoff, TokenBucket, TsPollScheduler, parse_retry_after
+
+
+@pytest.mark.parametrize("rate", [0, -1.0])
+def test_token_bucket_rejects_non_positive_rate(rate):
+    with pytest.raises(ValueError):
+        TokenBucket(rate=rate, burst=5)
+
+
+def test_token_bucket_rejects_empty_burst():
+    with pytest.raises(ValueError):
+        TokenBucket(rate=1.0, burst=0)
+
+
+class _Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("120", 120.0),
+    (" 5 ", 5.0),
+    ("-3", 0.0),
+    ("Wed, 21 Oct 2026 07:28:30 GMT", 30.0),
+    ("Wed, 21 Oct 2026 07:27:00 GMT", 0.0),
+    ("soon", None),
+    ("", None),
+    (None, None),
+])
+def test_parse_retry_after(value, expected):
+    now = parsedate_to_datetime("Wed, 21 Oct 2026 07:28:00 GMT").timestamp()
+    assert parse_retry_after(value, now) == expected
+
+
+def test_token_bucket_spends_burst_then_refills(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(time, "monotonic", clock)
+    bucket = TokenBucket(rate=2.0, burst=3)
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+    assert bucket.time_until_available() == pytest.approx(0.5)
+    clock.now += 0.5
+    assert bucket.time_until_available() == 0.0
+    assert bucket.try_acquire()
+    # never holds more than the burst, however long it sits idle
+    clock.now += 3600
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+
+
+def test_backoff_ceiling_doubles_up_to_cap():
+    class _Max(random.Random):
+        def uniform(self, a, b):
+            return b
+
+    backoff = Backoff(base_sec=2.0, cap_sec=10.0, rng=_Max())
+    assert [backoff.failure() for _ in range(5)] == [2.0, 4.0, 8.0, 10.0, 10.0]
+    backoff.success()
+    assert backoff.failure() == 2.0
+
+
+def test_scheduler_honors_retry_after_and_backoff():
+    scheduler = TsPollScheduler(min_period_sec=5, max_period_sec=60, rate_limiter=TokenBucket(rate=100, burst=5),
+                                backoff=Backoff(base_sec=20, cap_sec=20, rng=random.Random(1)))
+    now = 1000.0
+    assert scheduler.next_delay(now) == 5
+    assert scheduler.record_retry_after("30", now) == 30
+    assert scheduler.next_delay(now) == pytest.approx(30)
+    assert scheduler.record_retry_after("garbage", now) == TsPollScheduler.DEFAULT_RETRY_AFTER_SEC
+    assert scheduler.next_delay(now) == pytest.approx(TsPollScheduler.DEFAULT_RETRY_AFTER_SEC)
+
+    scheduler = TsPollScheduler(min_period_sec=5, max_period_sec=60, rate_limiter=TokenBucket(rate=100, burst=5),
+                                backoff=Backoff(base_sec=20, cap_sec=20, rng=random.Random(1)))
+    wait = scheduler.record_error(now)
+    assert scheduler.next_delay(now) == pytest.approx(max(5, wait))
+    scheduler.record_success("endpoint", now=now)
+    assert scheduler.next_delay(now) == 5
@@ -0,0 +1,46 @@
+from StApiDecoder import decode_trips_for_route
+from StReferenceCache import StReferenceCache
+from TsHeadlessLine import TsHeadlessLine
+from TsLayout import TsLayout
+from TsSnapshot import TsSnapshot
+from testing import fixtures
+
+
+def _snapshot_with_line(tmp_path, min_interval_sec: float):
+    cache = StReferenceCache()
+    line = TsHeadlessLine("test", TsLayout.load("1_line"), reference_cache=cache)
+    snapshot = TsSnapshot(str(tmp_path / "snapshot.json"), cache, min_interval_sec=min_interval_sec)
+    snapshot.add_line(line)
+    writes = []
+    write = snapshot._write
+    snapshot._write = lambda data: (writes.append(data), write(data))
+    return snapshot, line, writes
+
+
+def _feed(seed: int):
+    return decode_trips_for_route(fixtures.make_trips_for_route_bytes(10, seed=seed))
+
+
+def test_frames_within_the_interval_are_saved_on_close(tmp_path):
+    snapshot, line, writes = _snapshot_with_line(tmp_path, min_interval_sec=3600)
+    line.update_feed(_feed(1), now=1000.0)
+    line.update_feed(_feed(2), now=1001.0)
+    line.update_feed(_feed(3), now=1002.0)
+    snapshot.close()
+    # the first frame's save and the one on close, which the writer may have coalesced
+    assert 1 <= len(writes) <= 2
+    restored = TsSnapshot(str(tmp_path / "snapshot.json"), StReferenceCache())
+    restored_line = TsHeadlessLine("test", TsLayout.load("1_line"), reference_cache=StReferenceCache())
+    restored.add_line(restored_line)
+    assert restored.restore(now=1010.0) == 1
+    assert restored_line.engine.frame.positions == line.engine.frame.positions
+    restored.close()
+
+
+def test_unchanged_state_is_not_rewritten(tmp_path):
+    snapshot, line, writes = _snapshot_with_line(tmp_path, min_interval_sec=0)
+    line.update_feed(_feed(1), now=1000.0)
+    snapshot.save()
+    snapshot.save()
+    snapshot.close()
+    assert len(writes) == 1
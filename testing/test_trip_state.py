@@ -0,0 +1,47 @@
+from TsPositionEngine import NO_PIXEL
+from TsTripState import NO_DIRECTION, TsTripStateStore
+
+
+def test_stale_trips_are_evicted_and_slots_reused():
+    store = TsTripStateStore(num_pixels=10, max_age_sec=60, capacity=4)
+    old = store.slot_for("old", 0.0)
+    store.record(old, 5, 1)
+    store.slot_for("fresh", 50.0)
+    assert store.evict_stale(100.0) == 1
+    assert "old" not in store and "fresh" in store
+    assert store.previous_pixel("old") == NO_PIXEL
+    # the freed slot comes back cleared
+    assert store.slot_for("new", 100.0) == old
+    assert store.last_pixel[old] == NO_PIXEL
+    assert store.direction[old] == NO_DIRECTION
+
+
+def test_grows_then_evicts_least_recently_seen_at_max_capacity():
+    store = TsTripStateStore(num_pixels=10, max_age_sec=3600, capacity=2, max_capacity=4)
+    for i in range(4):
+        store.slot_for(f"trip {i}", float(i))
+    assert store.capacity == 4 and len(store) == 4
+    store.slot_for("trip 0", 10.0)
+    store.slot_for("trip 4", 11.0)
+    assert store.capacity == 4 and len(store) == 4
+    assert "trip 1" not in store
+    assert all(f"trip {i}" in store for i in (0, 2, 3, 4))
+
+
+def test_allocation_evicts_stale_before_growing():
+    store = TsTripStateStore(num_pixels=10, max_age_sec=60, capacity=2, max_capacity=8)
+    store.slot_for("a", 0.0)
+    store.slot_for("b", 0.0)
+    store.slot_for("c", 100.0)
+    assert store.capacity == 2
+    assert "c" in store and len(store) == 1
+
+
+def test_export_and_restore_drop_stale_trips():
+    store = TsTripStateStore(num_pixels=10, max_age_sec=60)
+    store.record(store.slot_for("kept", 100.0), 3, 0)
+    store.record(store.slot_for("stale", 10.0), 4, 1)
+    restored = TsTripStateStore(num_pixels=10, max_age_sec=60)
+    restored.restore_state(store.export_state(), now=120.0)
+    assert "kept" in restored and "stale" not in restored
+    assert restored.previous_pixel("kept") == 3